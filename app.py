@@ -1,82 +1,265 @@
+import copy
+import hashlib
 import json
+import logging
 import os
 import time
 from datetime import datetime, timedelta
-from flask import Flask, jsonify, send_from_directory, request, abort, render_template, render_template
+from flask import Flask, jsonify, request, abort, render_template, render_template, g
+from flask import send_file, stream_with_context
+
+from change_feed import ChangeFeed, changed_tokens
+from collection_index import CollectionColumns, CollectionIndex, QueryError, query_from_args
+from guild_stats import GuildAggregator, guild_event, merge_guild_delta, success_rate
+from hero_state import US, WalletState
+from image_variants import ImageVariants, VariantError, pick_format, variant_version
+from journal import Journal, ds_changes, ds_snapshot
+from leaderboard import METRICS as LEADERBOARD_METRICS, SCOPES as LEADERBOARD_SCOPES, Leaderboard, hero_entry_id
+from metadata_pack import MetadataPack, normalize_base_metadata, pack_token_num
+from metrics import MultiprocessExporter, SlowRequestProfiler, REQUEST_SECONDS, count_bytes, span, timed
+from player_store import open_player_store
+from rarity import RarityEngine
+from read_cache import CachedRead, ReadCache
+from response_cache import ResponseCache
+from static_assets import ASSET_PREFIX, IMMUTABLE_MAX_AGE, AssetManifest, send_asset
+from progression import (
+    MISSIONS,
+    MISSIONS_BY_ID,
+    ROTATION_HOURS,
+    XP_COST_PER_ENERGY,
+    accrue_hero,
+    passive_epoch,
+    ts_to_epoch,
+)
+from state_commit import WalletLocks, atomic_write_json
+from stats_aggregator import StatsAggregator, merge_stats_delta
 
 # ---------------------------------
 # Config
 # ---------------------------------
 
 BASE_DIR     = os.path.dirname(__file__)
-DATA_DIR     = os.path.join(BASE_DIR, "data")
+DATA_DIR     = os.environ.get("EMBERHOLM_DATA_DIR", os.path.join(BASE_DIR, "data"))
 PLAYERS_PATH = os.path.join(DATA_DIR, "players.json")
 STATS_PATH   = os.path.join(DATA_DIR, "stats.json")
 GUILDS_PATH  = os.path.join(DATA_DIR, "guilds.json")
 
+# Backend de jugadores: "sqlite" (default), "memory" o "json" (players.json legacy)
+PLAYER_STORE_BACKEND = os.environ.get("EMBERHOLM_PLAYER_STORE", "sqlite")
+PLAYERS_DB_PATH      = os.environ.get("EMBERHOLM_PLAYERS_DB", os.path.join(DATA_DIR, "players.db"))
+
 # Carpeta donde guardaste los metadatas base (00001.json, 00002.json, etc.)
-METADATA_DIR = os.path.join(DATA_DIR, "metadata")
-
-# Ganancia pasiva cada 24h por héroe
-PASSIVE_XP_PER_DAY   = 5
-PASSIVE_AURA_PER_DAY = 1
-
-# Cada cuántas horas se refresca la energía natural completa
-ENERGY_FULL_REFRESH_HOURS = 48
-
-# Coste de RECOVER: cuánta XP cuesta recuperar 1 punto de energía
-XP_COST_PER_ENERGY = 5
-
-# En cuántas horas se resetea el cooldown de misión
-ROTATION_HOURS = 72
-
-# Misiones disponibles en la rotación actual
-MISSIONS = [
-    {
-        "id": "001",
-        "name": "The Lost Forge",
-        "difficulty": "EASY",
-        "energy_cost": 10,
-        "reward_xp": 25,
-        "reward_aura": 2,
-        "favored": "Forge Legion / Orc Warrior"
-    },
-    {
-        "id": "002",
-        "name": "Circle Interference Node",
-        "difficulty": "MEDIUM",
-        "energy_cost": 18,
-        "reward_xp": 60,
-        "reward_aura": 5,
-        "favored": "Circle of Mist / Human Wizard"
-    },
-    {
-        "id": "003",
-        "name": "Veil Breach Containment",
-        "difficulty": "HARD",
-        "energy_cost": 25,
-        "reward_xp": 120,
-        "reward_aura": 11,
-        "favored": "Echoes of the Veil / Necromancer"
-    }
-]
+METADATA_DIR = os.environ.get("EMBERHOLM_METADATA_DIR", os.path.join(DATA_DIR, "metadata"))
+
+# Locks entre workers (un archivo por franja de wallets)
+WALLET_LOCKS_DIR = os.path.join(DATA_DIR, "locks")
+
+# Pack compilado de METADATA_DIR (python metadata_pack.py build)
+METADATA_PACK_PATH = os.path.join(DATA_DIR, "metadata.pack")
+
+# Columnas de la colección para /api/collection/search (python collection_index.py build)
+COLLECTION_CACHE_PATH      = os.path.join(DATA_DIR, "collection.json")
+COLLECTION_RECHECK_SECONDS = float(os.environ.get("EMBERHOLM_COLLECTION_RECHECK_SECONDS", 300))
+COLLECTION_PER_PAGE_MAX    = 200
+
+# Rareza de traits / distribuciones de stats (derivado de las columnas de la colección)
+RARITY_CACHE_PATH = os.path.join(DATA_DIR, "rarity.json")
+
+# Cache HTTP (segundos): navegador (max-age) y CDN (s-maxage)
+METADATA_MAX_AGE     = int(os.environ.get("EMBERHOLM_METADATA_MAX_AGE", 60))
+METADATA_CDN_MAX_AGE = int(os.environ.get("EMBERHOLM_METADATA_CDN_MAX_AGE", 300))
+PLAYER_MAX_AGE       = int(os.environ.get("EMBERHOLM_PLAYER_MAX_AGE", 0))
+PLAYER_CDN_MAX_AGE   = int(os.environ.get("EMBERHOLM_PLAYER_CDN_MAX_AGE", 10))
+
+# Flush de contadores globales a stats.json / guilds.json: cada N segundos o cada N eventos
+# (0 segundos = escribir en cada request, como antes)
+STATS_FLUSH_SECONDS     = float(os.environ.get("EMBERHOLM_STATS_FLUSH_SECONDS", 5))
+STATS_FLUSH_MAX_PENDING = int(os.environ.get("EMBERHOLM_STATS_FLUSH_MAX_PENDING", 500))
+
+# Journal de eventos (data/journal/*.log): una línea por commit de wallet,
+# fsync agrupado cada N segundos. EMBERHOLM_JOURNAL_DIR="" lo apaga.
+JOURNAL_DIR           = os.environ.get("EMBERHOLM_JOURNAL_DIR", os.path.join(DATA_DIR, "journal"))
+JOURNAL_FSYNC_SECONDS = float(os.environ.get("EMBERHOLM_JOURNAL_FSYNC_SECONDS", 1))
+
+# Feed de tokens con dynamic_state cambiado (/api/metadata/changes), en
+# data/changes.db. EMBERHOLM_CHANGES_DB="" lo apaga.
+CHANGES_DB_PATH       = os.environ.get("EMBERHOLM_CHANGES_DB", os.path.join(DATA_DIR, "changes.db"))
+CHANGE_FEED_PAGE_MAX  = 1000
+
+# Lecturas calientes (/api/metadata/<id>, /api/player/<wallet>): pedidos
+# concurrentes iguales comparten un cálculo y el resultado queda N segundos
+# (0 = sólo coalescing, sin cache)
+READ_CACHE_TTL         = float(os.environ.get("EMBERHOLM_READ_CACHE_TTL", 2))
+READ_CACHE_MAX_ENTRIES = 4096
+READ_CACHE_MAX_BYTES   = 32 << 20
+
+# Máximo de tokens por llamada a /api/metadata/batch (el stream no tiene límite)
+METADATA_BATCH_MAX = 500
+
+# Media estática: assets con fingerprint (/assets/<digest>/...) son immutable;
+# el resto de static/ se cachea STATIC_MAX_AGE segundos.
+# EMBERHOLM_STATIC_SENDFILE: "" (send_file + Range), "x-sendfile" o "x-accel" (nginx)
+STATIC_MAX_AGE      = int(os.environ.get("EMBERHOLM_STATIC_MAX_AGE", 3600))
+STATIC_SENDFILE     = os.environ.get("EMBERHOLM_STATIC_SENDFILE", "")
+STATIC_ACCEL_PREFIX = os.environ.get("EMBERHOLM_STATIC_ACCEL_PREFIX", "/_static")
+
+# Variantes de imágenes (/variants/<ancho>/<ruta>): resize + webp/jpeg la
+# primera vez, cache en disco con tope LRU. Pre-armado: python image_variants.py warm
+VARIANTS_DIR      = os.environ.get("EMBERHOLM_VARIANTS_DIR", os.path.join(DATA_DIR, "variants"))
+VARIANTS_MAX_MB   = int(os.environ.get("EMBERHOLM_VARIANTS_MAX_MB", 512))
+GUILD_BADGE_WIDTH = 128  # el badge se ve a 64px; 2x para pantallas densas
+
+# Métricas: snapshots por worker para /metrics y cProfile muestreado
+# (EMBERHOLM_PROFILE_SAMPLE=0.01 perfila 1 de cada 100 requests; se guardan
+# en data/profiles los que tardan más de EMBERHOLM_PROFILE_SLOW_MS)
+METRICS_DIR         = os.environ.get("EMBERHOLM_METRICS_DIR", os.path.join(DATA_DIR, "metrics"))
+METRICS_DUMP_SECONDS = float(os.environ.get("EMBERHOLM_METRICS_DUMP_SECONDS", 5))
+PROFILE_DIR         = os.path.join(DATA_DIR, "profiles")
+PROFILE_SAMPLE_RATE = float(os.environ.get("EMBERHOLM_PROFILE_SAMPLE", 0))
+PROFILE_SLOW_MS     = float(os.environ.get("EMBERHOLM_PROFILE_SLOW_MS", 500))
+
+# Máximo de pares (héroe, misión) por llamada a /api/mission/batch
+MISSION_BATCH_MAX = 100
+
+# Leaderboard: cada cuánto un worker trae las wallets que escribieron los otros
+LEADERBOARD_SYNC_SECONDS = float(os.environ.get("EMBERHOLM_LEADERBOARD_SYNC_SECONDS", 2))
+LEADERBOARD_PER_PAGE_MAX = 100
 
 # ---------------------------------
 # Helpers de lectura/escritura JSON
 # ---------------------------------
 
+log = logging.getLogger(__name__)
+
+@timed("load_json")
 def load_json(path, fallback):
     if not os.path.exists(path):
         return fallback
-    with open(path, "r", encoding="utf-8") as f:
+    with open(path, "rb") as f:
+        raw = f.read()
+        count_bytes(path, "read", len(raw))
         try:
-            return json.load(f)
+            return json.loads(raw)
         except json.JSONDecodeError:
+            # con escrituras atómicas esto ya no es un archivo a medio escribir:
+            # es corrupción real, que quede en el log en vez de pasar en silencio
+            log.error("corrupt state file %s, using fallback", path)
             return fallback
 
+@timed("save_json")
 def save_json(path, obj):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(obj, f, indent=4)
+    """Escritura atómica (temporal + rename) con la política de fsync configurada."""
+    atomic_write_json(path, obj, indent=4)
+
+# ---------------------------------
+# Locks de commit
+# ---------------------------------
+#
+# Un request sólo toma el lock de su wallet: stats.json y guilds.json
+# no se tocan en el request (write-behind, ver stats_aggregator).
+# Todo read-modify-write de estado corre dentro de estos locks, así
+# gunicorn puede levantar varios workers/threads sin perder updates.
+
+wallet_lock = WalletLocks(WALLET_LOCKS_DIR).lock
+
+# ---------------------------------
+# stats.json con write-behind
+# ---------------------------------
+
+stats_aggregator = StatsAggregator(
+    STATS_PATH,
+    flush_seconds=STATS_FLUSH_SECONDS,
+    max_pending=STATS_FLUSH_MAX_PENDING,
+)
+
+# guilds.json: agregados por gremio con el mismo write-behind
+guild_stats = GuildAggregator(
+    GUILDS_PATH,
+    flush_seconds=STATS_FLUSH_SECONDS,
+    max_pending=STATS_FLUSH_MAX_PENDING,
+)
+
+
+def record_deltas(stats_delta):
+    """Reparte el delta del request: "guilds" al agregado de gremios, el resto a stats."""
+    guild_stats.add(stats_delta.pop("guilds", None))
+    stats_aggregator.add(stats_delta)
+
+def merge_delta(target, delta):
+    """Suma el delta de un evento al del request (numéricos + "guilds")."""
+    merge_stats_delta(target, delta)
+    if delta.get("guilds"):
+        merge_guild_delta(target.setdefault("guilds", {}), delta["guilds"])
+    return target
+
+# ---------------------------------
+# Repositorio de jugadores (una wallet por lectura/escritura)
+# ---------------------------------
+
+player_store = open_player_store(PLAYER_STORE_BACKEND, PLAYERS_PATH, PLAYERS_DB_PATH)
+
+# guilds.json viejo: miembros y sumas se recalculan desde los héroes del store
+# (open_player_store vuelve con players.json ya migrado, aunque lo migre otro worker)
+guild_stats.upgrade(load_json(STATS_PATH, {}).get("guild_ranking"), player_store.iter_heroes)
+
+# Metadata base compartida entre workers vía mmap
+metadata_pack = MetadataPack(METADATA_PACK_PATH)
+
+# Búsqueda por traits: columnas de metadata base + bitmaps por valor
+collection_columns = CollectionColumns(
+    metadata_pack, METADATA_DIR, COLLECTION_CACHE_PATH, recheck_seconds=COLLECTION_RECHECK_SECONDS
+)
+collection_index = CollectionIndex(collection_columns)
+rarity = RarityEngine(collection_columns, RARITY_CACHE_PATH)
+# carga al importar (cada worker, o el master con --preload): el primer
+# tokenURI no paga la lectura de columnas; el re-chequeo va en segundo plano
+rarity.warm()
+
+# JSON ya serializado + gzip/br de /api/stats, /api/guilds y /api/missions
+response_cache = ResponseCache()
+
+# ETag + cuerpo de metadata / perfil por token o wallet (single-flight + TTL)
+metadata_reads = ReadCache("metadata", READ_CACHE_TTL, READ_CACHE_MAX_ENTRIES, READ_CACHE_MAX_BYTES)
+player_reads   = ReadCache("player", READ_CACHE_TTL, READ_CACHE_MAX_ENTRIES, READ_CACHE_MAX_BYTES)
+
+# Ranking de wallets/héroes, actualizado por wallet en cada commit
+leaderboard = Leaderboard(player_store, sync_seconds=LEADERBOARD_SYNC_SECONDS)
+
+
+# Eventos de cada commit (misión, compra de energía, pasivo); ver journal.py
+journal = Journal(JOURNAL_DIR, fsync_seconds=JOURNAL_FSYNC_SECONDS) if JOURNAL_DIR else None
+if journal is not None:
+    journal.ensure_genesis(lambda: {
+        "players": dict(player_store.iter_players()),
+        "stats":   load_json(STATS_PATH, {}),
+        "guilds":  load_json(GUILDS_PATH, []),
+    })
+
+# Tokens cuyo dynamic_state cambió, para /api/metadata/changes; ver change_feed.py
+change_feed = ChangeFeed(CHANGES_DB_PATH) if CHANGES_DB_PATH else None
+
+
+@timed("save_player")
+def save_player(wallet, player_obj):
+    """Commit de la wallet + su posición en el leaderboard (O(h log n))."""
+    player_store.put_player(wallet, player_obj)
+    leaderboard.update_player(wallet, player_obj)
+
+
+def commit_player(wallet, player_obj, stats_delta, events):
+    """
+    Fin de un request que escribe: commit de la wallet, sus eventos al
+    journal (una línea, después del commit), los tokens tocados al feed de
+    cambios y el delta a los agregadores.
+    """
+    save_player(wallet, player_obj)
+    metadata_reads.invalidate(*(h.get("token_id") for h in player_obj.get("heroes", [])))
+    player_reads.invalidate(wallet)
+    if journal is not None:
+        journal.commit(wallet, player_obj, events)
+    if change_feed is not None:
+        change_feed.append(changed_tokens(events))
+    record_deltas(stats_delta)
 
 # ---------------------------------
 # Helpers de tiempo
@@ -85,71 +268,122 @@ def save_json(path, obj):
 def now_utc_str():
     return datetime.utcnow().isoformat() + "Z"
 
-def hours_since(ts_str):
-    """Devuelve cuántas horas pasaron desde ts_str (ISO) hasta ahora."""
+def parse_utc(ts_str):
+    """ISO "2025-10-28T14:06:53.255261Z" -> datetime naive UTC (o None)."""
     if not ts_str:
-        return 999999
+        return None
     try:
-        clean = ts_str.replace("Z", "")
-        t = datetime.fromisoformat(clean)
+        return datetime.fromisoformat(ts_str.replace("Z", ""))
     except Exception:
-        return 999999
-    delta = datetime.utcnow() - t
-    return delta.total_seconds() / 3600.0
+        return None
+
+# ---------------------------------
+# Versionado de estado (ETag / Last-Modified)
+# ---------------------------------
+
+def bump_state_version(player_obj, hero):
+    """
+    Cada cambio de estado de un héroe sube su state_version y la de su wallet.
+    Los ETag de /api/metadata y /api/player salen de estos contadores.
+    """
+    ds = hero.setdefault("dynamic_state", {})
+    ds["state_version"]         = ds.get("state_version", 0) + 1
+    player_obj["state_version"] = player_obj.get("state_version", 0) + 1
+
+def make_etag(*parts):
+    return hashlib.sha1("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:24]
+
+def not_modified(etag, max_age, cdn_max_age):
+    """Devuelve un 304 si el cliente ya tiene esta versión, si no None."""
+    if not request.if_none_match.contains(etag):
+        return None
+    resp = app.response_class(status=304)
+    set_cache_headers(resp, etag, None, max_age, cdn_max_age)
+    return resp
+
+def client_has_etag(etag):
+    """If-None-Match ya trae esta versión (ReadCache no arma el cuerpo)."""
+    return request.if_none_match.contains(etag)
+
+def cached_read_response(entry, max_age, cdn_max_age):
+    """Respuesta (o 304) a partir de un CachedRead (sin cuerpo si el cliente ya lo tiene)."""
+    cached = not_modified(entry.etag, max_age, cdn_max_age)
+    if cached is not None:
+        return cached
+    resp = app.response_class(entry.body, mimetype="application/json")
+    set_cache_headers(resp, entry.etag, entry.last_modified, max_age, cdn_max_age)
+    return resp.make_conditional(request)
+
+def set_cache_headers(resp, etag, last_modified, max_age, cdn_max_age):
+    resp.set_etag(etag)
+    if last_modified is not None:
+        resp.last_modified = last_modified
+    resp.cache_control.public   = True
+    resp.cache_control.max_age  = max_age
+    resp.cache_control.s_maxage = cdn_max_age
+    return resp
 
 # ---------------------------------
 # Progresión pasiva + regeneración de energía
 # ---------------------------------
 
-def apply_passive_and_regen(player_obj, stats_obj):
+@timed("apply_passive_and_regen")
+def apply_passive_and_regen(player_obj, stats_obj, now=None, events=None):
     """
-    - Goteo pasivo XP/Aura cada 24h.
-    - Regeneración completa de energía cada 48h.
+    - Goteo pasivo XP/Aura: un tick por cada 24h completas desde passive_anchor.
+    - Regeneración completa de energía cada 48h desde last_energy_refresh.
     - Recalcula totales del jugador.
-    - Acumula XP/Aura global en stats.json.
+    - Acumula XP/Aura global en stats_obj (el delta que se suma a stats.json)
+      y el goteo de cada gremio (xp_sum / aura_sum) en stats_obj["guilds"].
+    - Cada tick sube state_version del héroe y de la wallet.
+    - events (lista) recibe un evento "passive" por héroe que cambió.
+    Muta player_obj: sólo lo llaman los endpoints que escriben.
+    Para lecturas usar effective_player().
     """
+    now = time.time() if now is None else now
+    stats_obj.setdefault("total_exp_collected", 0)
+    stats_obj.setdefault("total_aura_collected", 0)
+
+    for slot, hero in enumerate(player_obj.get("heroes", [])):
+        ds = hero.setdefault("dynamic_state", {})
+        before = ds_snapshot(ds) if events is not None else None
+
+        xp_gain, aura_gain, changed = accrue_hero(ds, now)
+        delta = {}
+        if changed:
+            delta["total_exp_collected"]  = xp_gain
+            delta["total_aura_collected"] = aura_gain
+            bump_state_version(player_obj, hero)
+            if xp_gain or aura_gain:
+                # sólo las sumas (avg_xp / avg_aura): xp_gained / aura_gained, que
+                # ordenan el ranking, son de misiones y no dependen de cuándo escribe
+                # una wallet inactiva
+                guild_event(
+                    delta, hero.get("guild") or ds.get("current_guild"),
+                    xp_sum=xp_gain, aura_sum=aura_gain,
+                )
+            merge_delta(stats_obj, delta)
+
+        if events is not None:
+            # también el passive_anchor que accrue_hero fija en héroes viejos
+            changes = ds_changes(before, ds)
+            if changes:
+                events.append({"k": "passive", "i": slot, "h": hero.get("token_id"), "ds": changes, "d": delta})
+
+    recompute_totals(player_obj)
+    return player_obj, stats_obj
+
+def recompute_totals(player_obj):
+    """Totales de la wallet a partir del estado actual de sus héroes."""
     heroes = player_obj.get("heroes", [])
     wallet_tot_xp = 0
     wallet_tot_aura = 0
     wallet_tot_energy_avail = 0
-
-    changed_global_xp = 0
-    changed_global_aura = 0
-
     for hero in heroes:
-        ds = hero.setdefault("dynamic_state", {})
-        xp_total        = ds.get("xp_total", 0)
-        aura_level      = ds.get("aura_level", 0)
-        energy_current  = ds.get("energy_current", 100)
-        energy_max      = ds.get("energy_max", 100)
-        last_update     = ds.get("last_update")
-        last_energy_ref = ds.get("last_energy_refresh")
-
-        # Goteo pasivo cada 24h
-        if hours_since(last_update) >= 24:
-            xp_total   += PASSIVE_XP_PER_DAY
-            aura_level += PASSIVE_AURA_PER_DAY
-
-            changed_global_xp   += PASSIVE_XP_PER_DAY
-            changed_global_aura += PASSIVE_AURA_PER_DAY
-
-            ds["last_update"] = now_utc_str()
-
-        # Regen natural de energía cada 48h
-        if hours_since(last_energy_ref) >= ENERGY_FULL_REFRESH_HOURS:
-            energy_current = energy_max
-            ds["last_energy_refresh"] = now_utc_str()
-
-        ds["xp_total"]       = xp_total
-        ds["aura_level"]     = aura_level
-        ds["energy_current"] = energy_current
-
-        wallet_tot_xp            += xp_total
-        wallet_tot_aura          += aura_level
-        wallet_tot_energy_avail  += energy_current
-
-    stats_obj["total_exp_collected"]  = stats_obj.get("total_exp_collected", 0) + changed_global_xp
-    stats_obj["total_aura_collected"] = stats_obj.get("total_aura_collected", 0) + changed_global_aura
+        ds = hero.get("dynamic_state", {})
+        wallet_tot_xp            += ds.get("xp_total", 0)
+        wallet_tot_aura          += ds.get("aura_level", 0)
+        wallet_tot_energy_avail  += ds.get("energy_current", 100)
 
     player_obj["totals"] = {
         "heroes_count": len(heroes),
@@ -157,8 +391,26 @@ def apply_passive_and_regen(player_obj, stats_obj):
         "aura_total_all": wallet_tot_aura,
         "energy_total_available": wallet_tot_energy_avail
     }
+    return player_obj
 
-    return player_obj, stats_obj
+def effective_player(player_obj, now=None):
+    """
+    Vista del jugador con el pasivo/regen acumulado hasta now, sin persistir nada.
+    El estado real se materializa recién en el próximo endpoint que escribe.
+    """
+    view = copy.deepcopy(player_obj)
+    apply_passive_and_regen(view, {}, now)
+    return view
+
+def heroes_by_token(player_obj):
+    """token_id -> héroe (el primero si hay repetidos), un solo recorrido por request."""
+    index = {}
+    for hero in player_obj.get("heroes", []):
+        index.setdefault(hero.get("token_id"), hero)
+    return index
+
+def player_passive_epoch(player_obj, now):
+    return tuple(passive_epoch(h.get("dynamic_state", {}), now) for h in player_obj.get("heroes", []))
 
 # ---------------------------------
 # Ranking y stats de gremios
@@ -166,39 +418,16 @@ def apply_passive_and_regen(player_obj, stats_obj):
 
 def update_guild_stats(guild_name, xp_gain, aura_gain, stats_obj):
     """
-    - Suma XP/Aura ganadas por ese gremio a stats["guild_ranking"].
-    - Refleja actividad en guilds.json (members, avg_xp, avg_aura).
+    Misión resuelta por un héroe del gremio: suma al delta del request
+    (stats_obj["guilds"]) la XP/Aura ganadas y el éxito. O(1), sin I/O:
+    guilds.json se reescribe en el próximo snapshot del agregador.
     """
-    if not guild_name:
-        return stats_obj
-
-    # 1) stats["guild_ranking"]
-    guild_ranking = stats_obj.get("guild_ranking", {})
-    if guild_name not in guild_ranking:
-        guild_ranking[guild_name] = {
-            "xp": 0,
-            "aura": 0,
-            "successes": 0,
-            "failures": 0
-        }
-
-    guild_ranking[guild_name]["xp"]   += xp_gain
-    guild_ranking[guild_name]["aura"] += aura_gain
-    stats_obj["guild_ranking"] = guild_ranking
-
-    # 2) guilds.json
-    guilds_data = load_json(GUILDS_PATH, [])
-    for g in guilds_data:
-        if g.get("name","").lower() == guild_name.lower():
-            current_members = g.get("members", 0)
-            if current_members < 1:
-                current_members = 1
-            g["members"]  = current_members
-            g["avg_xp"]   = round(g.get("avg_xp", 0)   + xp_gain,   2)
-            g["avg_aura"] = round(g.get("avg_aura", 0) + aura_gain, 2)
-    save_json(GUILDS_PATH, guilds_data)
-
-    return stats_obj
+    return guild_event(
+        stats_obj, guild_name,
+        xp_sum=xp_gain, aura_sum=aura_gain,
+        xp_gained=xp_gain, aura_gained=aura_gain,
+        successes=1,
+    )
 
 # ---------------------------------
 # Flask App
@@ -209,18 +438,126 @@ app = Flask(
     static_folder="static",
     static_url_path=""  # sirve /img/... /music/... directo
 )
+app.config["SEND_FILE_MAX_AGE_DEFAULT"] = STATIC_MAX_AGE
+app.use_x_sendfile = STATIC_SENDFILE == "x-sendfile"
+
+assets = AssetManifest(app.static_folder)
+image_variants = ImageVariants(app.static_folder, VARIANTS_DIR, VARIANTS_MAX_MB << 20)
+
+# ---------------------------------
+# Instrumentación por request
+# ---------------------------------
+
+metrics_exporter = MultiprocessExporter(METRICS_DIR, dump_seconds=METRICS_DUMP_SECONDS)
+profiler = SlowRequestProfiler(PROFILE_DIR, sample_rate=PROFILE_SAMPLE_RATE, slow_seconds=PROFILE_SLOW_MS / 1000.0)
+
+@app.before_request
+def _metrics_start():
+    g.metrics_t0 = time.perf_counter()
+    g.metrics_profile = profiler.start()
+
+@app.after_request
+def _metrics_stop(resp):
+    # en respuestas streaming (NDJSON) esto mide hasta el primer byte
+    t0 = g.get("metrics_t0")
+    if t0 is None:
+        return resp
+    elapsed = time.perf_counter() - t0
+    route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    REQUEST_SECONDS.observe(elapsed, request.method, route, resp.status_code)
+    if g.metrics_profile is not None:
+        profiler.stop(g.metrics_profile, elapsed, f"{request.method} {route}")
+    metrics_exporter.maybe_dump()
+    return resp
+
+@app.route("/metrics")
+def serve_metrics():
+    """Texto Prometheus con la suma de todos los workers."""
+    return app.response_class(metrics_exporter.render(), mimetype="text/plain; version=0.0.4")
 
 # ---------------------------------
 # Rutas estáticas base
 # ---------------------------------
 
+def page_version(path):
+    st = os.stat(path)
+    return assets.version, st.st_mtime_ns, st.st_size
+
 @app.route("/")
 def serve_index():
-    return send_from_directory(app.static_folder, "index.html")
+    # HTML con URLs de assets con fingerprint, ya comprimido (gzip/br)
+    path = os.path.join(app.static_folder, "index.html")
+
+    def build():
+        with open(path, "r", encoding="utf-8") as f:
+            return assets.rewrite(f.read())
+
+    return response_cache.respond("page:index", page_version(path), build, mimetype="text/html")
 @app.route("/mint")
 def serve_mint():
     # mint.html está en la carpeta raíz del proyecto (C:\EmberholmServer)
-    return render_template("mint.html")
+    path = os.path.join(app.root_path, app.template_folder, "mint.html")
+    return response_cache.respond(
+        "page:mint", page_version(path),
+        lambda: assets.rewrite(render_template("mint.html")),
+        mimetype="text/html",
+    )
+
+@app.route(f"{ASSET_PREFIX}/<digest>/<path:filename>")
+def serve_asset(digest, filename):
+    """
+    Asset con fingerprint: immutable por un año. Si el digest no coincide
+    (HTML viejo de un deploy anterior) se sirve el archivo actual sin immutable.
+    Range/206 para el video sale de send_file.
+    """
+    return send_asset(
+        app.static_folder, filename,
+        immutable=(assets.digest(filename) == digest),
+        sendfile_mode=STATIC_SENDFILE,
+        accel_prefix=STATIC_ACCEL_PREFIX,
+        max_age=STATIC_MAX_AGE,
+    )
+
+def variant_url(rel_path, width, fmt=None):
+    """
+    URL de la variante con ?v= (original + pipeline). Con fmt se sirve
+    immutable; sin fmt el formato sale de Accept y se revalida.
+    """
+    digest = assets.digest(rel_path) if rel_path else None
+    if not digest:
+        return ""
+    url = f"/variants/{width}/{rel_path.lstrip('/')}?v={variant_version(digest)}"
+    return f"{url}&fmt={fmt}" if fmt else url
+
+@app.route("/variants/<int:width>/<path:filename>")
+def serve_variant(width, filename):
+    """
+    static/<filename> achicada a width (redondeado a VARIANT_WIDTHS) en webp
+    o jpeg (?fmt=, o según Accept). Immutable sólo con ?v= vigente y ?fmt=
+    (ver variant_url). Sin Pillow se sirve el original, nunca immutable.
+    """
+    if not image_variants.available:
+        return send_asset(app.static_folder, filename, immutable=False, max_age=STATIC_MAX_AGE)
+    digest = assets.digest(filename)
+    immutable = (
+        digest is not None and request.args.get("fmt") is not None
+        and request.args.get("v") == variant_version(digest)
+    )
+    try:
+        fmt = pick_format(request.args.get("fmt"), request.accept_mimetypes)
+        path, mimetype = image_variants.path(filename, width, fmt)
+    except VariantError as e:
+        abort(e.status, e.message)
+
+    resp = send_file(
+        path, mimetype=mimetype, conditional=True, etag=True,
+        max_age=IMMUTABLE_MAX_AGE if immutable else STATIC_MAX_AGE,
+    )
+    if immutable:
+        resp.cache_control.immutable = True
+    if not request.args.get("fmt"):
+        resp.vary.add("Accept")
+    return resp
 
 # ---------------------------------
 # API: STATS
@@ -228,17 +565,25 @@ def serve_mint():
 
 @app.route("/api/stats")
 def api_stats():
-    stats_obj = load_json(STATS_PATH, {})
+    # se re-arma sólo si cambió stats.json, guilds.json, lo pendiente de este
+    # worker o el leaderboard; si no, es copiar bytes ya comprimidos
+    leaderboard.sync()
+    version = (stats_aggregator.version(), guild_stats.version(), leaderboard.version)
+    return response_cache.respond("stats", version, build_stats)
+
+def build_stats():
+    stats_obj = stats_aggregator.read(load_json(STATS_PATH, {}))
     guild_rank_list = []
-    for g_name, g_data in stats_obj.get("guild_ranking", {}).items():
+    for guild in sorted(guild_stats.guilds(), key=lambda x: -x.get("xp_gained", 0)):
         guild_rank_list.append({
-            "name": g_name,
-            "xp_total": g_data.get("xp", 0),
-            "aura_total": g_data.get("aura", 0),
-            "success_rate": f"{g_data.get('successes',0)}%"
+            "name": guild.get("name", ""),
+            "xp_total": guild.get("xp_gained", 0),
+            "aura_total": guild.get("aura_gained", 0),
+            "success_rate": f"{success_rate(guild)}%"
         })
 
-    leaderboard = stats_obj.get("player_leaderboard", [])
+    # top 10 de wallets por XP, sin recorrer players
+    _, top_wallets = leaderboard.page("xp", "wallet", 0, 10)
 
     resp = {
         "total_characters":     stats_obj.get("total_characters", 35000),
@@ -248,9 +593,130 @@ def api_stats():
         "total_exp_collected":  stats_obj.get("total_exp_collected", 0),
         "total_aura_collected": stats_obj.get("total_aura_collected", 0),
         "guild_ranking":        guild_rank_list,
-        "player_leaderboard":   leaderboard
+        "player_leaderboard":   top_wallets
     }
-    return jsonify(resp)
+    return resp
+
+# ---------------------------------
+# API: LEADERBOARD
+# ---------------------------------
+
+def leaderboard_args():
+    by    = request.args.get("by", "xp")
+    scope = request.args.get("scope", "wallet")
+    if by not in LEADERBOARD_METRICS or scope not in LEADERBOARD_SCOPES:
+        abort(400, "invalid leaderboard")
+    return by, scope
+
+@app.route("/api/leaderboard")
+def api_leaderboard():
+    """
+    ?by=xp|aura|missions &scope=wallet|hero &page=1 &per_page=25
+    Cada página sale del índice ordenado: O(log n + per_page).
+    XP / aura incluyen el pasivo acumulado, igual que /api/player.
+    """
+    by, scope = leaderboard_args()
+    try:
+        page     = max(1, int(request.args.get("page", 1)))
+        per_page = min(LEADERBOARD_PER_PAGE_MAX, max(1, int(request.args.get("per_page", 25))))
+    except ValueError:
+        abort(400, "invalid page")
+
+    total, rows = leaderboard.page(by, scope, (page - 1) * per_page, per_page)
+    return jsonify({
+        "by":       by,
+        "scope":    scope,
+        "page":     page,
+        "per_page": per_page,
+        "total":    total,
+        "entries":  rows,
+    })
+
+@app.route("/api/leaderboard/rank")
+def api_leaderboard_rank():
+    """
+    ?wallet=0x...            -> puesto de la wallet
+    ?wallet=0x...&hero=00001 -> puesto de ese héroe (scope=hero implícito)
+    """
+    by, scope = leaderboard_args()
+    wallet  = request.args.get("wallet")
+    hero_id = request.args.get("hero")
+    if not wallet:
+        abort(400, "invalid input")
+
+    if hero_id:
+        scope, entry_id = "hero", hero_entry_id(wallet, str(hero_id).zfill(5))
+    else:
+        entry_id = wallet
+    if scope == "hero" and not hero_id:
+        abort(400, "hero required")
+
+    row = leaderboard.rank(by, scope, entry_id)
+    if row is None:
+        abort(404, "not ranked")
+    return jsonify({"by": by, "scope": scope, **row})
+
+# ---------------------------------
+# API: COLLECTION (búsqueda por traits)
+# ---------------------------------
+
+@app.route("/api/collection/search", methods=["GET", "POST"])
+def api_collection_search():
+    """
+    GET  ?race=Gith,Orc &class=Druid &int_min=15 &age_max=40 &op=and|or
+         &sort=token_id|str|...|cha &order=asc|desc &page=1 &per_page=50 &facets=1
+    POST {"filter": {"and": [{"race": "Gith"}, {"or": [{"int": {"gte": 15}}, {"cha": {"gte": 15}}]}]},
+          "sort": "int", "order": "desc", "page": 1, "per_page": 50, "facets": true}
+    Dentro de un campo los valores se combinan con OR; filtros y rangos se
+    resuelven con AND/OR de bitmaps, así que cuesta lo mismo con 1 o 35k matches.
+    """
+    if request.method == "POST":
+        params = request.get_json(silent=True)
+        if not isinstance(params, dict):
+            abort(400, "invalid input")
+    else:
+        params = request.args
+    try:
+        query = params.get("filter", {}) if request.method == "POST" else query_from_args(params)
+        page     = max(1, int(params.get("page", 1)))
+        per_page = min(COLLECTION_PER_PAGE_MAX, max(1, int(params.get("per_page", 50))))
+    except QueryError as e:
+        abort(400, str(e))
+    except (TypeError, ValueError):
+        abort(400, "invalid page")
+
+    sort = params.get("sort") or "token_id"
+    order = params.get("order", "asc")
+    if order not in ("asc", "desc"):
+        abort(400, "order must be 'asc' or 'desc'")
+    facets = str(params.get("facets", "")).lower() in ("1", "true", "yes")
+
+    try:
+        result = collection_index.search(
+            query, sort=sort, descending=order == "desc",
+            offset=(page - 1) * per_page, limit=per_page, facets=facets,
+        )
+    except QueryError as e:
+        abort(400, str(e))
+    return jsonify({"page": page, "per_page": per_page, "sort": sort, "order": order, **result})
+
+@app.route("/api/collection/stats")
+def api_collection_stats():
+    """Frecuencia de cada trait y distribución de age/str..cha sobre toda la colección."""
+    return response_cache.respond("collection:stats", rarity.fingerprint, rarity.summary)
+
+@app.route("/api/collection/rarity/<token_id>")
+def api_collection_rarity(token_id):
+    """Score de rareza, puesto (1 = más raro) y frecuencia de cada trait del token."""
+    row = rarity.token(token_id)
+    if row is None:
+        abort(404, "token metadata not found")
+    return jsonify(row)
+
+@app.route("/api/collection/fields")
+def api_collection_fields():
+    """Valores posibles de cada campo categórico y rango de los numéricos."""
+    return jsonify(collection_index.fields())
 
 # ---------------------------------
 # API: GUILDS
@@ -258,8 +724,19 @@ def api_stats():
 
 @app.route("/api/guilds")
 def api_guilds():
-    guilds_data = load_json(GUILDS_PATH, [])
-    return jsonify(guilds_data)
+    return response_cache.respond("guilds", guild_stats.version(), guilds_with_assets)
+
+def guilds_with_assets():
+    # badges con fingerprint -> el navegador los cachea como immutable;
+    # badge_thumb: variante chica para la lista (el original pesa hasta ~80 KB)
+    return [
+        dict(
+            guild,
+            badge=assets.url(guild.get("badge", "")),
+            badge_thumb=variant_url(guild.get("badge", ""), GUILD_BADGE_WIDTH),
+        )
+        for guild in guild_stats.guilds()
+    ]
 
 # ---------------------------------
 # API: MISSIONS
@@ -267,7 +744,8 @@ def api_guilds():
 
 @app.route("/api/missions")
 def api_missions():
-    return jsonify(MISSIONS)
+    # MISSIONS es fijo en el proceso: se serializa una sola vez
+    return response_cache.respond("missions", 0, lambda: MISSIONS)
 
 # ---------------------------------
 # Helper: asegurar jugador
@@ -278,10 +756,10 @@ def ensure_player(wallet):
     Devuelve el objeto del jugador para esa wallet.
     Si no existe, lo crea con 2 héroes demo.
     """
-    players = load_json(PLAYERS_PATH, {})
+    player_obj = player_store.get_player(wallet)
 
-    if wallet not in players:
-        players[wallet] = {
+    if player_obj is None:
+        player_obj = {
             "wallet": wallet,
             "heroes": [
                 {
@@ -334,9 +812,17 @@ def ensure_player(wallet):
                 "energy_total_available": 125
             }
         }
-        save_json(PLAYERS_PATH, players)
-
-    return players[wallet], players
+        # los héroes nuevos entran como miembros de su gremio
+        joined = {}
+        for hero in player_obj["heroes"]:
+            ds = hero["dynamic_state"]
+            guild_event(
+                joined, hero.get("guild") or ds.get("current_guild"),
+                members=1, xp_sum=ds.get("xp_total", 0), aura_sum=ds.get("aura_level", 0),
+            )
+        commit_player(wallet, player_obj, joined, [{"k": "create", "p": player_obj, "d": joined}])
+
+    return player_obj
 
 # ---------------------------------
 # API: PLAYER PROFILE
@@ -344,28 +830,57 @@ def ensure_player(wallet):
 
 @app.route("/api/player/<wallet>")
 def api_player(wallet):
-    stats_obj = load_json(STATS_PATH, {
-        "total_characters": 35000,
-        "active_guilds": 6,
-        "missions_completed": 0,
-        "missions_failed": 0,
-        "total_exp_collected": 0,
-        "total_aura_collected": 0,
-        "guild_ranking": {},
-        "player_leaderboard": []
-    })
-
-    player_obj, players_all = ensure_player(wallet)
-
-    # aplicar pasivo/regen antes de mostrar
-    player_obj, stats_obj = apply_passive_and_regen(player_obj, stats_obj)
+    """
+    Perfil con el pasivo/regen calculado al vuelo: un GET no escribe nada
+    (salvo crear la wallet demo la primera vez). Pedidos concurrentes de la
+    misma wallet comparten la lectura (player_reads).
+    """
+    probe = lambda: probe_player_read(wallet)
+    entry = player_reads.get(wallet, probe, render_player_read, client_has_etag)
+    if entry is None:
+        with wallet_lock(wallet):
+            ensure_player(wallet)
+        entry = player_reads.get(wallet, probe, render_player_read, client_has_etag)
+    return cached_read_response(entry, PLAYER_MAX_AGE, PLAYER_CDN_MAX_AGE)
+
+def probe_player_read(wallet):
+    """
+    (ETag, estado) del perfil sin armar el JSON (None si la wallet no existe).
+    La elegibilidad sale de WalletState acumulado hasta ahora (enteros, sin
+    copiar el dict); un cooldown que vence cambia el perfil sin escritura,
+    así que entra en el ETag.
+    """
+    player_obj = player_store.get_player(wallet)
+    if player_obj is None:
+        return None
 
-    # guardar cambios
-    players_all[wallet] = player_obj
-    save_json(PLAYERS_PATH, players_all)
-    save_json(STATS_PATH, stats_obj)
+    now = time.time()
+    now_us = int(now * US)
+    wallet_state = WalletState.from_dict(player_obj)
+    for h in wallet_state:
+        h.accrue(now_us)
+    eligibility = wallet_state.eligibility(now_us)
+    ready = tuple(m["eligible"] for h in eligibility.values() for m in h.values())
+    etag = make_etag(
+        "player", wallet, player_obj.get("state_version", 0), player_passive_epoch(player_obj, now), ready
+    )
+    return etag, (player_obj, eligibility, now)
+
+def render_player_read(etag, state):
+    """
+    JSON del perfil para el estado de probe_player_read. Cada héroe lleva
+    mission_eligibility: por misión si ya se puede correr y desde cuándo
+    (cooldown / energía), para que el cliente agende en vez de probar.
+    """
+    player_obj, eligibility, now = state
+    player_obj = effective_player(player_obj, now)
+    for hero in player_obj.get("heroes", []):
+        hero["mission_eligibility"] = eligibility.get(hero.get("token_id"), {})
 
-    return jsonify(player_obj)
+    stamps = [parse_utc(h.get("dynamic_state", {}).get("last_update")) for h in player_obj.get("heroes", [])]
+    stamps = [t for t in stamps if t is not None]
+    last_modified = max(stamps) if stamps else None
+    return CachedRead(etag, app.json.response(player_obj).get_data(), last_modified)
 
 # ---------------------------------
 # API: RECOVER ENERGY (gastar XP para recargar energía temprano)
@@ -381,55 +896,50 @@ def api_spend_xp():
     if not wallet or not hero_id or energy_req <= 0:
         abort(400, "invalid input")
 
-    stats_obj = load_json(STATS_PATH, {
-        "total_characters": 35000,
-        "active_guilds": 6,
-        "missions_completed": 0,
-        "missions_failed": 0,
-        "total_exp_collected": 0,
-        "total_aura_collected": 0,
-        "guild_ranking": {},
-        "player_leaderboard": []
-    })
-    player_obj, players_all = ensure_player(wallet)
+    with wallet_lock(wallet):
+        # delta con forma de stats.json; lo suma el agregador (write-behind)
+        stats_delta = {}
+        events = []
+        player_obj = ensure_player(wallet)
 
-    # refrescamos pasivo/energía
-    player_obj, stats_obj = apply_passive_and_regen(player_obj, stats_obj)
+        # refrescamos pasivo/energía
+        player_obj, stats_delta = apply_passive_and_regen(player_obj, stats_delta, events=events)
 
-    # buscar héroe
-    hero = None
-    for h in player_obj.get("heroes", []):
-        if h.get("token_id") == hero_id:
-            hero = h
-            break
-    if not hero:
-        abort(404, "hero not found")
+        # buscar héroe
+        hero = heroes_by_token(player_obj).get(hero_id)
+        if not hero:
+            abort(404, "hero not found")
 
-    ds = hero["dynamic_state"]
-    xp_total       = ds.get("xp_total", 0)
-    aura_level     = ds.get("aura_level", 0)
-    energy_current = ds.get("energy_current", 0)
-    energy_max     = ds.get("energy_max", 100)
+        ds = hero["dynamic_state"]
+        before = ds_snapshot(ds)
+        xp_total       = ds.get("xp_total", 0)
+        aura_level     = ds.get("aura_level", 0)
+        energy_current = ds.get("energy_current", 0)
+        energy_max     = ds.get("energy_max", 100)
 
-    xp_cost = energy_req * XP_COST_PER_ENERGY
-    if xp_total < xp_cost:
-        abort(400, "not enough xp")
+        xp_cost = energy_req * XP_COST_PER_ENERGY
+        if xp_total < xp_cost:
+            abort(400, "not enough xp")
 
-    # aplicar recuperación
-    xp_total       -= xp_cost
-    energy_current = min(energy_max, energy_current + energy_req)
+        # aplicar recuperación
+        xp_total       -= xp_cost
+        energy_current = min(energy_max, energy_current + energy_req)
 
-    ds["xp_total"]       = xp_total
-    ds["aura_level"]     = aura_level
-    ds["energy_current"] = energy_current
-    ds["last_update"]    = now_utc_str()
+        ds["xp_total"]       = xp_total
+        ds["aura_level"]     = aura_level
+        ds["energy_current"] = energy_current
+        ds["last_update"]    = now_utc_str()
+        bump_state_version(player_obj, hero)
+        delta = guild_event({}, hero.get("guild") or ds.get("current_guild"), xp_sum=-xp_cost)
+        merge_delta(stats_delta, delta)
+        events.append({
+            "k": "spend", "h": hero_id, "n": energy_req, "ds": ds_changes(before, ds), "d": delta,
+        })
 
-    # recalcular totales de wallet (llama pasivo otra vez para coherencia)
-    player_obj, stats_obj = apply_passive_and_regen(player_obj, stats_obj)
+        # recalcular totales de wallet
+        recompute_totals(player_obj)
 
-    players_all[wallet] = player_obj
-    save_json(PLAYERS_PATH, players_all)
-    save_json(STATS_PATH, stats_obj)
+        commit_player(wallet, player_obj, stats_delta, events)
 
     return jsonify({
         "hero_id": hero_id,
@@ -441,66 +951,39 @@ def api_spend_xp():
 # API: EXECUTE MISSION (SEND)
 # ---------------------------------
 
-@app.route("/api/mission/execute", methods=["POST"])
-def api_mission_execute():
-    data = request.get_json(force=True)
-    wallet     = data.get("wallet")
-    hero_id    = data.get("hero_id")
-    mission_id = data.get("mission_id")
+class MissionError(Exception):
+    """Misión rechazada (energía, cooldown, ids): status HTTP + mensaje."""
 
-    if not wallet or not hero_id or not mission_id:
-        abort(400, "invalid input")
-
-    stats_obj = load_json(STATS_PATH, {
-        "total_characters": 35000,
-        "active_guilds": 6,
-        "missions_completed": 0,
-        "missions_failed": 0,
-        "total_exp_collected": 0,
-        "total_aura_collected": 0,
-        "guild_ranking": {},
-        "player_leaderboard": []
-    })
-    player_obj, players_all = ensure_player(wallet)
-
-    # refrescar antes de operar
-    player_obj, stats_obj = apply_passive_and_regen(player_obj, stats_obj)
-
-    # ubicar misión
-    mission = None
-    for m in MISSIONS:
-        if m["id"] == mission_id:
-            mission = m
-            break
-    if mission is None:
-        abort(400, "mission not found")
-
-    # ubicar héroe
-    hero = None
-    for h in player_obj.get("heroes", []):
-        if h.get("token_id") == hero_id:
-            hero = h
-            break
-    if hero is None:
-        abort(404, "hero not found")
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status  = status
+        self.message = message
 
+def run_mission(player_obj, hero, mission, stats_delta, events=None):
+    """
+    Valida energía y cooldown (ROTATION_HOURS) y aplica la misión sobre un
+    héroe ya cargado: muta hero, player_obj (state_version) y stats_delta
+    (y agrega el evento "mission" a events, si viene).
+    No persiste nada: el caller hace un solo commit por request.
+    """
+    mission_id = mission["id"]
     ds = hero["dynamic_state"]
+    before = ds_snapshot(ds) if events is not None else None
     xp_total        = ds.get("xp_total", 0)
     aura_level      = ds.get("aura_level", 0)
     energy_current  = ds.get("energy_current", 0)
-    energy_max      = ds.get("energy_max", 100)
     mission_hist    = ds.get("mission_history", {})
     hero_guild_name = hero.get("guild") or ds.get("current_guild", "Unknown Guild")
 
     # check energía
     cost_energy = mission["energy_cost"]
     if energy_current < cost_energy:
-        abort(400, "not enough energy")
+        raise MissionError(400, "not enough energy")
 
-    # check cooldown (72h)
-    last_run_ts = mission_hist.get(mission_id)
-    if last_run_ts and hours_since(last_run_ts) < ROTATION_HOURS:
-        abort(400, "mission on cooldown")
+    # check cooldown (72h); ts_to_epoch está cacheado, no se re-parsea el ISO
+    last_run = ts_to_epoch(mission_hist.get(mission_id))
+    if last_run is not None and time.time() - last_run < ROTATION_HOURS * 3600:
+        raise MissionError(400, "mission on cooldown")
 
     # resolver misión (por ahora siempre éxito)
     xp_gain   = mission["reward_xp"]
@@ -515,25 +998,27 @@ def api_mission_execute():
     ds["energy_current"]  = max(0, energy_current)
     ds["last_update"]     = now_utc_str()
     ds["last_mission"]    = mission["name"]
+    ds["missions_completed"] = ds.get("missions_completed", 0) + 1
     mission_hist[mission_id] = now_utc_str()
     ds["mission_history"]    = mission_hist
+    bump_state_version(player_obj, hero)
 
-    stats_obj["missions_completed"]   = stats_obj.get("missions_completed", 0) + 1
-    stats_obj["total_exp_collected"]  = stats_obj.get("total_exp_collected", 0) + xp_gain
-    stats_obj["total_aura_collected"] = stats_obj.get("total_aura_collected", 0) + aura_gain
-
+    delta = {
+        "missions_completed":   1,
+        "total_exp_collected":  xp_gain,
+        "total_aura_collected": aura_gain,
+    }
     # ranking gremio
-    stats_obj = update_guild_stats(hero_guild_name, xp_gain, aura_gain, stats_obj)
-
-    # recalcular totales, con pasivo otra vez
-    player_obj, stats_obj = apply_passive_and_regen(player_obj, stats_obj)
-
-    players_all[wallet] = player_obj
-    save_json(PLAYERS_PATH, players_all)
-    save_json(STATS_PATH, stats_obj)
+    update_guild_stats(hero_guild_name, xp_gain, aura_gain, delta)
+    merge_delta(stats_delta, delta)
+    if events is not None:
+        events.append({
+            "k": "mission", "h": hero.get("token_id"), "m": mission_id,
+            "ds": ds_changes(before, ds), "d": delta,
+        })
 
-    return jsonify({
-        "hero_id": hero_id,
+    return {
+        "hero_id": hero.get("token_id"),
         "mission_id": mission_id,
         "mission_name": mission["name"],
         "energy_spent": cost_energy,
@@ -542,21 +1027,136 @@ def api_mission_execute():
         "hero_energy_now": ds["energy_current"],
         "hero_xp_now": ds["xp_total"],
         "hero_aura_now": ds["aura_level"]
+    }
+
+@app.route("/api/mission/execute", methods=["POST"])
+def api_mission_execute():
+    data = request.get_json(force=True)
+    wallet     = data.get("wallet")
+    hero_id    = data.get("hero_id")
+    mission_id = data.get("mission_id")
+
+    if not wallet or not hero_id or not mission_id:
+        abort(400, "invalid input")
+
+    with wallet_lock(wallet):
+        # delta con forma de stats.json; lo suma el agregador (write-behind)
+        stats_delta = {}
+        events = []
+        player_obj = ensure_player(wallet)
+
+        # refrescar antes de operar
+        player_obj, stats_delta = apply_passive_and_regen(player_obj, stats_delta, events=events)
+
+        # ubicar misión
+        mission = MISSIONS_BY_ID.get(mission_id)
+        if mission is None:
+            abort(400, "mission not found")
+
+        # ubicar héroe
+        hero = heroes_by_token(player_obj).get(hero_id)
+        if hero is None:
+            abort(404, "hero not found")
+
+        try:
+            result = run_mission(player_obj, hero, mission, stats_delta, events)
+        except MissionError as e:
+            abort(e.status, e.message)
+
+        recompute_totals(player_obj)
+        commit_player(wallet, player_obj, stats_delta, events)
+
+    return jsonify(result)
+
+# ---------------------------------
+# API: BATCH DISPATCH (varios héroes, un commit)
+# ---------------------------------
+
+@app.route("/api/mission/batch", methods=["POST"])
+def api_mission_batch():
+    """
+    {"wallet": "0x..", "missions": [{"hero_id": "00001", "mission_id": "001"}, ...]}
+
+    Un lock, un pasivo, un commit para todo el lote. Cada par se valida y se
+    aplica en orden (dos misiones al mismo héroe ven la energía ya gastada);
+    los que fallan quedan en results con ok=false y no frenan al resto.
+    """
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict):
+        abort(400, "invalid input")
+    wallet = data.get("wallet")
+    pairs  = data.get("missions")
+
+    if not wallet or not isinstance(pairs, list) or not pairs:
+        abort(400, "invalid input")
+    if len(pairs) > MISSION_BATCH_MAX:
+        abort(400, f"too many missions (max {MISSION_BATCH_MAX})")
+
+    results = []
+    with wallet_lock(wallet):
+        stats_delta = {}
+        events = []
+        player_obj = ensure_player(wallet)
+        player_obj, stats_delta = apply_passive_and_regen(player_obj, stats_delta, events=events)
+        heroes_by_id = heroes_by_token(player_obj)
+
+        for pair in pairs:
+            pair = pair if isinstance(pair, dict) else {}
+            hero_id    = pair.get("hero_id")
+            mission_id = pair.get("mission_id")
+            try:
+                if not hero_id or not mission_id:
+                    raise MissionError(400, "invalid input")
+                mission = MISSIONS_BY_ID.get(mission_id)
+                if mission is None:
+                    raise MissionError(400, "mission not found")
+                hero = heroes_by_id.get(hero_id)
+                if hero is None:
+                    raise MissionError(404, "hero not found")
+                result = run_mission(player_obj, hero, mission, stats_delta, events)
+                results.append({"ok": True, **result})
+            except MissionError as e:
+                results.append({
+                    "ok": False,
+                    "hero_id": hero_id,
+                    "mission_id": mission_id,
+                    "status": e.status,
+                    "error": e.message,
+                })
+
+        # si todo falló no hay nada que commitear (el pasivo se materializa
+        # en la próxima escritura, igual que cuando /execute aborta)
+        if any(r["ok"] for r in results):
+            recompute_totals(player_obj)
+            commit_player(wallet, player_obj, stats_delta, events)
+
+    succeeded = sum(1 for r in results if r["ok"])
+    return jsonify({
+        "wallet": wallet,
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "xp_gained": sum(r["xp_gained"] for r in results if r["ok"]),
+        "aura_gained": sum(r["aura_gained"] for r in results if r["ok"]),
+        "results": results,
     })
 
 # ---------------------------------
 # Helpers internos para metadata dinámica (OpenSea-style)
 # ---------------------------------
 
+@timed("load_base_metadata")
 def load_base_metadata_for_token(token_id):
     """
-    Carga data/metadata/<token_id>.json (ej 00001.json)
-    y normaliza la info fija:
-    - name / description / image
-    - fixed_profile{}  (race, class, str, etc.)
-    - attributes[]     (fallback si falta algo)
-    Devuelve todo en un dict plano usable.
+    Devuelve la metadata fija normalizada del token (ver normalize_base_metadata).
+    1) data/metadata.pack (mmap, ya normalizado)
+    2) fallback: data/metadata/<token_id>.json (ej 00001.json) si el token no está en el pack
     """
+    meta = metadata_pack.get(token_id)
+    if meta is not None:
+        return meta
+    if pack_token_num(token_id) is None:
+        return None
+
     filename = f"{str(token_id).zfill(5)}.json"
     path = os.path.join(METADATA_DIR, filename)
     if not os.path.exists(path):
@@ -565,89 +1165,51 @@ def load_base_metadata_for_token(token_id):
     with open(path, "r", encoding="utf-8") as f:
         raw = json.load(f)
 
-    # base del resultado
-    meta = {
-        "token_id":        str(token_id).zfill(5),
-        "name":            raw.get("name", f"Emissary #{str(token_id).zfill(5)}"),
-        "description":     raw.get("description", "Emissary of Emberholm."),
-        "image":           raw.get("image", ""),
-        "race":            "Unknown",
-        "class":           "Unknown",
-        "rarity":          "Unknown",
-        "age":             0,
-        "starting_guild":  "Unknown",
-        "str":             0,
-        "dex":             0,
-        "con":             0,
-        "int":             0,
-        "wis":             0,
-        "cha":             0,
-    }
+    return normalize_base_metadata(token_id, raw)
 
-    # 1) fixed_profile: tu formato real
-    fixed = raw.get("fixed_profile", {})
-    if isinstance(fixed, dict):
-        if "token_id"       in fixed: meta["token_id"]        = fixed["token_id"]
-        if "race"           in fixed: meta["race"]            = fixed["race"]
-        if "class"          in fixed: meta["class"]           = fixed["class"]
-        if "rarity"         in fixed: meta["rarity"]          = fixed["rarity"]
-        if "age"            in fixed: meta["age"]             = fixed["age"]
-        if "starting_guild" in fixed: meta["starting_guild"]  = fixed["starting_guild"]
-        if "str"            in fixed: meta["str"]             = fixed["str"]
-        if "dex"            in fixed: meta["dex"]             = fixed["dex"]
-        if "con"            in fixed: meta["con"]             = fixed["con"]
-        if "int"            in fixed: meta["int"]             = fixed["int"]
-        if "wis"            in fixed: meta["wis"]             = fixed["wis"]
-        if "cha"            in fixed: meta["cha"]             = fixed["cha"]
-
-    # 2) fallback desde attributes[] si todavía faltan cosas
-    attrs = raw.get("attributes", [])
-    for trait in attrs:
-        ttype = trait.get("trait_type", "").lower()
-        val   = trait.get("value")
-
-        if ttype == "id" and meta["token_id"] == str(token_id).zfill(5):
-            # ya tenemos token_id, no lo pisamos
-            pass
-        elif ttype == "race" and meta["race"] == "Unknown":
-            meta["race"] = val
-        elif ttype == "class" and meta["class"] == "Unknown":
-            meta["class"] = val
-        elif ttype == "rarity" and meta["rarity"] == "Unknown":
-            meta["rarity"] = val
-        elif ttype == "guild" and meta["starting_guild"] == "Unknown":
-            meta["starting_guild"] = val
-        elif ttype == "age" and meta["age"] == 0:
-            meta["age"] = val
-
-    return meta
-
-
-def find_dynamic_state_for_token(token_id):
-    """
-    Busca en players.json qué wallet contiene este héroe
-    y devuelve su dynamic_state (XP / Aura / Energía / última misión).
-    Si no está todavía, devolvemos defaults.
-    """
-    players_all = load_json(PLAYERS_PATH, {})
-
-    for wallet_addr, pobj in players_all.items():
-        for hero in pobj.get("heroes", []):
-            if hero.get("token_id") == str(token_id).zfill(5):
-                ds = hero.get("dynamic_state", {})
-                last_mission_name = ds.get("last_mission", "None")
-                return {
-                    "current_guild":   ds.get("current_guild", hero.get("guild","Unknown")),
-                    "xp_total":        ds.get("xp_total", 0),
-                    "xp_level":        ds.get("xp_level", 1),
-                    "aura_level":      ds.get("aura_level", 0),
-                    "energy_current":  ds.get("energy_current", 100),
-                    "energy_max":      ds.get("energy_max", 100),
-                    "power_current":   ds.get("power_current", 0),
-                    "last_update":     ds.get("last_update", now_utc_str()),
-                    "last_mission":    last_mission_name,
-                }
 
+def base_metadata_signature(token_id):
+    """
+    Firma barata de la metadata base, sin parsear nada:
+    (firma, mtime) desde el índice del pack o el stat() del archivo suelto.
+    None si el token no existe.
+    """
+    crc = metadata_pack.source_crc(token_id)
+    if crc is not None:
+        return f"p{crc:08x}", metadata_pack.mtime
+    if pack_token_num(token_id) is None:
+        return None
+
+    path = os.path.join(METADATA_DIR, f"{str(token_id).zfill(5)}.json")
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return f"f{st.st_mtime_ns}-{st.st_size}", datetime.utcfromtimestamp(st.st_mtime)
+
+
+def dynamic_state_from_hero(hero, now=None):
+    """
+    dynamic_state público de un héroe (o defaults si nadie lo tiene todavía),
+    con el pasivo/regen acumulado hasta now ya aplicado.
+    """
+    if hero is not None:
+        ds = dict(hero.get("dynamic_state", {}))
+        accrue_hero(ds, time.time() if now is None else now)
+        last_mission_name = ds.get("last_mission", "None")
+        return {
+            "current_guild":   ds.get("current_guild", hero.get("guild","Unknown")),
+            "xp_total":        ds.get("xp_total", 0),
+            "xp_level":        ds.get("xp_level", 1),
+            "aura_level":      ds.get("aura_level", 0),
+            "energy_current":  ds.get("energy_current", 100),
+            "energy_max":      ds.get("energy_max", 100),
+            "power_current":   ds.get("power_current", 0),
+            "last_update":     ds.get("last_update", now_utc_str()),
+            "last_mission":    last_mission_name,
+        }
+
+    # "None" fijo (no la hora actual) para que el cuerpo sea estable y cacheable
     return {
         "current_guild":   "Unassigned",
         "xp_total":        0,
@@ -656,29 +1218,27 @@ def find_dynamic_state_for_token(token_id):
         "energy_current":  100,
         "energy_max":      100,
         "power_current":   0,
-        "last_update":     now_utc_str(),
+        "last_update":     "None",
         "last_mission":    "None"
     }
 
-# ---------------------------------
-# API: NFT METADATA dinámica tipo DX Terminal / OpenSea
-# ---------------------------------
 
-@app.route("/api/metadata/<token_id>")
-def api_metadata(token_id):
-    """
-    Endpoint que OpenSea/marketplaces pueden consultar como tokenURI.
-    Combina:
-    - metadata fija del héroe (race, STR, etc.)
-    - estado dinámico actual (XP, Aura, Energy, Last Mission)
-    y lo devuelve TODO dentro de "attributes".
-    """
-    base_meta = load_base_metadata_for_token(token_id)
-    if base_meta is None:
-        abort(404, "token metadata not found")
+def all_token_ids():
+    """Todos los token_id de la colección ("00001"...), desde el pack o el directorio."""
+    nums = metadata_pack.token_nums()
+    if not nums:
+        nums = sorted(
+            int(name[:-5]) for name in os.listdir(METADATA_DIR)
+            if name.endswith(".json") and name[:-5].isdigit()
+        )
+    return [f"{n:05d}" for n in nums]
 
-    dyn = find_dynamic_state_for_token(token_id)
 
+def build_token_metadata(token_id, base_meta, dyn):
+    """
+    Arma el JSON tokenURI (name/description/image + "attributes")
+    a partir de la metadata base y el dynamic_state público.
+    """
     current_guild = dyn.get("current_guild", base_meta.get("starting_guild", "Unknown"))
     energy_str = f"{dyn.get('energy_current',0)} / {dyn.get('energy_max',0)}"
 
@@ -687,6 +1247,7 @@ def api_metadata(token_id):
         {"trait_type": "Race",          "value": base_meta.get("race")},
         {"trait_type": "Class",         "value": base_meta.get("class")},
         {"trait_type": "Rarity",        "value": base_meta.get("rarity")},
+        {"trait_type": "Rarity Rank",   "value": rarity.rank(token_id), "display_type": "number"},
         {"trait_type": "Guild",         "value": current_guild},
         {"trait_type": "Age",           "value": base_meta.get("age")},
         {"trait_type": "STR",           "value": base_meta.get("str")},
@@ -711,7 +1272,212 @@ def api_metadata(token_id):
         "attributes":  traits
     }
 
-    return jsonify(response)
+    return response
+
+# ---------------------------------
+# API: NFT METADATA dinámica tipo DX Terminal / OpenSea
+# ---------------------------------
+
+@app.route("/api/metadata/<token_id>")
+def api_metadata(token_id):
+    """
+    Endpoint que OpenSea/marketplaces pueden consultar como tokenURI.
+    Combina:
+    - metadata fija del héroe (race, STR, etc.)
+    - estado dinámico actual (XP, Aura, Energy, Last Mission)
+    y lo devuelve TODO dentro de "attributes".
+
+    ETag = metadata base + rareza de la colección + dueño + state_version del
+    héroe. ETag y cuerpo se arman una vez para todos los pedidos
+    concurrentes del mismo token y quedan READ_CACHE_TTL segundos
+    (metadata_reads, por id canónico: /api/metadata/1 y /00001 comparten
+    entrada e invalidación); un If-None-Match que coincide se responde 304
+    sin armar el cuerpo.
+    """
+    token_num = pack_token_num(token_id)
+    if token_num is None:
+        abort(404, "token metadata not found")
+    token_id = f"{token_num:05d}"
+    entry = metadata_reads.get(
+        token_id, lambda: probe_metadata_read(token_id), render_metadata_probe, client_has_etag
+    )
+    if entry is None:
+        abort(404, "token metadata not found")
+    return cached_read_response(entry, METADATA_MAX_AGE, METADATA_CDN_MAX_AGE)
+
+def probe_metadata_read(token_id):
+    """(ETag, estado) de un token sin cargar su metadata (None si no existe)."""
+    base_sig = base_metadata_signature(token_id)
+    if base_sig is None:
+        return None
+    # dueño + dynamic_state vía el índice token_id -> (wallet, slot)
+    with span("find_dynamic_state_for_token"):
+        found = player_store.find_token(token_id)
+    now = time.time()
+    return metadata_etag(token_id, base_sig, found, now), (token_id, base_sig, found, now)
+
+def render_metadata_probe(etag, state):
+    """render de metadata_reads: el estado que devolvió probe_metadata_read."""
+    token_id, base_sig, found, now = state
+    return render_metadata_body(token_id, etag, base_sig, found, now)
+
+def metadata_etag(token_id, base_sig, found, now):
+    """ETag de /api/metadata/<id> sin cargar la metadata (found = find_token del token)."""
+    hero  = found[2] if found is not None else None
+    owner = found[0] if found is not None else ""
+    hero_version = hero.get("dynamic_state", {}).get("state_version", 0) if hero else 0
+    hero_epoch   = passive_epoch(hero.get("dynamic_state", {}), now) if hero else ()
+    return make_etag(
+        "meta", str(token_id).zfill(5), base_sig[0], rarity.fingerprint, owner, hero_version, hero_epoch
+    )
+
+def render_metadata_read(token_id, found, now):
+    """CachedRead de un token con el dueño ya resuelto (None si el token no existe)."""
+    base_sig = base_metadata_signature(token_id)
+    if base_sig is None:
+        return None
+    return render_metadata_body(token_id, metadata_etag(token_id, base_sig, found, now), base_sig, found, now)
+
+def render_metadata_body(token_id, etag, base_sig, found, now):
+    """Cuerpo tokenURI para un ETag ya calculado con esos mismos base_sig/found/now."""
+    base_meta = load_base_metadata_for_token(token_id)
+    if base_meta is None:
+        return None
+
+    dyn = dynamic_state_from_hero(found[2] if found is not None else None, now)
+    response = build_token_metadata(token_id, base_meta, dyn)
+
+    last_modified = max(filter(None, [base_sig[1], parse_utc(dyn.get("last_update"))]), default=None)
+    return CachedRead(etag, app.json.response(response).get_data(), last_modified)
+
+# ---------------------------------
+# API: METADATA en lote (indexers / refresh de colección)
+# ---------------------------------
+
+def parse_token_selection(args, default_all=False, max_tokens=None):
+    """
+    Lee la selección de tokens desde query string o JSON:
+    - ids=1,2,3  /  {"ids": [1, 2, 3]}
+    - start=1&end=500  /  {"start": 1, "end": 500}   (rango inclusivo)
+    Devuelve lista de token_id "00001" o None si no vino nada.
+    ids que no son números de token (o no es una lista) -> 400. Con
+    max_tokens un rango más largo es 400 antes de armar la lista; sin tope
+    el rango se recorta al último token de la colección.
+    """
+    if not isinstance(args, dict):
+        abort(400, "invalid input")
+    ids = args.get("ids")
+    if isinstance(ids, str):
+        ids = [x.strip() for x in ids.split(",") if x.strip()]
+    if ids is not None and not isinstance(ids, list):
+        abort(400, "ids must be a list of token ids")
+    if ids:
+        # sólo ids canónicos: nada de rutas ("../players") que lleguen al fallback de archivos
+        nums = [pack_token_num(x) if isinstance(x, (str, int)) and not isinstance(x, bool) else None for x in ids]
+        if None in nums:
+            abort(400, "ids must be numeric token ids")
+        return [f"{n:05d}" for n in nums]
+
+    start, end = args.get("start"), args.get("end")
+    if start is None and end is None:
+        return all_token_ids() if default_all else None
+    try:
+        last  = int(all_token_ids()[-1])
+        start = int(start) if start is not None else 1
+        end   = int(end)   if end   is not None else last
+    except (TypeError, ValueError, IndexError):
+        abort(400, "invalid range")
+    if start < 1 or end < start:
+        abort(400, "invalid range")
+    if max_tokens is not None:
+        if end - start + 1 > max_tokens:
+            abort(400, f"max {max_tokens} tokens per batch, use /api/metadata/stream")
+    else:
+        end = min(end, last)
+    return [f"{n:05d}" for n in range(start, end + 1)]
+
+
+@app.route("/api/metadata/batch", methods=["GET", "POST"])
+def api_metadata_batch():
+    """
+    Varios tokenURI en una sola llamada:
+    {"tokens": [{"token_id", "metadata"}, ...], "missing": [...]}
+    "metadata" tiene exactamente la forma de /api/metadata/<token_id>.
+    """
+    args = request.get_json(force=True, silent=True) if request.method == "POST" else request.args
+    token_ids = parse_token_selection(args or {}, max_tokens=METADATA_BATCH_MAX)
+    if not token_ids:
+        abort(400, "invalid input")
+    if len(token_ids) > METADATA_BATCH_MAX:
+        abort(400, f"max {METADATA_BATCH_MAX} tokens per batch, use /api/metadata/stream")
+
+    with span("find_dynamic_state_for_token"):
+        owners = player_store.find_tokens(token_ids)
+    tokens, missing = [], []
+    for token_id in token_ids:
+        base_meta = load_base_metadata_for_token(token_id)
+        if base_meta is None:
+            missing.append(token_id)
+            continue
+        found = owners.get(token_id)
+        dyn = dynamic_state_from_hero(found[2] if found is not None else None)
+        tokens.append({"token_id": token_id, "metadata": build_token_metadata(token_id, base_meta, dyn)})
+
+    return jsonify({"tokens": tokens, "missing": missing})
+
+
+@app.route("/api/metadata/stream")
+def api_metadata_stream():
+    """
+    NDJSON con toda la colección (o start/end): una línea {"token_id", "metadata"} por token.
+    El estado de jugadores se carga una sola vez (token -> héroe) y los tokens
+    se generan de a uno, así la memoria no crece con el tamaño de la respuesta.
+    """
+    token_ids = parse_token_selection(request.args, default_all=True)
+
+    heroes_by_token = {}
+    with span("find_dynamic_state_for_token"):
+        for wallet_addr, hero in player_store.iter_heroes():
+            heroes_by_token.setdefault(str(hero.get("token_id", "")), hero)
+
+    def generate():
+        for token_id in token_ids:
+            base_meta = load_base_metadata_for_token(token_id)
+            if base_meta is None:
+                continue
+            dyn = dynamic_state_from_hero(heroes_by_token.get(token_id))
+            item = {"token_id": token_id, "metadata": build_token_metadata(token_id, base_meta, dyn)}
+            yield json.dumps(item, separators=(",", ":")) + "\n"
+
+    return app.response_class(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+# ---------------------------------
+# API: FEED DE CAMBIOS (tokens con dynamic_state nuevo)
+# ---------------------------------
+
+@app.route("/api/metadata/changes")
+def api_metadata_changes():
+    """
+    ?since=<cursor>&limit=N -> tokens cuyo dynamic_state cambió después del
+    cursor, en orden: {"changes": [{"token_id", "seq", "changed_at"}],
+    "next_cursor", "has_more"}. since=0 (o sin since) = todo lo que cambió
+    alguna vez; since=latest = arrancar desde ahora sin historial.
+    """
+    if change_feed is None:
+        abort(404, "change feed disabled")
+    since = request.args.get("since", "0")
+    try:
+        cursor = change_feed.latest() if since == "latest" else int(since)
+        limit = min(int(request.args.get("limit", CHANGE_FEED_PAGE_MAX)), CHANGE_FEED_PAGE_MAX)
+    except ValueError:
+        abort(400, "since and limit must be integers")
+    if cursor < 0 or limit < 1:
+        abort(400, "since must be >= 0 and limit >= 1")
+
+    changes, next_cursor, has_more = change_feed.since(cursor, limit)
+    resp = jsonify({"changes": changes, "next_cursor": next_cursor, "has_more": has_more})
+    resp.cache_control.no_cache = True
+    return resp
 
 # ---------------------------------
 # Run local dev server
@@ -0,0 +1,585 @@
+"""
+Benchmark / load test del portal.
+
+Genera un directorio de datos sintético (players.json, stats.json,
+guilds.json) con N wallets x H héroes, usa la metadata real de
+data/metadata (35k archivos, + metadata.pack) y dispara una mezcla de
+requests contra todas las rutas de app.py:
+
+- target "client"  : Flask test client en este proceso (sin red)
+- target "gunicorn": levanta gunicorn de verdad y le pega por HTTP
+
+Mezclas (--mix):
+- marketplace: crawl de metadata (single, batch, stream) + imágenes
+- dashboard  : home, stats, guilds, missions, perfil, leaderboard
+- missions   : ráfaga de misiones (execute, batch, spend) + perfil
+- all        : todas las rutas con el mismo peso
+
+Salida: JSON con throughput y p50/p95/p99 por ruta (--out para guardarlo).
+--compare base.json nuevo.json muestra la diferencia entre dos corridas.
+
+Uso:
+    python bench.py --wallets 5000 --heroes 4 --mix dashboard --concurrency 16 --requests 5000
+    python bench.py --target gunicorn --workers 2 --threads 4 --mix marketplace --duration 30 --out run.json
+    python bench.py --compare base.json run.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+HERE         = os.path.dirname(os.path.abspath(__file__))
+METADATA_DIR = os.path.join(HERE, "data", "metadata")
+
+GUILDS = [
+    ("Forge Legion",       "Orc Warrior"),
+    ("Circle of Mist",     "Gith Druid"),
+    ("Shadow Guild",       "Elf Rogue"),
+    ("Horizon Watch",      "Human Ranger"),
+    ("Dawnkeepers",        "Dwarf Paladin"),
+    ("Echoes of the Veil", "Tiefling Necromancer"),
+]
+MISSION_IDS = ["001", "002", "003"]
+
+
+# ---------------------------------
+# Datos sintéticos
+# ---------------------------------
+
+def _iso(dt):
+    return dt.isoformat() + "Z"
+
+
+def make_hero(rng, token_id, now):
+    guild, race_class = rng.choice(GUILDS)
+    last_update = now - timedelta(hours=rng.uniform(0, 96))
+    history = {
+        m: _iso(now - timedelta(hours=rng.uniform(0, 150)))
+        for m in MISSION_IDS if rng.random() < 0.4
+    }
+    return {
+        "token_id": token_id,
+        "name": f"Emissary #{token_id}",
+        "image_url": f"img/{token_id}.png",
+        "race_class": race_class,
+        "guild": guild,
+        "dynamic_state": {
+            "xp_total": rng.randint(0, 5000),
+            "xp_level": rng.randint(1, 10),
+            "aura_level": rng.randint(0, 300),
+            "energy_current": rng.randint(0, 100),
+            "energy_max": 100,
+            "power_current": rng.randint(5, 40),
+            "current_guild": guild,
+            "state": "READY",
+            "last_update": _iso(last_update),
+            "last_energy_refresh": _iso(last_update - timedelta(hours=rng.uniform(0, 40))),
+            "mission_history": history,
+            "missions_completed": rng.randint(0, 200),
+        },
+    }
+
+
+def generate_dataset(data_dir, wallets, heroes, seed=1):
+    """
+    Escribe players.json / stats.json / guilds.json en data_dir.
+    Los token_id recorren la colección real (1..35000) en orden, así los
+    héroes tienen metadata base; si wallets*heroes > 35000 se repiten.
+    Devuelve (lista de wallets, {wallet: [token_id, ...]}).
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    supply = len([n for n in os.listdir(METADATA_DIR) if n.endswith(".json")]) or 35000
+
+    players, owned = {}, {}
+    n = 0
+    for w in range(wallets):
+        wallet = f"0xbench{w:06d}"
+        hero_list = []
+        for _ in range(heroes):
+            hero_list.append(make_hero(rng, f"{n % supply + 1:05d}", now))
+            n += 1
+        players[wallet] = {
+            "wallet": wallet,
+            "heroes": hero_list,
+            "totals": {
+                "heroes_count": len(hero_list),
+                "xp_total_all": sum(h["dynamic_state"]["xp_total"] for h in hero_list),
+                "aura_total_all": sum(h["dynamic_state"]["aura_level"] for h in hero_list),
+                "energy_total_available": sum(h["dynamic_state"]["energy_current"] for h in hero_list),
+            },
+        }
+        owned[wallet] = [h["token_id"] for h in hero_list]
+
+    members = {}
+    for pobj in players.values():
+        for h in pobj["heroes"]:
+            g = members.setdefault(h["guild"], [0, 0, 0])
+            g[0] += 1
+            g[1] += h["dynamic_state"]["xp_total"]
+            g[2] += h["dynamic_state"]["aura_level"]
+
+    guilds = []
+    for name, _ in GUILDS:
+        count, xp, aura = members.get(name, [0, 0, 0])
+        guilds.append({
+            "name": name,
+            "flavor": "",
+            "members": count,
+            "avg_xp": round(xp / count, 2) if count else 0,
+            "avg_aura": round(aura / count, 2) if count else 0,
+            "badge": f"img/{name.lower().replace(' ', '_')}.JPG",
+        })
+    stats = {
+        "total_characters": supply,
+        "active_guilds": len(GUILDS),
+        "missions_completed": 0,
+        "missions_failed": 0,
+        "total_exp_collected": 0,
+        "total_aura_collected": 0,
+        "guild_ranking": {name: {"xp": 0, "aura": 0, "successes": 0, "failures": 0} for name, _ in GUILDS},
+    }
+
+    for fname, obj in (("players.json", players), ("stats.json", stats), ("guilds.json", guilds)):
+        with open(os.path.join(data_dir, fname), "w", encoding="utf-8") as f:
+            json.dump(obj, f)
+    return list(players), owned
+
+
+# ---------------------------------
+# Mezclas de requests
+# ---------------------------------
+
+class RequestMix:
+    """
+    routes(): nombre de ruta -> fábrica que devuelve (method, path, json_body)
+    con parámetros al azar sobre el dataset. weights(mix): peso de cada ruta.
+    """
+
+    def __init__(self, wallets, owned, supply, assets):
+        self.wallets = wallets
+        self.owned = owned
+        self.supply = supply
+        self.assets = assets or ["/img/logo-site.png"]
+
+    def _wallet(self, rng):
+        return rng.choice(self.wallets)
+
+    def _token(self, rng):
+        return f"{rng.randint(1, self.supply):05d}"
+
+    def _owned(self, rng):
+        wallet = self._wallet(rng)
+        return wallet, rng.choice(self.owned[wallet])
+
+    def routes(self):
+        return {
+            "GET /": lambda rng: ("GET", "/", None),
+            "GET /mint": lambda rng: ("GET", "/mint", None),
+            "GET asset": lambda rng: ("GET", rng.choice(self.assets), None),
+            "GET /api/stats": lambda rng: ("GET", "/api/stats", None),
+            "GET /api/guilds": lambda rng: ("GET", "/api/guilds", None),
+            "GET /api/missions": lambda rng: ("GET", "/api/missions", None),
+            "GET /api/leaderboard": lambda rng: (
+                "GET",
+                f"/api/leaderboard?by={rng.choice(['xp', 'aura', 'missions'])}"
+                f"&scope={rng.choice(['wallet', 'hero'])}&page={rng.randint(1, 20)}",
+                None,
+            ),
+            "GET /api/leaderboard/rank": lambda rng: ("GET", f"/api/leaderboard/rank?wallet={self._wallet(rng)}", None),
+            "GET /api/player/<wallet>": lambda rng: ("GET", f"/api/player/{self._wallet(rng)}", None),
+            "POST /api/player/spend_xp_for_energy": self._spend,
+            "POST /api/mission/execute": self._execute,
+            "POST /api/mission/batch": self._batch,
+            "GET /api/metadata/<token_id>": lambda rng: ("GET", f"/api/metadata/{self._token(rng)}", None),
+            "GET /api/metadata/batch": self._metadata_batch,
+            "GET /api/metadata/stream": self._metadata_stream,
+        }
+
+    def _spend(self, rng):
+        wallet, token_id = self._owned(rng)
+        return "POST", "/api/player/spend_xp_for_energy", {
+            "wallet": wallet, "hero_id": token_id, "energy_request": rng.randint(1, 5)
+        }
+
+    def _execute(self, rng):
+        wallet, token_id = self._owned(rng)
+        return "POST", "/api/mission/execute", {
+            "wallet": wallet, "hero_id": token_id, "mission_id": rng.choice(MISSION_IDS)
+        }
+
+    def _batch(self, rng):
+        wallet = self._wallet(rng)
+        pairs = [{"hero_id": t, "mission_id": rng.choice(MISSION_IDS)} for t in self.owned[wallet]]
+        return "POST", "/api/mission/batch", {"wallet": wallet, "missions": pairs}
+
+    def _metadata_batch(self, rng):
+        start = rng.randint(1, max(1, self.supply - 50))
+        return "GET", f"/api/metadata/batch?start={start}&end={start + 49}", None
+
+    def _metadata_stream(self, rng):
+        start = rng.randint(1, max(1, self.supply - 200))
+        return "GET", f"/api/metadata/stream?start={start}&end={start + 199}", None
+
+    def weights(self, mix):
+        if mix == "marketplace":
+            return {
+                "GET /api/metadata/<token_id>": 70,
+                "GET /api/metadata/batch": 15,
+                "GET /api/metadata/stream": 5,
+                "GET asset": 10,
+            }
+        if mix == "dashboard":
+            return {
+                "GET /": 10,
+                "GET /api/stats": 25,
+                "GET /api/guilds": 10,
+                "GET /api/missions": 10,
+                "GET /api/player/<wallet>": 25,
+                "GET /api/leaderboard": 10,
+                "GET /api/leaderboard/rank": 5,
+                "GET asset": 5,
+            }
+        if mix == "missions":
+            return {
+                "POST /api/mission/execute": 60,
+                "POST /api/mission/batch": 10,
+                "POST /api/player/spend_xp_for_energy": 15,
+                "GET /api/player/<wallet>": 15,
+            }
+        if mix == "all":
+            return {name: 1 for name in self.routes()}
+        raise ValueError(f"unknown mix: {mix}")
+
+    def sampler(self, mix, seed):
+        routes = self.routes()
+        weights = self.weights(mix)
+        names = list(weights)
+        cum = []
+        total = 0
+        for name in names:
+            total += weights[name]
+            cum.append(total)
+        rng = random.Random(seed)
+
+        def sample():
+            x = rng.uniform(0, total)
+            for name, c in zip(names, cum):
+                if x <= c:
+                    break
+            return (name,) + routes[name](rng)
+
+        return sample
+
+
+# ---------------------------------
+# Drivers
+# ---------------------------------
+
+class ClientDriver:
+    """Flask test client en proceso: mide el costo de la app sin red."""
+
+    def __init__(self, data_dir):
+        os.environ["EMBERHOLM_DATA_DIR"] = data_dir
+        os.environ["EMBERHOLM_METADATA_DIR"] = METADATA_DIR
+        sys.path.insert(0, HERE)
+        from app import app
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, body):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        r = client.open(path, method=method, json=body)
+        size = len(r.get_data())
+        r.close()
+        return r.status_code, size
+
+    def get_text(self, path):
+        r = self.app.test_client().get(path)
+        return r.get_data(as_text=True)
+
+    def close(self):
+        # flush antes de borrar el directorio (si no, lo intenta atexit y falla)
+        from app import guild_stats, stats_aggregator
+        stats_aggregator.flush()
+        guild_stats.flush()
+
+
+class GunicornDriver:
+    """gunicorn real en un puerto libre + una conexión keep-alive por hilo."""
+
+    def __init__(self, data_dir, workers, threads, timeout=60):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        env = dict(os.environ, EMBERHOLM_DATA_DIR=data_dir, EMBERHOLM_METADATA_DIR=METADATA_DIR)
+        self.proc = subprocess.Popen(
+            [
+                sys.executable, "-m", "gunicorn", "app:app",
+                "--bind", f"127.0.0.1:{self.port}",
+                "--workers", str(workers), "--threads", str(threads),
+                "--log-level", "warning",
+            ],
+            cwd=HERE, env=env,
+        )
+        self._local = threading.local()
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                if self.request("GET", "/api/missions", None)[0] == 200:
+                    return
+            except OSError:
+                self._local.conn = None
+            if self.proc.poll() is not None:
+                raise RuntimeError("gunicorn exited during startup")
+            time.sleep(0.2)
+        self.close()
+        raise RuntimeError("gunicorn did not come up")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=120)
+        return conn
+
+    def request(self, method, path, body):
+        headers = {"Accept-Encoding": "gzip"}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        conn = self._conn()
+        try:
+            conn.request(method, path, body=payload, headers=headers)
+            r = conn.getresponse()
+            data = r.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            self._local.conn = None
+            raise
+        return r.status, len(data)
+
+    def get_text(self, path):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        conn.request("GET", path)
+        text = conn.getresponse().read().decode("utf-8", "replace")
+        conn.close()
+        return text
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.send_signal(signal.SIGTERM)
+            try:
+                self.proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+
+# ---------------------------------
+# Corrida + reporte
+# ---------------------------------
+
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return 0.0
+    k = max(0, min(len(sorted_vals) - 1, int(round(p / 100.0 * len(sorted_vals) + 0.5)) - 1))
+    return sorted_vals[k]
+
+
+def summarize(samples, elapsed):
+    """samples: [(latencia_s, status, bytes)] -> dict con ms."""
+    lat = sorted(s[0] * 1000 for s in samples)
+    statuses = {}
+    for _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    errors = sum(n for st, n in statuses.items() if st == "error" or st.startswith("5"))
+    return {
+        "count": len(samples),
+        "errors": errors,
+        "statuses": statuses,
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "bytes": sum(s[2] for s in samples),
+        "mean_ms": round(sum(lat) / len(lat), 3) if lat else 0.0,
+        "p50_ms": round(percentile(lat, 50), 3),
+        "p95_ms": round(percentile(lat, 95), 3),
+        "p99_ms": round(percentile(lat, 99), 3),
+        "max_ms": round(lat[-1], 3) if lat else 0.0,
+    }
+
+
+def run_load(driver, sampler_factory, concurrency, total_requests, duration, warmup):
+    results = {}
+    lock = threading.Lock()
+    counter = {"issued": 0}
+    stop_at = [None]
+
+    def take():
+        with lock:
+            if total_requests and counter["issued"] >= total_requests:
+                return False
+            counter["issued"] += 1
+            return True
+
+    def worker(idx):
+        sample = sampler_factory(idx)
+        local = {}
+        for _ in range(warmup):
+            _, method, path, body = sample()
+            try:
+                driver.request(method, path, body)
+            except Exception:
+                pass
+        while True:
+            if stop_at[0] is not None and time.perf_counter() >= stop_at[0]:
+                break
+            if not take():
+                break
+            name, method, path, body = sample()
+            t0 = time.perf_counter()
+            try:
+                status, size = driver.request(method, path, body)
+            except Exception:
+                status, size = "error", 0
+            local.setdefault(name, []).append((time.perf_counter() - t0, status, size))
+        with lock:
+            for name, samples in local.items():
+                results.setdefault(name, []).extend(samples)
+
+    t0 = time.perf_counter()
+    if duration:
+        stop_at[0] = t0 + duration
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - t0
+
+    all_samples = [s for samples in results.values() for s in samples]
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "overall": summarize(all_samples, elapsed),
+        "routes": {name: summarize(samples, elapsed) for name, samples in sorted(results.items())},
+    }
+
+
+def compare(base_path, new_path):
+    with open(base_path, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+
+    def diff(a, b):
+        out = {}
+        for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            va, vb = a.get(key, 0), b.get(key, 0)
+            out[key] = {"base": va, "new": vb, "change_pct": round((vb - va) / va * 100, 1) if va else None}
+        return out
+
+    report = {"overall": diff(base["overall"], new["overall"]), "routes": {}}
+    for name in sorted(set(base["routes"]) | set(new["routes"])):
+        if name in base["routes"] and name in new["routes"]:
+            report["routes"][name] = diff(base["routes"][name], new["routes"][name])
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default="client", choices=["client", "gunicorn"])
+    parser.add_argument("--mix", default="dashboard", choices=["marketplace", "dashboard", "missions", "all"])
+    parser.add_argument("--wallets", type=int, default=1000)
+    parser.add_argument("--heroes", type=int, default=3, help="héroes por wallet")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000, help="total de requests (0 = sólo --duration)")
+    parser.add_argument("--duration", type=float, default=0, help="segundos (gana el primero que se cumpla)")
+    parser.add_argument("--warmup", type=int, default=5, help="requests por hilo antes de medir")
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "json", "memory"])
+    parser.add_argument("--workers", type=int, default=2, help="workers de gunicorn")
+    parser.add_argument("--threads", type=int, default=4, help="threads por worker de gunicorn")
+    parser.add_argument("--no-pack", action="store_true", help="no compilar metadata.pack (archivos sueltos)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="guardar el reporte JSON en este archivo")
+    parser.add_argument("--keep", action="store_true", help="no borrar el directorio temporal")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="comparar dos reportes y salir")
+    args = parser.parse_args()
+
+    if args.compare:
+        print(json.dumps(compare(*args.compare), indent=2))
+        return
+    if not args.requests and not args.duration:
+        parser.error("--requests 0 requires --duration")
+
+    data_dir = tempfile.mkdtemp(prefix="emberholm-bench-")
+    os.environ["EMBERHOLM_PLAYER_STORE"] = args.backend
+    os.environ.setdefault("EMBERHOLM_FSYNC", "always")
+
+    t_gen = time.perf_counter()
+    wallets, owned = generate_dataset(data_dir, args.wallets, args.heroes, seed=args.seed)
+    supply = len([n for n in os.listdir(METADATA_DIR) if n.endswith(".json")])
+    if not args.no_pack:
+        sys.path.insert(0, HERE)
+        from metadata_pack import build_pack
+        build_pack(METADATA_DIR, os.path.join(data_dir, "metadata.pack"))
+    gen_s = time.perf_counter() - t_gen
+
+    driver = None
+    try:
+        t_start = time.perf_counter()
+        if args.target == "client":
+            driver = ClientDriver(data_dir)
+        else:
+            driver = GunicornDriver(data_dir, args.workers, args.threads)
+        startup_s = time.perf_counter() - t_start
+
+        # URLs reales de assets (con fingerprint) sacadas de las páginas
+        assets = sorted(set(re.findall(r'"(/assets/[^"]+)"', driver.get_text("/") + driver.get_text("/mint"))))
+        mix = RequestMix(wallets, owned, supply, assets)
+        report = run_load(
+            driver,
+            lambda idx: mix.sampler(args.mix, args.seed * 1000 + idx),
+            args.concurrency, args.requests, args.duration, args.warmup,
+        )
+    finally:
+        if driver is not None:
+            driver.close()
+        if not args.keep:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        "config": {
+            "target": args.target,
+            "mix": args.mix,
+            "wallets": args.wallets,
+            "heroes_per_wallet": args.heroes,
+            "concurrency": args.concurrency,
+            "backend": args.backend,
+            "workers": args.workers if args.target == "gunicorn" else None,
+            "threads": args.threads if args.target == "gunicorn" else None,
+            "metadata_pack": not args.no_pack,
+            "seed": args.seed,
+            "python": sys.version.split()[0],
+            "timestamp": _iso(datetime.utcnow()),
+        },
+        "setup": {"generate_s": round(gen_s, 3), "startup_s": round(startup_s, 3)},
+        **report,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
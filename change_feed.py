@@ -0,0 +1,152 @@
+import os
+import sqlite3
+import threading
+import time
+
+# ---------------------------------
+# Feed de cambios de tokens (dynamic_state)
+# ---------------------------------
+#
+# Cada commit de una wallet agrega a data/changes.db una fila por token cuyo
+# dynamic_state cambió (misión, spend, pasivo materializado, alta):
+#   changes(seq, token_id, t)   seq = cursor, creciente entre todos los workers
+# Un marketplace pide /api/metadata/changes?since=<cursor> y refresca sólo
+# esos tokenURI; next_cursor es el seq de la última fila que vio.
+#
+# Compactación: una fila vieja de un token que volvió a cambiar después ya
+# no aporta nada (cualquier cursor anterior ve la nueva), así que se borra.
+# Queda a lo sumo una fila por token: la tabla no crece con el tiempo y un
+# cursor viejo (o since=0) sigue siendo válido.
+# El pasivo que se acumula sin escrituras no pasa por acá: aparece cuando el
+# próximo commit de la wallet lo materializa.
+
+COMPACT_EVERY = 5000  # appends de este worker entre compactaciones
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS changes (
+    seq      INTEGER PRIMARY KEY AUTOINCREMENT,
+    token_id TEXT    NOT NULL,
+    t        REAL    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_token_seq ON changes (token_id, seq);
+"""
+
+
+def changed_tokens(events):
+    """token_ids tocados por los eventos de un commit (formato de journal.py), sin repetir."""
+    tokens = {}
+    for ev in events:
+        if ev.get("k") == "create":
+            for hero in ev.get("p", {}).get("heroes", []):
+                tokens[hero.get("token_id")] = None
+        elif ev.get("h") is not None:
+            tokens[ev["h"]] = None
+    tokens.pop(None, None)
+    return list(tokens)
+
+
+class ChangeFeed:
+    """
+    Log compacto en SQLite (WAL): varios workers agregan y leen a la vez.
+    Una conexión por hilo/proceso, como SQLitePlayerStore.
+    """
+
+    def __init__(self, path, compact_every=COMPACT_EVERY):
+        self.path = path
+        self.compact_every = compact_every
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._appended = 0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def append(self, token_ids, now=None):
+        if not token_ids:
+            return
+        now = time.time() if now is None else now
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO changes (token_id, t) VALUES (?, ?)",
+                [(str(t).zfill(5), now) for t in token_ids],
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+        with self._lock:
+            self._appended += len(token_ids)
+            due = self._appended >= self.compact_every
+            if due:
+                self._appended = 0
+        if due:
+            self.compact()
+
+    def compact(self):
+        """Borra las filas superadas por una más nueva del mismo token. Devuelve cuántas."""
+        conn = self._conn()
+        cur = conn.execute(
+            "DELETE FROM changes WHERE seq < "
+            "(SELECT MAX(c.seq) FROM changes c WHERE c.token_id = changes.token_id)"
+        )
+        return cur.rowcount
+
+    def vacuum(self):
+        self._conn().execute("VACUUM")
+
+    def latest(self):
+        (seq,) = self._conn().execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()
+        return seq
+
+    def since(self, cursor, limit):
+        """
+        Cambios con seq > cursor, en orden: ([{"token_id", "seq", "changed_at"}], next_cursor, has_more).
+        Un token que aparece dos veces en la página queda sólo con su cambio más nuevo.
+        """
+        rows = self._conn().execute(
+            "SELECT seq, token_id, t FROM changes WHERE seq > ? ORDER BY seq LIMIT ?",
+            (cursor, limit + 1),
+        ).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        last = {token_id: seq for seq, token_id, _ in rows}
+        items = [
+            {"token_id": token_id, "seq": seq, "changed_at": t}
+            for seq, token_id, t in rows if last[token_id] == seq
+        ]
+        return items, (rows[-1][0] if rows else cursor), has_more
+
+    def stats(self):
+        (rows, tokens) = self._conn().execute("SELECT COUNT(*), COUNT(DISTINCT token_id) FROM changes").fetchone()
+        return {"rows": rows, "tokens": tokens, "latest": self.latest()}
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    data_dir = os.environ.get("EMBERHOLM_DATA_DIR", os.path.join(here, "data"))
+    parser = argparse.ArgumentParser(description="Mantenimiento de data/changes.db (feed de tokens cambiados).")
+    parser.add_argument("command", choices=["compact", "stats"])
+    parser.add_argument("--db", default=os.environ.get("EMBERHOLM_CHANGES_DB", os.path.join(data_dir, "changes.db")))
+    args = parser.parse_args()
+
+    feed = ChangeFeed(args.db)
+    if args.command == "compact":
+        removed = feed.compact()
+        feed.vacuum()
+        print(f"{removed} superseded rows removed")
+    print(json.dumps(feed.stats(), indent=2))
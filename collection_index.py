@@ -0,0 +1,466 @@
+import json
+import os
+from bisect import bisect_left, bisect_right
+import threading
+import time
+import zlib
+from array import array
+
+from metadata_pack import normalize_base_metadata
+from state_commit import atomic_write_json
+
+# ---------------------------------
+# Columnas de la colección (metadata base normalizada)
+# ---------------------------------
+#
+# Una pasada sobre los 35k tokens arma una tabla columnar: por cada campo
+# normalizado una lista alineada con token_nums. Categóricos como código
+# entero (race/class/rarity/starting_guild), numéricos como int.
+# Se cachea en data/collection.json con un "stamp" por token (crc del pack,
+# o mtime del archivo suelto) y al abrir se re-extraen sólo los tokens
+# cuyo stamp cambió.
+
+CATEGORICAL = ("race", "class", "rarity", "starting_guild")
+NUMERIC     = ("age", "str", "dex", "con", "int", "wis", "cha")
+
+CACHE_FORMAT = 1
+
+
+def _as_int(val):
+    try:
+        return int(val)
+    except (TypeError, ValueError):
+        return 0
+
+
+class CollectionColumns:
+    """
+    token_nums[i]           -> número de token de la fila i (ordenado)
+    categorical[f]["values"]-> valores distintos (código -> texto)
+    categorical[f]["codes"] -> código por fila
+    numeric[f]              -> valor por fila
+    version sube en cada cambio (los índices derivados se rearman con eso);
+    fingerprint identifica el contenido entre procesos/arranques.
+    """
+
+    def __init__(self, pack, metadata_dir, cache_path, recheck_seconds=300):
+        self.pack = pack
+        self.metadata_dir = metadata_dir
+        self.cache_path = cache_path
+        self.recheck_seconds = recheck_seconds
+        self.version = 0
+        self.fingerprint = None
+        self.token_nums = []
+        self.stamps = []
+        self.categorical = {f: {"values": [], "codes": []} for f in CATEGORICAL}
+        self.numeric = {f: [] for f in NUMERIC}
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._checked_at = 0.0
+
+    # --- fuente ---
+
+    def _current_stamps(self):
+        """{token_num: stamp} de la fuente que usa la app (pack o archivos)."""
+        if self.pack is not None and self.pack.available:
+            return dict(self.pack.iter_crcs())
+        stamps = {}
+        try:
+            entries = os.scandir(self.metadata_dir)
+        except OSError:
+            return stamps
+        with entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                if ext == ".json" and stem.isdigit():
+                    stamps[int(stem)] = entry.stat().st_mtime_ns
+        return stamps
+
+    def _extract(self, token_num):
+        token_id = f"{token_num:05d}"
+        meta = self.pack.get(token_id) if self.pack is not None and self.pack.available else None
+        if meta is None:
+            path = os.path.join(self.metadata_dir, f"{token_id}.json")
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    meta = normalize_base_metadata(token_id, json.load(f))
+            except (OSError, ValueError):
+                return None
+        return meta
+
+    # --- cache en disco ---
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get("format") != CACHE_FORMAT:
+            return {}
+        rows = {}
+        cat = data["categorical"]
+        for i, token_num in enumerate(data["token_nums"]):
+            row = {f: cat[f]["values"][cat[f]["codes"][i]] for f in CATEGORICAL}
+            row.update({f: data["numeric"][f][i] for f in NUMERIC})
+            rows[token_num] = (data["stamps"][i], row)
+        return rows
+
+    def _save_cache(self):
+        if not self.cache_path:
+            return
+        try:
+            atomic_write_json(self.cache_path, {
+                "format": CACHE_FORMAT,
+                "token_nums": self.token_nums,
+                "stamps": self.stamps,
+                "categorical": self.categorical,
+                "numeric": self.numeric,
+            }, indent=None, fsync="never")
+        except OSError:
+            pass  # sin cache en disco: se recalcula en el próximo arranque
+
+    # --- refresh incremental ---
+
+    def _rows(self):
+        rows = {}
+        for i, token_num in enumerate(self.token_nums):
+            row = {f: self.categorical[f]["values"][self.categorical[f]["codes"][i]] for f in CATEGORICAL}
+            row.update({f: self.numeric[f][i] for f in NUMERIC})
+            rows[token_num] = (self.stamps[i], row)
+        return rows
+
+    def _set_rows(self, rows):
+        self.token_nums = sorted(rows)
+        self.stamps = [rows[n][0] for n in self.token_nums]
+        for f in CATEGORICAL:
+            values = sorted({rows[n][1][f] for n in self.token_nums})
+            lookup = {v: code for code, v in enumerate(values)}
+            self.categorical[f] = {"values": values, "codes": [lookup[rows[n][1][f]] for n in self.token_nums]}
+        for f in NUMERIC:
+            self.numeric[f] = [rows[n][1][f] for n in self.token_nums]
+        crc = zlib.crc32(array("q", self.token_nums).tobytes())
+        self.fingerprint = f"{zlib.crc32(array('q', self.stamps).tobytes(), crc):08x}-{len(self.token_nums)}"
+        self.version += 1
+
+    def refresh(self, force=False):
+        """
+        Compara stamps con la fuente y re-extrae sólo lo que cambió.
+        Devuelve (cambiados, borrados).
+        """
+        with self._lock:
+            if not self._loaded:
+                rows = self._load_cache()
+            else:
+                if not force and time.monotonic() - self._checked_at < self.recheck_seconds:
+                    return 0, 0
+                rows = self._rows()
+            self._checked_at = time.monotonic()
+
+            current = self._current_stamps()
+            changed = [n for n, stamp in current.items() if n not in rows or rows[n][0] != stamp]
+            removed = [n for n in rows if n not in current]
+            for token_num in removed:
+                del rows[token_num]
+            for token_num in changed:
+                meta = self._extract(token_num)
+                if meta is None:
+                    rows.pop(token_num, None)
+                    continue
+                row = {f: str(meta.get(f, "Unknown")) for f in CATEGORICAL}
+                row.update({f: _as_int(meta.get(f)) for f in NUMERIC})
+                rows[token_num] = (current[token_num], row)
+
+            if changed or removed or not self._loaded:
+                self._set_rows(rows)
+                if changed or removed:
+                    self._save_cache()
+            self._loaded = True
+            return len(changed), len(removed)
+
+    def ensure(self):
+        """Carga (cache + diff) la primera vez; después re-chequea cada recheck_seconds."""
+        self.refresh()
+        return self
+
+    def snapshot(self):
+        """
+        (version, token_nums, categorical, numeric) de una misma versión:
+        _set_rows reemplaza las listas en vez de mutarlas, así que una copia
+        superficial bajo el lock no cambia aunque después haya un refresh.
+        """
+        with self._lock:
+            return self.version, self.token_nums, dict(self.categorical), dict(self.numeric)
+
+    def __len__(self):
+        return len(self.token_nums)
+
+    def row(self, i):
+        out = {"token_id": f"{self.token_nums[i]:05d}"}
+        for f in CATEGORICAL:
+            out[f] = self.categorical[f]["values"][self.categorical[f]["codes"][i]]
+        for f in NUMERIC:
+            out[f] = self.numeric[f][i]
+        return out
+
+
+# ---------------------------------
+# Índice de búsqueda (bitmaps + arrays ordenados)
+# ---------------------------------
+#
+# - Categóricos: un bitmap por valor (int de Python, bit i = fila i).
+#   AND/OR entre filtros = & / | sobre enteros de ~4.4 KB.
+# - Numéricos: valores distintos ordenados + bitmap por valor; un rango
+#   min..max es bisect + OR de los bitmaps del rango. Además, el orden de
+#   filas por ese campo (para sort=campo) ya calculado.
+
+# bits puestos en cada byte, para recorrer un bitmap sin desarmarlo bit a bit
+_BYTE_BITS = [tuple(b for b in range(8) if (n >> b) & 1) for n in range(256)]
+
+
+def _popcount(bits):
+    return bits.bit_count() if hasattr(bits, "bit_count") else bin(bits).count("1")
+
+
+def _bitmap_from_codes(codes, n_values):
+    masks = [bytearray((len(codes) + 7) // 8) for _ in range(n_values)]
+    for i, code in enumerate(codes):
+        masks[code][i >> 3] |= 1 << (i & 7)
+    return [int.from_bytes(m, "little") for m in masks]
+
+
+class QueryError(ValueError):
+    pass
+
+
+class _IndexSnapshot:
+    """
+    Índice de una versión de las columnas, armado entero antes de publicarse
+    y nunca modificado después: una búsqueda lee siempre uno solo.
+    """
+
+    __slots__ = (
+        "version", "size", "all_bits", "cat_bits", "cat_lookup", "num_values", "num_bits", "num_order",
+        "token_nums", "categorical", "numeric",
+    )
+
+    def __init__(self, version, token_nums, categorical, numeric):
+        n = len(token_nums)
+        self.version = version
+        self.token_nums = token_nums
+        self.categorical = categorical
+        self.numeric = numeric
+        self.size = n
+        self.all_bits = (1 << n) - 1
+        self.cat_bits = {}
+        self.cat_lookup = {}
+        for f in CATEGORICAL:
+            values = categorical[f]["values"]
+            self.cat_bits[f] = _bitmap_from_codes(categorical[f]["codes"], len(values))
+            self.cat_lookup[f] = {v.lower(): code for code, v in enumerate(values)}
+
+        self.num_values = {}
+        self.num_bits = {}
+        self.num_order = {}
+        for f in NUMERIC:
+            column = numeric[f]
+            distinct = sorted(set(column))
+            lookup = {v: k for k, v in enumerate(distinct)}
+            self.num_values[f] = distinct
+            self.num_bits[f] = _bitmap_from_codes([lookup[v] for v in column], len(distinct))
+            self.num_order[f] = sorted(range(n), key=column.__getitem__)
+
+    def row(self, i):
+        out = {"token_id": f"{self.token_nums[i]:05d}"}
+        for f in CATEGORICAL:
+            out[f] = self.categorical[f]["values"][self.categorical[f]["codes"][i]]
+        for f in NUMERIC:
+            out[f] = self.numeric[f][i]
+        return out
+
+
+class CollectionIndex:
+
+    def __init__(self, columns):
+        self.columns = columns
+        self._lock = threading.Lock()
+        self._snap = None
+
+    def _ensure(self):
+        """Snapshot vigente; si las columnas cambiaron se arma uno nuevo y se publica con una asignación."""
+        self.columns.ensure()
+        snap = self._snap
+        if snap is None or snap.version != self.columns.version:
+            with self._lock:
+                snap = self._snap
+                if snap is None or snap.version != self.columns.version:
+                    snap = self._snap = _IndexSnapshot(*self.columns.snapshot())
+        return snap
+
+    # --- filtros ---
+
+    def _categorical(self, snap, field, values):
+        if isinstance(values, str):
+            values = [v for v in values.split(",") if v.strip()]
+        bits = 0
+        for v in values:
+            code = snap.cat_lookup[field].get(str(v).strip().lower())
+            if code is not None:
+                bits |= snap.cat_bits[field][code]
+        return bits
+
+    def _numeric(self, snap, field, lo=None, hi=None, eq=None):
+        distinct = snap.num_values[field]
+        if eq is not None:
+            lo = hi = eq
+        start = 0 if lo is None else bisect_left(distinct, lo)
+        stop = len(distinct) if hi is None else bisect_right(distinct, hi)
+        bits = 0
+        for k in range(start, stop):
+            bits |= snap.num_bits[field][k]
+        return bits
+
+    def _eval(self, snap, node):
+        """
+        node:
+          {"and": [nodo, ...]} / {"or": [nodo, ...]}
+          {"race": "Gith"} / {"rarity": ["Rare", "Epic"]}     (OR dentro del campo)
+          {"int": {"gte": 15}} / {"age": {"gte": 20, "lte": 40}} / {"str": 12}
+        Un dict con varios campos es AND entre ellos.
+        """
+        if not isinstance(node, dict):
+            raise QueryError("filter must be an object")
+        bits = snap.all_bits
+        for key, val in node.items():
+            if key in ("and", "or"):
+                if not isinstance(val, list):
+                    raise QueryError(f"'{key}' needs a list")
+                parts = [self._eval(snap, child) for child in val]
+                if key == "and":
+                    sub = snap.all_bits
+                    for p in parts:
+                        sub &= p
+                else:
+                    sub = 0
+                    for p in parts:
+                        sub |= p
+            elif key in CATEGORICAL:
+                sub = self._categorical(snap, key, val if isinstance(val, (list, str)) else [val])
+            elif key in NUMERIC:
+                try:
+                    if isinstance(val, dict):
+                        sub = self._numeric(
+                            snap, key,
+                            lo=int(val["gte"]) if "gte" in val else None,
+                            hi=int(val["lte"]) if "lte" in val else None,
+                            eq=int(val["eq"]) if "eq" in val else None,
+                        )
+                    else:
+                        sub = self._numeric(snap, key, eq=int(val))
+                except (TypeError, ValueError):
+                    raise QueryError(f"invalid value for {key}")
+            else:
+                raise QueryError(f"unknown field: {key}")
+            bits &= sub
+        return bits
+
+    # --- resultados ---
+
+    def _iter_positions(self, data):
+        for byte_i, byte in enumerate(data):
+            if byte:
+                base = byte_i << 3
+                for b in _BYTE_BITS[byte]:
+                    yield base + b
+
+    def _page_positions(self, snap, bits, sort, descending, offset, limit):
+        data = bits.to_bytes((snap.size + 7) // 8, "little")
+        if sort in (None, "token_id"):
+            positions = self._iter_positions(data)
+            if descending:
+                positions = reversed(list(positions))
+        elif sort in NUMERIC:
+            order = snap.num_order[sort]
+            positions = (p for p in (reversed(order) if descending else order) if data[p >> 3] >> (p & 7) & 1)
+        else:
+            raise QueryError(f"cannot sort by {sort}")
+        out = []
+        for k, p in enumerate(positions):
+            if k < offset:
+                continue
+            if len(out) >= limit:
+                break
+            out.append(p)
+        return out
+
+    def search(self, query=None, sort=None, descending=False, offset=0, limit=50, facets=False):
+        snap = self._ensure()
+        bits = self._eval(snap, query or {})
+        result = {
+            "total": _popcount(bits),
+            "tokens": [snap.row(p) for p in self._page_positions(snap, bits, sort, descending, offset, limit)],
+        }
+        if facets:
+            result["facets"] = {
+                f: {
+                    v: c for v, c in (
+                        (value, _popcount(bits & snap.cat_bits[f][code]))
+                        for code, value in enumerate(snap.categorical[f]["values"])
+                    ) if c
+                }
+                for f in CATEGORICAL
+            }
+        return result
+
+    def fields(self):
+        snap = self._ensure()
+        return {
+            "categorical": {f: list(snap.categorical[f]["values"]) for f in CATEGORICAL},
+            "numeric": {
+                f: {"min": snap.num_values[f][0], "max": snap.num_values[f][-1]} if snap.num_values[f] else {}
+                for f in NUMERIC
+            },
+        }
+
+
+def query_from_args(args):
+    """
+    Query string -> filtro:
+      race=Gith&class=Druid,Wizard&int_min=15&age_max=40&op=and|or
+    Cada campo es un filtro; op decide si se combinan con AND (default) u OR.
+    """
+    parts = []
+    for f in CATEGORICAL:
+        if args.get(f):
+            parts.append({f: args.get(f)})
+    for f in NUMERIC:
+        rng = {}
+        for suffix, key in (("_min", "gte"), ("_max", "lte")):
+            if args.get(f + suffix) not in (None, ""):
+                rng[key] = args.get(f + suffix)
+        if args.get(f) not in (None, ""):
+            rng["eq"] = args.get(f)
+        if rng:
+            parts.append({f: rng})
+    op = args.get("op", "and")
+    if op not in ("and", "or"):
+        raise QueryError("op must be 'and' or 'or'")
+    return {op: parts} if parts else {}
+
+
+if __name__ == "__main__":
+    import argparse
+    from metadata_pack import MetadataPack
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Arma / refresca data/collection.json (columnas de la colección).")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--metadata-dir", default=os.path.join(here, "data", "metadata"))
+    parser.add_argument("--pack", default=os.path.join(here, "data", "metadata.pack"))
+    parser.add_argument("--cache", default=os.path.join(here, "data", "collection.json"))
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    columns = CollectionColumns(MetadataPack(args.pack), args.metadata_dir, args.cache)
+    changed, removed = columns.refresh(force=True)
+    print(f"{len(columns)} tokens ({changed} extracted, {removed} removed) in {time.perf_counter() - t0:.2f}s -> {args.cache}")
@@ -0,0 +1,420 @@
+"""
+Simulador offline de la economía (XP / Aura / Energía / gremios).
+
+Corre las mismas reglas de progression.py (pasivo diario, refresh de
+energía, costo de RECOVER, cooldown de rotación y la tabla MISSIONS) sobre
+toda la colección a la vez: cada héroe es una posición en arrays de NumPy y
+cada paso de tiempo es un puñado de operaciones vectorizadas, no el loop por
+héroe de app.py. 35k héroes x 365 días tarda unos segundos.
+
+Comportamiento de jugadores (--behaviour): mezcla de perfiles por héroe
+  idle     -> nunca juega, sólo pasivo
+  casual   -> entra ~30% de los días, manda lo que tenga listo
+  daily    -> entra ~90% de los días
+  grinder  -> entra todos los días y gasta XP en energía si le falta
+más --churn (prob. diaria de abandonar) y --return (prob. de volver).
+
+Cambiar reglas: --set PASSIVE_XP_PER_DAY=10 --set ROTATION_HOURS=48,
+--missions otra_tabla.json (misma forma que MISSIONS). Con --baseline corre
+también las reglas actuales con la misma semilla y reporta la diferencia.
+
+Uso:
+    python economy_sim.py --days 365
+    python economy_sim.py --days 180 --behaviour idle:0.4,casual:0.3,daily:0.2,grinder:0.1 --out sim.json
+    python economy_sim.py --days 365 --set XP_COST_PER_ENERGY=3 --baseline
+    python economy_sim.py --days 90 --from-store sqlite   (arranca del estado real de players.db)
+
+Requiere numpy (pip install numpy); la app no lo necesita.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import progression
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HERE     = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(HERE, "data")
+
+RULE_NAMES = (
+    "PASSIVE_XP_PER_DAY",
+    "PASSIVE_AURA_PER_DAY",
+    "ENERGY_FULL_REFRESH_HOURS",
+    "XP_COST_PER_ENERGY",
+    "ROTATION_HOURS",
+)
+# XP / aura / energía son enteros en la app (y arrays int64 acá): sus reglas también
+INT_RULES = ("PASSIVE_XP_PER_DAY", "PASSIVE_AURA_PER_DAY", "XP_COST_PER_ENERGY")
+INT_MISSION_FIELDS = ("energy_cost", "reward_xp", "reward_aura")
+
+# perfil -> (prob. de entrar en cada paso de --step-hours, recupera energía con XP)
+PROFILES = {
+    "idle":    (0.0, False),
+    "casual":  (0.3, False),
+    "daily":   (0.9, False),
+    "grinder": (1.0, True),
+}
+DEFAULT_BEHAVIOUR = "idle:0.45,casual:0.30,daily:0.18,grinder:0.07"
+
+# mismo default que un héroe nuevo en app.py
+ENERGY_MAX = 100
+PERCENTILES = (10, 50, 90, 99)
+
+
+# ---------------------------------
+# Reglas
+# ---------------------------------
+
+def live_rules():
+    rules = {name: getattr(progression, name) for name in RULE_NAMES}
+    rules["MISSIONS"] = [dict(m) for m in progression.MISSIONS]
+    return rules
+
+
+def apply_overrides(rules, sets=(), missions_path=None):
+    rules = dict(rules, MISSIONS=[dict(m) for m in rules["MISSIONS"]])
+    for item in sets:
+        name, _, value = item.partition("=")
+        name = name.strip().upper()
+        if name not in RULE_NAMES:
+            raise SystemExit(f"--set: regla desconocida {name!r} (una de {', '.join(RULE_NAMES)})")
+        try:
+            rules[name] = int(value) if name in INT_RULES else float(value) if "." in value else int(value)
+        except ValueError:
+            kind = "un entero" if name in INT_RULES else "un número"
+            raise SystemExit(f"--set: {name} tiene que ser {kind} (no {value!r})")
+    if missions_path:
+        with open(missions_path, "r", encoding="utf-8") as f:
+            rules["MISSIONS"] = json.load(f)
+        for m in rules["MISSIONS"]:
+            for field in INT_MISSION_FIELDS:
+                if type(m.get(field)) is not int:
+                    raise SystemExit(f"--missions: {m.get('id')!r}.{field} tiene que ser un entero")
+    return rules
+
+
+def parse_behaviour(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, share = part.partition(":")
+        name = name.strip()
+        if name not in PROFILES:
+            raise SystemExit(f"--behaviour: perfil desconocido {name!r} (uno de {', '.join(PROFILES)})")
+        mix[name] = float(share or 0)
+    total = sum(mix.values())
+    if total <= 0:
+        raise SystemExit("--behaviour: las proporciones suman 0")
+    return {k: v / total for k, v in mix.items()}
+
+
+# ---------------------------------
+# Población
+# ---------------------------------
+
+def load_population(heroes, seed):
+    """
+    (guild por héroe como código, nombres de gremio). Usa starting_guild de
+    la colección real (columnas de collection_index); --heroes distinto de
+    35k repite/recorta la colección.
+    """
+    from collection_index import CollectionColumns
+    from metadata_pack import MetadataPack
+
+    columns = CollectionColumns(
+        MetadataPack(os.path.join(DATA_DIR, "metadata.pack")),
+        os.path.join(DATA_DIR, "metadata"),
+        os.path.join(DATA_DIR, "collection.json"),
+    ).ensure()
+    names = columns.categorical["starting_guild"]["values"]
+    codes = np.asarray(columns.categorical["starting_guild"]["codes"], dtype=np.int64)
+    token_nums = np.asarray(columns.token_nums, dtype=np.int64)
+    if not len(codes):
+        raise SystemExit("no hay metadata en data/metadata (ni metadata.pack)")
+    if heroes and heroes != len(codes):
+        pick = np.random.default_rng(seed).integers(0, len(codes), heroes) if heroes > len(codes) \
+            else np.arange(heroes)
+        codes, token_nums = codes[pick], token_nums[pick]
+    return codes, list(names), token_nums
+
+
+def seed_from_store(state, token_nums, backend, rules, now):
+    """Estado inicial de los héroes con dueño desde el player store (vía HeroState)."""
+    from hero_state import US, WalletState
+    from player_store import open_player_store
+
+    store = open_player_store(
+        backend, os.path.join(DATA_DIR, "players.json"), os.path.join(DATA_DIR, "players.db")
+    )
+    position = {int(t): i for i, t in enumerate(token_nums)}
+    now_us = int(now * US)
+    slots = {m["id"]: k for k, m in enumerate(rules["MISSIONS"])}
+    seeded = 0
+    for _, player_obj in store.iter_players():
+        for hero in WalletState.from_dict(player_obj):
+            try:
+                i = position.get(int(hero.token_id))
+            except (TypeError, ValueError):
+                continue
+            if i is None:
+                continue
+            hero.accrue(now_us)
+            state["xp"][i]     = hero.xp_total or 0
+            state["aura"][i]   = hero.aura_level or 0
+            state["energy"][i] = hero.energy_current if hero.energy_current is not None else ENERGY_MAX
+            for mission_id, k in slots.items():
+                last = hero.last_run(mission_id)
+                if last is not None:
+                    state["last_run"][i, k] = (last - now_us) / US
+            seeded += 1
+    return seeded
+
+
+# ---------------------------------
+# Simulación
+# ---------------------------------
+
+def _distribution(arr):
+    arr = np.asarray(arr, dtype=np.float64)
+    if not len(arr):
+        return {}
+    ordered = np.sort(arr)
+    total = ordered.sum()
+    # Gini sobre los valores ordenados (0 = todos iguales, 1 = uno tiene todo)
+    n = len(ordered)
+    gini = float((2 * np.arange(1, n + 1) - n - 1).dot(ordered) / (n * total)) if total > 0 else 0.0
+    out = {
+        "mean": round(float(arr.mean()), 2),
+        "min":  float(ordered[0]),
+        "max":  float(ordered[-1]),
+        "gini": round(gini, 4),
+    }
+    for p in PERCENTILES:
+        out[f"p{p}"] = float(ordered[max(0, int(np.ceil(p / 100 * n)) - 1)])
+    return out
+
+
+def _phase_ticks(t, step, offset, period):
+    """Cuántos múltiplos de period cruza cada héroe entre t-step y t (anchors con fase propia)."""
+    return (t + offset) // period - (t - step + offset) // period
+
+
+def simulate(rules, days, behaviour, guild_codes, guild_names, step_hours=24.0, churn=0.0,
+             ret=0.0, success_rate=1.0, strategy="hardest", seed=1, report_every=30,
+             token_nums=None, from_store=None):
+    rng = np.random.default_rng(seed)
+    n = len(guild_codes)
+    missions = list(rules["MISSIONS"])
+    if strategy == "hardest":
+        order = sorted(range(len(missions)), key=lambda k: -missions[k]["reward_xp"])
+    elif strategy == "easiest":
+        order = sorted(range(len(missions)), key=lambda k: missions[k]["energy_cost"])
+    else:  # efficient: más XP por punto de energía primero
+        order = sorted(range(len(missions)), key=lambda k: -missions[k]["reward_xp"] / max(1, missions[k]["energy_cost"]))
+
+    day_s     = float(progression.DAY_SECONDS)
+    refresh_s = rules["ENERGY_FULL_REFRESH_HOURS"] * 3600.0
+    cooldown  = rules["ROTATION_HOURS"] * 3600.0
+    step      = step_hours * 3600.0
+    xp_cost   = rules["XP_COST_PER_ENERGY"]
+
+    state = {
+        "xp":       np.zeros(n, dtype=np.int64),
+        "aura":     np.zeros(n, dtype=np.int64),
+        "energy":   np.full(n, ENERGY_MAX, dtype=np.int64),
+        "last_run": np.full((n, len(missions)), -np.inf),
+    }
+    seeded = seed_from_store(state, token_nums, from_store, rules, time.time()) if from_store else 0
+    xp, aura, energy, last_run = state["xp"], state["aura"], state["energy"], state["last_run"]
+
+    # perfil fijo por héroe + fase propia de los relojes pasivo / energía
+    names = list(behaviour)
+    profile = rng.choice(len(names), size=n, p=[behaviour[k] for k in names])
+    play_prob = np.array([PROFILES[k][0] for k in names])[profile]
+    recovers  = np.array([PROFILES[k][1] for k in names])[profile]
+    active    = play_prob > 0
+    passive_offset = rng.uniform(0, day_s, n)
+    energy_offset  = rng.uniform(0, refresh_s, n)
+
+    n_guilds = len(guild_names)
+    g_xp_gained   = np.zeros(n_guilds)
+    g_aura_gained = np.zeros(n_guilds)
+    g_success     = np.zeros(n_guilds, dtype=np.int64)
+    g_failure     = np.zeros(n_guilds, dtype=np.int64)
+    mission_runs  = np.zeros(len(missions), dtype=np.int64)
+    totals = {"xp_passive": 0, "xp_missions": 0, "xp_burned_recover": 0, "aura_passive": 0, "aura_missions": 0}
+
+    series = []
+    steps = int(round(days * 24 / step_hours))
+    steps_per_report = max(1, int(round(report_every * 24 / step_hours)))
+    for s in range(1, steps + 1):
+        t = s * step
+
+        # pasivo: +X por cada 24h cruzadas
+        ticks = _phase_ticks(t, step, passive_offset, day_s).astype(np.int64)
+        xp   += ticks * rules["PASSIVE_XP_PER_DAY"]
+        aura += ticks * rules["PASSIVE_AURA_PER_DAY"]
+        totals["xp_passive"]   += int(ticks.sum()) * rules["PASSIVE_XP_PER_DAY"]
+        totals["aura_passive"] += int(ticks.sum()) * rules["PASSIVE_AURA_PER_DAY"]
+        # como en la app: el pasivo no suma al xp_gained / aura_gained del gremio
+
+        # refresh completo de energía
+        refreshed = _phase_ticks(t, step, energy_offset, refresh_s) > 0
+        energy[refreshed] = ENERGY_MAX
+
+        # churn / regreso
+        if churn:
+            active &= rng.random(n) >= churn
+        if ret:
+            active |= (play_prob > 0) & (rng.random(n) < ret)
+        playing = active & (rng.random(n) < play_prob)
+
+        for k in order:
+            m = missions[k]
+            cost = m["energy_cost"]
+            ready = playing & (t - last_run[:, k] >= cooldown)
+
+            # RECOVER: el grinder paga la energía que le falta con XP
+            need = np.where(ready & recovers & (energy < cost), cost - energy, 0)
+            burn = need * xp_cost
+            pay = burn <= xp
+            need, burn = need * pay, burn * pay
+            xp     -= burn
+            energy += need
+            # igual que en la app: gastar baja xp_sum del gremio, no lo ganado
+            totals["xp_burned_recover"] += int(burn.sum())
+
+            run = ready & (energy >= cost)
+            ok  = run & (rng.random(n) < success_rate) if success_rate < 1 else run
+            energy -= cost * run
+            xp     += m["reward_xp"] * ok
+            aura   += m["reward_aura"] * ok
+            last_run[run, k] = t
+            mission_runs[k] += int(run.sum())
+            n_ok = int(ok.sum())
+            totals["xp_missions"]   += n_ok * m["reward_xp"]
+            totals["aura_missions"] += n_ok * m["reward_aura"]
+            g_ok = np.bincount(guild_codes, weights=ok, minlength=n_guilds)
+            g_xp_gained   += g_ok * m["reward_xp"]
+            g_aura_gained += g_ok * m["reward_aura"]
+            g_success     += g_ok.astype(np.int64)
+            g_failure     += np.bincount(guild_codes, weights=run & ~ok, minlength=n_guilds).astype(np.int64)
+
+        if s % steps_per_report == 0 or s == steps:
+            series.append({
+                "day":          round(t / day_s, 2),
+                "active":       int(active.sum()),
+                "xp_mean":      round(float(xp.mean()), 2),
+                "xp_p50":       float(np.median(xp)),
+                "xp_p99":       round(float(np.percentile(xp, 99)), 2),
+                "aura_mean":    round(float(aura.mean()), 2),
+                "energy_mean":  round(float(energy.mean()), 2),
+                "missions":     int(mission_runs.sum()),
+                "xp_in_economy": int(xp.sum()),
+            })
+
+    guilds = []
+    g_members = np.bincount(guild_codes, minlength=n_guilds)
+    g_xp_sum = np.bincount(guild_codes, weights=xp, minlength=n_guilds)
+    g_aura_sum = np.bincount(guild_codes, weights=aura, minlength=n_guilds)
+    for gi, name in enumerate(guild_names):
+        runs = int(g_success[gi] + g_failure[gi])
+        guilds.append({
+            "name":         name,
+            "members":      int(g_members[gi]),
+            "avg_xp":       round(float(g_xp_sum[gi] / g_members[gi]), 2) if g_members[gi] else 0,
+            "avg_aura":     round(float(g_aura_sum[gi] / g_members[gi]), 2) if g_members[gi] else 0,
+            "xp_gained":    int(g_xp_gained[gi]),
+            "aura_gained":  int(g_aura_gained[gi]),
+            "successes":    int(g_success[gi]),
+            "success_rate": round(100 * int(g_success[gi]) / runs) if runs else 0,
+        })
+    # mismo orden que guild_ranking en /api/stats
+    guilds.sort(key=lambda g: -g["xp_gained"])
+    for rank, g in enumerate(guilds, start=1):
+        g["rank"] = rank
+
+    return {
+        "heroes":        n,
+        "seeded_from_store": seeded,
+        "days":          days,
+        "totals":        totals,
+        "missions_run":  {missions[k]["id"]: int(mission_runs[k]) for k in range(len(missions))},
+        "distributions": {"xp": _distribution(xp), "aura": _distribution(aura), "energy": _distribution(energy)},
+        "guild_ranking": guilds,
+        "series":        series,
+    }
+
+
+def diff_reports(base, new):
+    """Cambios relevantes entre dos corridas: medias/percentiles y puestos de gremios."""
+    out = {"distributions": {}, "totals": {}, "guild_rank_changes": []}
+    for key, dist in new["distributions"].items():
+        out["distributions"][key] = {
+            stat: round(val - base["distributions"][key].get(stat, 0), 4) for stat, val in dist.items()
+        }
+    out["totals"] = {k: v - base["totals"].get(k, 0) for k, v in new["totals"].items()}
+    base_rank = {g["name"]: g["rank"] for g in base["guild_ranking"]}
+    for g in new["guild_ranking"]:
+        if base_rank.get(g["name"]) != g["rank"]:
+            out["guild_rank_changes"].append({"name": g["name"], "from": base_rank.get(g["name"]), "to": g["rank"]})
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=float, default=365)
+    parser.add_argument("--heroes", type=int, default=0, help="cantidad de héroes (0 = toda la colección)")
+    parser.add_argument("--behaviour", default=DEFAULT_BEHAVIOUR, help="perfil:proporción,... (idle/casual/daily/grinder)")
+    parser.add_argument("--strategy", default="hardest", choices=["hardest", "easiest", "efficient"],
+                        help="en qué orden manda misiones un jugador que entra")
+    parser.add_argument("--step-hours", type=float, default=24, help="resolución de la simulación")
+    parser.add_argument("--churn", type=float, default=0.0, help="prob. diaria de que un jugador abandone")
+    parser.add_argument("--return", dest="ret", type=float, default=0.0, help="prob. diaria de que vuelva")
+    parser.add_argument("--success-rate", type=float, default=1.0, help="app.py hoy resuelve siempre con éxito")
+    parser.add_argument("--set", action="append", default=[], metavar="REGLA=VALOR")
+    parser.add_argument("--missions", help="JSON con una tabla de misiones alternativa")
+    parser.add_argument("--baseline", action="store_true", help="correr también las reglas actuales y comparar")
+    parser.add_argument("--from-store", choices=["sqlite", "json"], help="arrancar del estado real de los jugadores")
+    parser.add_argument("--report-every", type=float, default=30, help="días entre puntos de la serie")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="guardar el reporte JSON en este archivo")
+    args = parser.parse_args()
+
+    if np is None:
+        raise SystemExit("economy_sim.py necesita numpy: pip install numpy")
+
+    behaviour = parse_behaviour(args.behaviour)
+    guild_codes, guild_names, token_nums = load_population(args.heroes, args.seed)
+    base_rules = live_rules()
+    rules = apply_overrides(base_rules, args.set, args.missions)
+    kwargs = dict(
+        step_hours=args.step_hours, churn=args.churn, ret=args.ret, success_rate=args.success_rate,
+        strategy=args.strategy, seed=args.seed, report_every=args.report_every,
+        token_nums=token_nums, from_store=args.from_store,
+    )
+
+    t0 = time.perf_counter()
+    report = {"rules": {k: v for k, v in rules.items() if k != "MISSIONS"}, "missions": rules["MISSIONS"],
+              "behaviour": behaviour, "result": simulate(rules, args.days, behaviour, guild_codes, guild_names, **kwargs)}
+    if args.baseline:
+        base = simulate(base_rules, args.days, behaviour, guild_codes, guild_names, **kwargs)
+        report["baseline"] = base
+        report["diff"] = diff_reports(base, report["result"])
+    report["elapsed_seconds"] = round(time.perf_counter() - t0, 3)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
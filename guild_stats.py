@@ -0,0 +1,175 @@
+import copy
+import json
+import os
+import re
+import threading
+
+from metrics import count_bytes
+from state_commit import atomic_write_json, file_lock
+from stats_aggregator import StatsAggregator
+
+# ---------------------------------
+# Agregados por gremio (guilds.json con write-behind)
+# ---------------------------------
+#
+# Cada gremio se identifica por un id normalizado ("Circle of Mist" ->
+# "circle-of-mist") y guarda contadores aditivos:
+#   members, xp_sum, aura_sum          -> estado actual de sus héroes
+#   xp_gained, aura_gained             -> lo ganado en misiones (el pasivo no: ordena el ranking)
+#   successes, failures                -> misiones resueltas
+# avg_xp / avg_aura son la media real (xp_sum / members), no una suma
+# corrida. Los handlers suman eventos O(1) al delta del request; el
+# agregador los junta en memoria y guilds.json se reescribe en snapshots
+# periódicos, igual que stats.json.
+
+GUILD_COUNTERS = ("members", "xp_sum", "aura_sum", "xp_gained", "aura_gained", "successes", "failures")
+
+
+def guild_id(name):
+    return re.sub(r"[^a-z0-9]+", "-", str(name).strip().lower()).strip("-")
+
+
+def guild_event(delta, guild_name, **counters):
+    """
+    Suma un evento al delta del request: delta["guilds"][id][contador] += n.
+    Ej: guild_event(stats_delta, "Forge Legion", xp_sum=25, xp_gained=25, successes=1)
+    """
+    if not guild_name:
+        return delta
+    g = delta.setdefault("guilds", {}).setdefault(guild_id(guild_name), {"name": guild_name})
+    for field, n in counters.items():
+        g[field] = g.get(field, 0) + n
+    return delta
+
+
+def merge_guild_delta(target, delta):
+    for gid, g_delta in delta.items():
+        g = target.setdefault(gid, {"name": g_delta.get("name", gid)})
+        for field, n in g_delta.items():
+            if field != "name":
+                g[field] = g.get(field, 0) + n
+    return target
+
+
+def current_guild_aggregates(heroes):
+    """{id: {"name", "members", "xp_sum", "aura_sum"}} recalculado desde (wallet, héroe)."""
+    delta = {}
+    for _, hero in heroes:
+        ds = hero.get("dynamic_state", {})
+        guild_event(
+            delta, hero.get("guild") or ds.get("current_guild"),
+            members=1, xp_sum=ds.get("xp_total", 0), aura_sum=ds.get("aura_level", 0),
+        )
+    return delta.get("guilds", {})
+
+
+def upgrade_guild_record(g, legacy_ranking=None, current=None):
+    """
+    Registros de guilds.json anteriores a los agregados. El avg_* viejo era
+    una suma corrida de lo ganado, no una media: members / xp_sum / aura_sum
+    salen de los héroes actuales (current, ver current_guild_aggregates) y
+    de stats["guild_ranking"] sólo se toma lo ganado y los éxitos/fallos.
+    """
+    if "id" in g:
+        return g
+    legacy = (legacy_ranking or {}).get(g.get("name", ""), {})
+    g["id"]          = guild_id(g.get("name", ""))
+    now = (current or {}).get(g["id"], {})
+    g["members"]     = now.get("members", 0)
+    g["xp_sum"]      = now.get("xp_sum", 0)
+    g["aura_sum"]    = now.get("aura_sum", 0)
+    g["xp_gained"]   = legacy.get("xp", 0)
+    g["aura_gained"] = legacy.get("aura", 0)
+    g["successes"]   = legacy.get("successes", 0)
+    g["failures"]    = legacy.get("failures", 0)
+    return g
+
+
+def finalize_guild(g):
+    members = g.get("members", 0)
+    g["avg_xp"]   = round(g.get("xp_sum", 0) / members, 2) if members > 0 else 0
+    g["avg_aura"] = round(g.get("aura_sum", 0) / members, 2) if members > 0 else 0
+    return g
+
+
+def apply_guild_delta(guilds, delta):
+    """Aplica un delta {id: {contador: n}} sobre la lista de guilds.json."""
+    by_id = {}
+    for g in guilds:
+        upgrade_guild_record(g)
+        by_id[g["id"]] = g
+    for gid, g_delta in delta.items():
+        g = by_id.get(gid)
+        if g is None:
+            # gremio que no estaba en guilds.json: se da de alta sin badge
+            g = {"id": gid, "name": g_delta.get("name", gid), "flavor": "", "badge": ""}
+            g.update({field: 0 for field in GUILD_COUNTERS})
+            guilds.append(g)
+            by_id[gid] = g
+        for field, n in g_delta.items():
+            if field != "name":
+                g[field] = g.get(field, 0) + n
+    for g in guilds:
+        finalize_guild(g)
+    return guilds
+
+
+def success_rate(g):
+    runs = g.get("successes", 0) + g.get("failures", 0)
+    return round(100 * g.get("successes", 0) / runs) if runs else 0
+
+
+class GuildAggregator(StatsAggregator):
+    """
+    Mismo write-behind que stats.json, pero sobre la lista de guilds.json.
+    guilds() sirve el último snapshot (cacheado por mtime) + lo pendiente
+    de este worker, sin releer el archivo en cada request.
+    """
+
+    empty_state   = list
+    merge_pending = staticmethod(merge_guild_delta)
+    apply_delta   = staticmethod(apply_guild_delta)
+
+    def __init__(self, path, flush_seconds=5.0, max_pending=500):
+        super().__init__(path, flush_seconds=flush_seconds, max_pending=max_pending)
+        self._snapshot = []
+        self._snapshot_sig = None
+        self._snapshot_lock = threading.Lock()
+
+    def snapshot(self):
+        sig = self._file_sig()
+        with self._snapshot_lock:
+            if sig != self._snapshot_sig:
+                guilds = []
+                if sig is not None:
+                    with open(self.path, "rb") as f:
+                        raw = f.read()
+                    count_bytes(self.path, "read", len(raw))
+                    guilds = json.loads(raw)
+                self._snapshot = apply_guild_delta(guilds, {})
+                self._snapshot_sig = sig
+            return copy.deepcopy(self._snapshot)
+
+    def guilds(self):
+        return apply_guild_delta(self.snapshot(), self.pending())
+
+    def upgrade(self, legacy_ranking=None, iter_heroes=None):
+        """
+        Migra guilds.json al formato con agregados (una vez, idempotente).
+        iter_heroes() -> (wallet, héroe) del store, para recalcular miembros y sumas.
+        """
+        with file_lock(self.path):
+            if not os.path.exists(self.path):
+                return False
+            with open(self.path, "r", encoding="utf-8") as f:
+                guilds = json.load(f)
+            if all("id" in g for g in guilds):
+                return False
+            current = current_guild_aggregates(iter_heroes() if iter_heroes is not None else ())
+            for g in guilds:
+                upgrade_guild_record(g, legacy_ranking, current)
+            # gremios con héroes que no estaban en guilds.json
+            known = {g["id"] for g in guilds}
+            missing = {gid: agg for gid, agg in current.items() if gid not in known}
+            atomic_write_json(self.path, apply_guild_delta(guilds, missing), indent=4)
+            return True
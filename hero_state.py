@@ -0,0 +1,294 @@
+from array import array
+from datetime import datetime, timedelta
+
+from progression import (
+    DAY_SECONDS,
+    ENERGY_REFRESH_SECONDS,
+    MISSIONS,
+    PASSIVE_AURA_PER_DAY,
+    PASSIVE_XP_PER_DAY,
+    ROTATION_HOURS,
+    elapsed_periods,
+)
+
+# ---------------------------------
+# Estado de héroe compacto (procesos en lote / wallets grandes)
+# ---------------------------------
+#
+# HeroState guarda el héroe + su dynamic_state en __slots__:
+#   - timestamps como epoch entero en microsegundos (sin re-parsear ISO)
+#   - mission_history como array indexado por la posición de la misión en
+#     MISSIONS (0 = nunca corrida)
+# WalletState indexa sus héroes por token_id (lookup O(1)).
+#
+# La conversión es sin pérdida: to_dict(from_dict(x)) == x. Los timestamps
+# se parsean como ts_to_epoch (con o sin Z, sin µs, ...) y si el texto no
+# es el que escribiría now_utc_str() se guarda el original, que vuelve igual
+# mientras el valor no cambie. Lo que no encaja en la forma compacta (claves
+# desconocidas, tipos raros, timestamps que no se parsean, misiones que ya
+# no están en la rotación) se guarda tal cual aparte y se devuelve igual.
+
+US = 1_000_000
+_EPOCH = datetime(1970, 1, 1)
+
+MISSION_SLOTS = {m["id"]: i for i, m in enumerate(MISSIONS)}
+MISSION_COSTS = array("q", (m["energy_cost"] for m in MISSIONS))
+COOLDOWN_US   = ROTATION_HOURS * 3600 * US
+
+HERO_FIELDS = ("token_id", "name", "race_class", "guild", "image_url")
+DS_INTS = (
+    "xp_total", "xp_level", "aura_level", "energy_current", "energy_max",
+    "power_current", "missions_completed", "state_version",
+)
+DS_STRS = ("state", "current_guild", "last_mission")
+DS_TIMESTAMPS = ("last_update", "last_energy_refresh", "passive_anchor")
+
+
+def iso_to_us(ts_str):
+    """
+    ISO -> epoch en µs (int), o None. Acepta lo mismo que ts_to_epoch
+    ("2025-10-28T14:06:53.255261Z", sin Z, sin µs, ...), sin pasar por float.
+    """
+    if not isinstance(ts_str, str) or not ts_str:
+        return None
+    try:
+        t = datetime.fromisoformat(ts_str.replace("Z", ""))
+    except ValueError:
+        return None
+    # como ts_to_epoch: el offset, si viene, se ignora (todo es UTC)
+    return (t.replace(tzinfo=None) - _EPOCH) // timedelta(microseconds=1)
+
+
+def us_to_iso(us):
+    return (_EPOCH + timedelta(microseconds=us)).isoformat() + "Z"
+
+
+def _ts_out(us, text):
+    """El texto original si el valor sigue siendo el mismo; si no, la forma de now_utc_str()."""
+    return text[1] if text is not None and text[0] == us else us_to_iso(us)
+
+
+class HeroState:
+    __slots__ = HERO_FIELDS + DS_INTS + DS_STRS + DS_TIMESTAMPS + (
+        "mission_runs",    # array('q') µs por slot de MISSIONS, 0 = nunca
+        "extra",           # claves del héroe fuera de HERO_FIELDS
+        "ds_extra",        # claves / valores de dynamic_state que no encajan
+        "ts_text",         # timestamp -> (µs, texto original) si no es la forma de now_utc_str()
+        "mission_extra",   # mission_history fuera de la rotación o que no se parsea
+        "mission_text",    # slot -> (µs, texto original), como ts_text
+        "has_ds",
+        "has_history",
+    )
+
+    def __init__(self):
+        for name in HERO_FIELDS + DS_INTS + DS_STRS + DS_TIMESTAMPS:
+            setattr(self, name, None)
+        self.mission_runs = array("q", bytes(8 * len(MISSIONS)))
+        self.extra = {}
+        self.ds_extra = {}
+        self.ts_text = {}
+        self.mission_extra = {}
+        self.mission_text = {}
+        self.has_ds = False
+        self.has_history = False
+
+    @classmethod
+    def from_dict(cls, hero):
+        h = cls()
+        for key, val in hero.items():
+            if key in HERO_FIELDS and isinstance(val, str):
+                setattr(h, key, val)
+            elif key == "dynamic_state" and isinstance(val, dict):
+                h.has_ds = True
+                h._load_ds(val)
+            else:
+                h.extra[key] = val
+        return h
+
+    def _load_ds(self, ds):
+        for key, val in ds.items():
+            if key in DS_INTS and type(val) is int:
+                setattr(self, key, val)
+            elif key in DS_STRS and isinstance(val, str):
+                setattr(self, key, val)
+            elif key in DS_TIMESTAMPS and iso_to_us(val) is not None:
+                us = iso_to_us(val)
+                setattr(self, key, us)
+                if us_to_iso(us) != val:
+                    self.ts_text[key] = (us, val)
+            elif key == "mission_history" and isinstance(val, dict):
+                self.has_history = True
+                for mission_id, ts in val.items():
+                    slot = MISSION_SLOTS.get(mission_id)
+                    us = iso_to_us(ts)
+                    if slot is not None and us:
+                        self.mission_runs[slot] = us
+                        if us_to_iso(us) != ts:
+                            self.mission_text[slot] = (us, ts)
+                    else:
+                        self.mission_extra[mission_id] = ts
+            else:
+                self.ds_extra[key] = val
+
+    def to_dict(self):
+        hero = {k: getattr(self, k) for k in HERO_FIELDS if getattr(self, k) is not None}
+        hero.update(self.extra)
+        if self.has_ds:
+            ds = {k: getattr(self, k) for k in DS_INTS + DS_STRS if getattr(self, k) is not None}
+            for k in DS_TIMESTAMPS:
+                us = getattr(self, k)
+                if us is not None:
+                    ds[k] = _ts_out(us, self.ts_text.get(k))
+            if self.has_history:
+                history = {
+                    MISSIONS[slot]["id"]: _ts_out(us, self.mission_text.get(slot))
+                    for slot, us in enumerate(self.mission_runs) if us
+                }
+                history.update(self.mission_extra)
+                ds["mission_history"] = history
+            ds.update(self.ds_extra)
+            hero["dynamic_state"] = ds
+        return hero
+
+    # --- reglas (mismas que progression.accrue_hero, sobre enteros) ---
+
+    def _ds_get(self, key, default):
+        # como ds.get(key, default) de accrue_hero: incluye valores guardados aparte
+        val = getattr(self, key)
+        return val if val is not None else self.ds_extra.get(key, default)
+
+    def _ds_set(self, key, val):
+        setattr(self, key, val)
+        # la copia cruda ya no vale: to_dict la pisaría sobre el valor nuevo
+        self.ds_extra.pop(key, None)
+
+    def accrue(self, now_us):
+        """Pasivo + regen hasta now_us. Devuelve (xp_gain, aura_gain, changed)."""
+        self.has_ds = True
+        # como passive_accrual: un passive_anchor que no se parsea no cae a last_update
+        if self.passive_anchor is not None or self.ds_extra.get("passive_anchor"):
+            passive_from = self.passive_anchor
+        else:
+            passive_from = self.last_update
+        ticks, anchor = elapsed_periods(passive_from, now_us, DAY_SECONDS * US)
+        refreshes, e_anchor = elapsed_periods(self.last_energy_refresh, now_us, ENERGY_REFRESH_SECONDS * US)
+        changed = False
+
+        if self.passive_anchor is None:
+            self._ds_set("passive_anchor", anchor)
+        xp_gain, aura_gain = ticks * PASSIVE_XP_PER_DAY, ticks * PASSIVE_AURA_PER_DAY
+        if ticks:
+            self._ds_set("xp_total", self._ds_get("xp_total", 0) + xp_gain)
+            self._ds_set("aura_level", self._ds_get("aura_level", 0) + aura_gain)
+            self._ds_set("passive_anchor", anchor)
+            self._ds_set("last_update", anchor)
+            changed = True
+        if refreshes:
+            self._ds_set("energy_current", self._ds_get("energy_max", 100))
+            self._ds_set("last_energy_refresh", e_anchor)
+            changed = True
+        return xp_gain, aura_gain, changed
+
+    def last_run(self, mission_id):
+        """µs de la última corrida de la misión (None si nunca o fuera de la rotación)."""
+        slot = MISSION_SLOTS.get(mission_id)
+        if slot is None or not self.mission_runs[slot]:
+            return None
+        return self.mission_runs[slot]
+
+    def cooldown_remaining(self, mission_id, now_us):
+        """Segundos que faltan para poder repetir la misión (0 = disponible)."""
+        last = self.last_run(mission_id)
+        if last is None:
+            return 0
+        return max(0, (last + COOLDOWN_US - now_us) / US)
+
+    def eligibility(self, now_us):
+        """
+        Por slot de MISSIONS: (eligible_at en µs o None, motivo) con el héroe
+        ya acumulado hasta now_us. Mismas reglas que run_mission:
+        - cooldown: última corrida + ROTATION_HOURS
+        - energía: si no alcanza, el próximo refresh completo (None si ni con
+          energy_max alcanza: sólo queda RECOVER)
+        Motivo None = puede correrla ya (eligible_at: cuándo venció el
+        cooldown, None si nunca la corrió); si no, "cooldown" o "energy".
+        """
+        energy = self.energy_current or 0
+        energy_max = self.energy_max if self.energy_max is not None else 100
+        next_refresh = (
+            self.last_energy_refresh + ENERGY_REFRESH_SECONDS * US
+            if self.last_energy_refresh is not None else now_us
+        )
+        out = []
+        for slot, cost in enumerate(MISSION_COSTS):
+            last = self.mission_runs[slot]
+            ready = last + COOLDOWN_US if last else now_us
+            if energy >= cost:
+                energy_at = now_us
+            elif energy_max >= cost:
+                energy_at = next_refresh
+            else:
+                out.append((None, "energy"))
+                continue
+            at = max(ready, energy_at)
+            if at <= now_us:
+                # ya disponible: el momento en que venció el cooldown (fijo entre lecturas)
+                out.append((last + COOLDOWN_US if last else None, None))
+            else:
+                out.append((at, "cooldown" if ready >= energy_at else "energy"))
+        return out
+
+
+class WalletState:
+    __slots__ = ("heroes", "by_token", "extra")
+
+    def __init__(self, heroes=(), extra=None):
+        self.heroes = list(heroes)
+        self.extra = dict(extra or {})
+        self.by_token = {}
+        for h in self.heroes:
+            # igual que el lookup de los endpoints: gana el primero con ese token
+            self.by_token.setdefault(h.token_id, h)
+
+    @classmethod
+    def from_dict(cls, player_obj):
+        extra = {k: v for k, v in player_obj.items() if k != "heroes"}
+        if "heroes" in player_obj:
+            extra["heroes"] = None  # marca de presencia, para el orden y el round-trip
+        return cls([HeroState.from_dict(h) for h in player_obj.get("heroes", [])], extra)
+
+    def to_dict(self):
+        out = {}
+        for k, v in self.extra.items():
+            out[k] = [h.to_dict() for h in self.heroes] if k == "heroes" else v
+        if "heroes" not in out and self.heroes:
+            out["heroes"] = [h.to_dict() for h in self.heroes]
+        return out
+
+    def hero(self, token_id):
+        return self.by_token.get(token_id)
+
+    def eligibility(self, now_us):
+        """
+        {token_id: {mission_id: {"eligible", "eligible_at", "blocked_by"}}} en
+        una pasada sobre la wallet; eligible_at en ISO (ver HeroState.eligibility).
+        """
+        out = {}
+        for h in self.heroes:
+            if h.token_id in out:
+                continue
+            out[h.token_id] = {
+                MISSIONS[slot]["id"]: {
+                    "eligible":    reason is None,
+                    "eligible_at": us_to_iso(at) if at is not None else None,
+                    "blocked_by":  reason,
+                }
+                for slot, (at, reason) in enumerate(h.eligibility(now_us))
+            }
+        return out
+
+    def __len__(self):
+        return len(self.heroes)
+
+    def __iter__(self):
+        return iter(self.heroes)
@@ -0,0 +1,279 @@
+import hashlib
+import io
+import os
+import threading
+import time
+
+from metrics import registry
+from read_cache import SingleFlight
+from state_commit import atomic_write_bytes, file_lock
+
+try:
+    from PIL import Image
+except ImportError:  # sin Pillow: se sirve el original (mismo contenido, más pesado)
+    Image = None
+
+# ---------------------------------
+# Variantes de imágenes (resize / transcode) con cache en disco
+# ---------------------------------
+#
+# /variants/<ancho>/<ruta en static/>?fmt=webp|jpeg
+#   - el ancho se redondea hacia arriba a uno de VARIANT_WIDTHS (nunca se
+#     agranda la imagen: si el original es más chico queda de su tamaño)
+#   - sin fmt se elige por Accept (webp si el cliente lo acepta, si no jpeg)
+#   - immutable sólo con ?v=<variant_version> y fmt explícito, y con Pillow:
+#     la URL fija el original, el pipeline y el formato (Accept no entra en
+#     la URL, y sin Pillow se sirve el original que después cambiaría)
+# La variante se arma la primera vez y queda en data/variants/ con nombre =
+# hash(contenido del original + ancho + formato + parámetros del encoder):
+# si el original cambia cambia el nombre, y la vieja sale por LRU.
+# Tope de tamaño: al pasar max_bytes se borran las menos usadas (mtime; un
+# hit lo renueva a lo sumo cada TOUCH_SECONDS) hasta quedar en PRUNE_TO.
+# Entre workers: escritura atómica (tmp + rename) y prune bajo file_lock.
+
+VARIANT_WIDTHS = (64, 128, 256, 512, 1024)
+SOURCE_EXT     = (".png", ".jpg", ".jpeg", ".webp")
+TOUCH_SECONDS  = 3600
+PRUNE_TO       = 0.9
+
+# formato -> (formato Pillow, mimetype, extensión, opciones del encoder)
+FORMATS = {
+    "webp": ("WEBP", "image/webp", "webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", "jpg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+# cambiar el resize o las opciones invalida todas las variantes (y sus URLs)
+PIPELINE_VERSION = 1
+
+VARIANT_EVENTS = registry.counter(
+    "emberholm_image_variants_total", "Variantes de imagen servidas (hit/built/pruned)", ("result",)
+)
+VARIANT_BUILD_SECONDS = registry.histogram(
+    "emberholm_image_variant_build_seconds", "Tiempo de resize + encode de una variante", ("format",)
+)
+
+
+class VariantError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def variant_version(source_digest):
+    """?v= de una URL de variante: contenido del original + versión del pipeline."""
+    return f"{source_digest}-p{PIPELINE_VERSION}"
+
+
+def pick_width(width):
+    """Ancho pedido -> el primero de VARIANT_WIDTHS que lo cubre (el mayor si se pasa)."""
+    for w in VARIANT_WIDTHS:
+        if width <= w:
+            return w
+    return VARIANT_WIDTHS[-1]
+
+
+def pick_format(fmt, accept_mimetypes):
+    if fmt:
+        if fmt not in FORMATS:
+            raise VariantError(400, f"fmt must be one of {', '.join(FORMATS)}")
+        return fmt
+    return "webp" if accept_mimetypes.quality("image/webp") > 0 else "jpeg"
+
+
+def render_variant(src_path, width, fmt):
+    """Bytes de la variante: resize a width (sin agrandar) + encode en fmt."""
+    pil_format, _, _, options = FORMATS[fmt]
+    with Image.open(src_path) as img:
+        img.load()
+        if img.width > width:
+            height = max(1, round(img.height * width / img.width))
+            # pixel art chico (paleta): NEAREST mantiene los bordes nítidos
+            resample = Image.NEAREST if img.mode == "P" else Image.LANCZOS
+            img = img.resize((width, height), resample)
+        if fmt == "jpeg" and img.mode != "RGB":
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, (0, 0, 0))
+            img.paste(rgba, mask=rgba.getchannel("A"))
+        elif img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA")
+        out = io.BytesIO()
+        img.save(out, pil_format, **options)
+    return out.getvalue()
+
+
+class ImageVariants:
+    """
+    Variantes de imágenes de static_dir cacheadas en cache_dir. path()
+    devuelve el archivo listo para send_file (lo arma si falta).
+    """
+
+    def __init__(self, static_dir, cache_dir, max_bytes=512 << 20):
+        self.static_dir = os.path.abspath(static_dir)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._digests = {}  # ruta -> ((mtime_ns, size), sha1 del contenido)
+        self._flight = SingleFlight()
+        # bytes escritos por este worker desde el último prune (el total real lo mide prune)
+        self._written = 0
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def source_path(self, rel_path):
+        """Ruta absoluta del original dentro de static/, o None si no es una imagen de ahí."""
+        rel_path = rel_path.lstrip("/")
+        if not rel_path.lower().endswith(SOURCE_EXT):
+            return None
+        path = os.path.abspath(os.path.join(self.static_dir, rel_path))
+        if not path.startswith(self.static_dir + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def _source_digest(self, path):
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = self._digests.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self._lock:
+            self._digests[path] = (stamp, digest)
+        return digest
+
+    def variant_name(self, src_path, width, fmt):
+        key = f"{self._source_digest(src_path)}:{width}:{fmt}:{PIPELINE_VERSION}:{sorted(FORMATS[fmt][3].items())}"
+        return f"{hashlib.sha1(key.encode('utf-8')).hexdigest()[:24]}.{FORMATS[fmt][2]}"
+
+    def path(self, rel_path, width, fmt):
+        """(archivo de la variante, mimetype). VariantError si no hay original."""
+        src = self.source_path(rel_path)
+        if src is None:
+            raise VariantError(404, "image not found")
+        width = pick_width(width)
+        name = self.variant_name(src, width, fmt)
+        dest = os.path.join(self.cache_dir, name)
+
+        try:
+            st = os.stat(dest)
+        except FileNotFoundError:
+            self._flight.do(name, lambda: self._build(src, dest, width, fmt))
+        else:
+            VARIANT_EVENTS.inc("hit")
+            if time.time() - st.st_mtime > TOUCH_SECONDS:
+                try:
+                    os.utime(dest)
+                except OSError:
+                    pass
+        return dest, FORMATS[fmt][1]
+
+    def _build(self, src, dest, width, fmt):
+        if os.path.exists(dest):  # otro worker la terminó mientras tanto
+            return
+        t0 = time.perf_counter()
+        data = render_variant(src, width, fmt)
+        VARIANT_BUILD_SECONDS.observe(time.perf_counter() - t0, fmt)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        atomic_write_bytes(dest, data, fsync="never")
+        VARIANT_EVENTS.inc("built")
+        with self._lock:
+            self._written += len(data)
+            over = self._written > self.max_bytes * (1 - PRUNE_TO)
+            if over:
+                self._written = 0
+        if over:
+            self.prune()
+
+    def prune(self):
+        """Borra las variantes menos usadas hasta quedar en PRUNE_TO del tope. Devuelve cuántas."""
+        removed = 0
+        with file_lock(os.path.join(self.cache_dir, ".prune")):
+            entries = []
+            total = 0
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.name.startswith(".") or not entry.is_file():
+                        continue
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+            if total <= self.max_bytes:
+                return 0
+            entries.sort()
+            target = self.max_bytes * PRUNE_TO
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+        if removed:
+            VARIANT_EVENTS.inc("pruned", amount=removed)
+        return removed
+
+    def sources(self, subdir="img"):
+        """Rutas relativas (posix) de todas las imágenes bajo static/<subdir>."""
+        base = os.path.join(self.static_dir, subdir)
+        for root, _, files in os.walk(base):
+            for name in sorted(files):
+                if name.lower().endswith(SOURCE_EXT):
+                    yield os.path.relpath(os.path.join(root, name), self.static_dir).replace(os.sep, "/")
+
+
+def _warm_one(job):
+    static_dir, cache_dir, max_bytes, rel, width, fmt = job
+    variants = ImageVariants(static_dir, cache_dir, max_bytes)
+    dest, _ = variants.path(rel, width, fmt)
+    return os.path.getsize(dest)
+
+
+if __name__ == "__main__":
+    import argparse
+    from concurrent.futures import ProcessPoolExecutor
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    data_dir = os.environ.get("EMBERHOLM_DATA_DIR", os.path.join(here, "data"))
+    parser = argparse.ArgumentParser(description="Pre-arma las variantes de imagen de static/img (warm) o aplica el tope (prune).")
+    parser.add_argument("command", choices=["warm", "prune"])
+    parser.add_argument("--static-dir", default=os.path.join(here, "static"))
+    parser.add_argument("--cache-dir", default=os.path.join(data_dir, "variants"))
+    parser.add_argument("--max-mb", type=int, default=int(os.environ.get("EMBERHOLM_VARIANTS_MAX_MB", 512)))
+    parser.add_argument("--widths", default=",".join(str(w) for w in VARIANT_WIDTHS))
+    parser.add_argument("--formats", default=",".join(FORMATS))
+    parser.add_argument("--subdir", default="img")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    variants = ImageVariants(args.static_dir, args.cache_dir, args.max_mb << 20)
+    if args.command == "prune":
+        os.makedirs(args.cache_dir, exist_ok=True)
+        print(f"{variants.prune()} variants removed")
+        raise SystemExit(0)
+    if not variants.available:
+        raise SystemExit("Pillow no está instalado (pip install Pillow)")
+
+    widths = [pick_width(int(w)) for w in args.widths.split(",") if w]
+    formats = [f for f in args.formats.split(",") if f]
+    for f in formats:
+        if f not in FORMATS:
+            raise SystemExit(f"formato desconocido: {f}")
+    jobs = [
+        (args.static_dir, args.cache_dir, variants.max_bytes, rel, w, f)
+        for rel in variants.sources(args.subdir) for w in sorted(set(widths)) for f in formats
+    ]
+    t0 = time.perf_counter()
+    total = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for size in pool.map(_warm_one, jobs, chunksize=16):
+            total += size
+    print(f"{len(jobs)} variants ({total / 1024:.0f} KB) in {time.perf_counter() - t0:.2f}s -> {args.cache_dir}")
+    variants.prune()
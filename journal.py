@@ -0,0 +1,373 @@
+import atexit
+import copy
+import json
+import os
+import re
+import threading
+import time
+
+from guild_stats import apply_guild_delta
+from metrics import count_bytes
+from state_commit import FSYNC_POLICY, atomic_write_json, file_lock
+from stats_aggregator import merge_stats_delta
+
+# ---------------------------------
+# Journal de eventos (append-only) + snapshots + replay
+# ---------------------------------
+#
+# Cada commit de una wallet agrega UNA línea JSON a data/journal/NNNNNN.log:
+#   {"t": epoch, "w": wallet, "v": state_version, "tot": totals, "ev": [evento, ...]}
+# eventos:
+#   {"k": "create",  "p": jugador completo, "d": delta}
+#   {"k": "passive", "i": slot, "h": token_id, "ds": cambios, "d": delta}
+#   {"k": "mission", "i": slot, "h": token_id, "m": mission_id, "ds": cambios, "d": delta}
+#   {"k": "spend",   "i": slot, "h": token_id, "n": energía, "ds": cambios, "d": delta}
+# "ds" son los campos de dynamic_state que cambiaron (valores finales) y
+# "d" el delta con forma de stats.json (+ "guilds") que generó el evento.
+#
+# - Append: un write() con O_APPEND por commit (varios workers escriben el
+#   mismo archivo sin pisarse); el fsync se agrupa cada fsync_seconds en un
+#   hilo aparte, igual que el flush de StatsAggregator.
+# - Segmentos: al pasar segment_bytes se abre el siguiente NNNNNN.log.
+# - Snapshots: snapshot-NNNNNN-OOOOOOOOOOOO.json = estado completo (players,
+#   stats, guilds) hasta (segmento, offset). El primero (génesis) se toma de
+#   los archivos vivos al habilitar el journal; los siguientes salen de
+#   replay (python journal.py snapshot), así que siempre son consistentes.
+# - Replay: último snapshot + cola de eventos -> players / stats.json / guilds.json.
+
+SEGMENT_BYTES = 64 << 20
+
+_SEGMENT_RE  = re.compile(r"^(\d{6})\.log$")
+_SNAPSHOT_RE = re.compile(r"^snapshot-(\d{6})-(\d{12})\.json$")
+
+
+def _segment_name(seq):
+    return f"{seq:06d}.log"
+
+
+def segments(journal_dir):
+    """Números de segmento existentes, ordenados."""
+    try:
+        names = os.listdir(journal_dir)
+    except OSError:
+        return []
+    return sorted(int(m.group(1)) for m in map(_SEGMENT_RE.match, names) if m)
+
+
+def snapshots(journal_dir):
+    """[(segmento, offset, path)] ordenados por posición."""
+    try:
+        names = os.listdir(journal_dir)
+    except OSError:
+        return []
+    out = []
+    for name in names:
+        m = _SNAPSHOT_RE.match(name)
+        if m:
+            out.append((int(m.group(1)), int(m.group(2)), os.path.join(journal_dir, name)))
+    return sorted(out)
+
+
+def ds_snapshot(ds):
+    """Copia de dynamic_state para diff (mission_history se muta en el lugar)."""
+    snap = dict(ds)
+    if isinstance(snap.get("mission_history"), dict):
+        snap["mission_history"] = dict(snap["mission_history"])
+    return snap
+
+
+def ds_changes(before, ds):
+    return {k: v for k, v in ds.items() if k not in before or before[k] != v}
+
+
+class Journal:
+
+    def __init__(self, journal_dir, fsync_seconds=1.0, segment_bytes=SEGMENT_BYTES):
+        self.journal_dir = journal_dir
+        self.fsync_seconds = fsync_seconds
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        self._fd = None
+        self._fd_pid = None
+        self._seq = None
+        self._dirty = False
+        self._wake = threading.Event()
+        self._thread_pid = None
+        atexit.register(self.sync)
+
+    # --- escritura ---
+
+    def _open_current(self):
+        """fd O_APPEND del último segmento (crea el primero si no hay)."""
+        if self._fd is not None:
+            os.close(self._fd)
+        seqs = segments(self.journal_dir)
+        self._seq = seqs[-1] if seqs else 1
+        path = os.path.join(self.journal_dir, _segment_name(self._seq))
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._fd_pid = os.getpid()
+
+    def _rotate(self):
+        with file_lock(os.path.join(self.journal_dir, "journal")):
+            seqs = segments(self.journal_dir)
+            if seqs and seqs[-1] == self._seq:
+                # nadie rotó todavía: se crea el siguiente segmento vacío
+                path = os.path.join(self.journal_dir, _segment_name(self._seq + 1))
+                os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0o644))
+            self._sync_fd()
+            self._open_current()
+
+    def append(self, record):
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            # fd heredado del master de gunicorn: cada worker abre el suyo
+            if self._fd is None or self._fd_pid != os.getpid():
+                self._fd = None
+                os.makedirs(self.journal_dir, exist_ok=True)
+                self._open_current()
+            # se chequea ANTES de escribir: una vez pasado el tamaño nadie
+            # más escribe en este segmento (el orden por wallet se mantiene)
+            if os.fstat(self._fd).st_size >= self.segment_bytes:
+                self._rotate()
+            os.write(self._fd, line)
+            self._dirty = True
+        count_bytes(_segment_name(self._seq), "write", len(line))
+        if self.fsync_seconds <= 0:
+            self.sync()
+        else:
+            self._ensure_thread()
+
+    def _sync_fd(self):
+        if self._dirty and self._fd is not None and FSYNC_POLICY != "never":
+            os.fsync(self._fd)
+        self._dirty = False
+
+    def sync(self):
+        with self._lock:
+            if self._fd_pid == os.getpid():
+                self._sync_fd()
+
+    def _ensure_thread(self):
+        if self._thread_pid == os.getpid():
+            return
+        self._thread_pid = os.getpid()
+        t = threading.Thread(target=self._run, name="journal-fsync", daemon=True)
+        t.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.fsync_seconds)
+            try:
+                self.sync()
+            except OSError:
+                pass
+
+    def commit(self, wallet, player_obj, events):
+        """Una línea por commit de wallet: todos sus eventos o ninguno."""
+        if not events:
+            return
+        self.append({
+            "t": round(time.time(), 3),
+            "w": wallet,
+            "v": player_obj.get("state_version", 0),
+            "tot": player_obj.get("totals", {}),
+            "ev": events,
+        })
+
+    # --- snapshots ---
+
+    def ensure_genesis(self, build_state):
+        """
+        Si el journal está vacío, guarda el estado actual (build_state()) como
+        snapshot inicial en la posición (1, 0). Lo hace un solo worker.
+        """
+        if snapshots(self.journal_dir):
+            return False
+        os.makedirs(self.journal_dir, exist_ok=True)
+        with file_lock(os.path.join(self.journal_dir, "journal")):
+            if snapshots(self.journal_dir):
+                return False
+            if segments(self.journal_dir):
+                # hay eventos sin snapshot base: no se puede inventar uno
+                return False
+            write_snapshot(self.journal_dir, build_state(), (1, 0))
+            return True
+
+
+# ---------------------------------
+# Lectura / replay
+# ---------------------------------
+
+def iter_records(journal_dir, start=(1, 0)):
+    """
+    (posición después del registro, registro) desde start. Sólo líneas
+    completas: una línea a medio escribir al final se deja para después.
+    """
+    start_seq, start_off = start
+    for seq in segments(journal_dir):
+        if seq < start_seq:
+            continue
+        offset = start_off if seq == start_seq else 0
+        path = os.path.join(journal_dir, _segment_name(seq))
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                yield (seq, offset), json.loads(line)
+
+
+def empty_state():
+    return {"players": {}, "stats": {}, "guilds": []}
+
+
+def load_snapshot(journal_dir):
+    """(posición, estado) del último snapshot, o ((1, 0), vacío)."""
+    snaps = snapshots(journal_dir)
+    if not snaps:
+        return (1, 0), empty_state()
+    seq, offset, path = snaps[-1]
+    with open(path, "r", encoding="utf-8") as f:
+        return (seq, offset), json.load(f)
+
+
+def write_snapshot(journal_dir, state, pos):
+    seq, offset = pos
+    path = os.path.join(journal_dir, f"snapshot-{seq:06d}-{offset:012d}.json")
+    atomic_write_json(path, state, indent=None)
+    return path
+
+
+def apply_record(state, record):
+    players = state["players"]
+    wallet = record["w"]
+    guild_delta = {}
+    for ev in record["ev"]:
+        if ev["k"] == "create":
+            players[wallet] = copy.deepcopy(ev["p"])
+        else:
+            heroes = players.get(wallet, {}).get("heroes", [])
+            if "i" in ev:
+                hero = heroes[ev["i"]] if 0 <= ev["i"] < len(heroes) else None
+            else:
+                # misión / compra: mismo lookup que los endpoints (el primero con ese token)
+                hero = next((h for h in heroes if h.get("token_id") == ev.get("h")), None)
+            if hero is not None:
+                hero.setdefault("dynamic_state", {}).update(copy.deepcopy(ev.get("ds", {})))
+        delta = ev.get("d") or {}
+        merge_stats_delta(state["stats"], delta)
+        for gid, g in (delta.get("guilds") or {}).items():
+            target = guild_delta.setdefault(gid, {"name": g.get("name", gid)})
+            for field, n in g.items():
+                if field != "name":
+                    target[field] = target.get(field, 0) + n
+    if wallet in players:
+        players[wallet]["state_version"] = record.get("v", 0)
+        players[wallet]["totals"] = record.get("tot", {})
+    if guild_delta:
+        apply_guild_delta(state["guilds"], guild_delta)
+    return state
+
+
+def replay(journal_dir, until=None):
+    """Último snapshot + cola. Devuelve (estado, posición, registros aplicados)."""
+    pos, state = load_snapshot(journal_dir)
+    applied = 0
+    for pos_after, record in iter_records(journal_dir, pos):
+        apply_record(state, record)
+        pos = pos_after
+        applied += 1
+        if until is not None and applied >= until:
+            break
+    return state, pos, applied
+
+
+def prune(journal_dir, keep_snapshots=2):
+    """Borra snapshots viejos y los segmentos que ya cubre el más antiguo que queda."""
+    snaps = snapshots(journal_dir)
+    removed = []
+    for _, _, path in snaps[:-keep_snapshots]:
+        os.unlink(path)
+        removed.append(os.path.basename(path))
+    kept = snaps[-keep_snapshots:]
+    if kept:
+        oldest_seq = kept[0][0]
+        for seq in segments(journal_dir)[:-1]:
+            if seq < oldest_seq:
+                os.unlink(os.path.join(journal_dir, _segment_name(seq)))
+                removed.append(_segment_name(seq))
+    return removed
+
+
+def _diff_players(a, b):
+    diffs = []
+    for wallet in sorted(set(a) | set(b)):
+        pa, pb = a.get(wallet), b.get(wallet)
+        if pa is None or pb is None:
+            diffs.append({"wallet": wallet, "missing_in": "replay" if pa is None else "live"})
+            continue
+        for i, (ha, hb) in enumerate(zip(pa.get("heroes", []), pb.get("heroes", []))):
+            da, db = ha.get("dynamic_state", {}), hb.get("dynamic_state", {})
+            fields = sorted(k for k in set(da) | set(db) if da.get(k) != db.get(k))
+            if fields:
+                diffs.append({"wallet": wallet, "slot": i, "fields": fields})
+        if len(pa.get("heroes", [])) != len(pb.get("heroes", [])):
+            diffs.append({"wallet": wallet, "heroes": [len(pa.get("heroes", [])), len(pb.get("heroes", []))]})
+    return diffs
+
+
+if __name__ == "__main__":
+    import argparse
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    data_dir = os.environ.get("EMBERHOLM_DATA_DIR", os.path.join(here, "data"))
+    parser = argparse.ArgumentParser(description="Journal de eventos: snapshot / replay / verify.")
+    parser.add_argument("command", choices=["snapshot", "replay", "verify", "tail"])
+    parser.add_argument("--journal-dir", default=os.environ.get("EMBERHOLM_JOURNAL_DIR") or os.path.join(data_dir, "journal"))
+    parser.add_argument("--out", default=os.path.join(data_dir, "replay"), help="replay: directorio de salida")
+    parser.add_argument("--prune", action="store_true", help="snapshot: borrar snapshots/segmentos viejos")
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "json"], help="verify: store vivo")
+    parser.add_argument("-n", type=int, default=20, help="tail: cantidad de registros")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    if args.command == "tail":
+        pos, _ = load_snapshot(args.journal_dir)
+        records = [r for _, r in iter_records(args.journal_dir, pos)]
+        for record in records[-args.n:]:
+            print(json.dumps(record, separators=(",", ":")))
+        raise SystemExit(0)
+
+    state, pos, applied = replay(args.journal_dir)
+    summary = {"position": list(pos), "records": applied, "wallets": len(state["players"])}
+
+    if args.command == "snapshot":
+        summary["snapshot"] = write_snapshot(args.journal_dir, state, pos)
+        if args.prune:
+            summary["pruned"] = prune(args.journal_dir)
+
+    elif args.command == "replay":
+        os.makedirs(args.out, exist_ok=True)
+        atomic_write_json(os.path.join(args.out, "stats.json"), state["stats"])
+        atomic_write_json(os.path.join(args.out, "guilds.json"), state["guilds"])
+        atomic_write_json(os.path.join(args.out, "players.json"), state["players"])
+        summary["out"] = args.out
+
+    else:  # verify: replay vs archivos vivos
+        from player_store import open_player_store
+
+        store = open_player_store(
+            args.backend, os.path.join(data_dir, "players.json"), os.path.join(data_dir, "players.db")
+        )
+        live_players = dict(store.iter_players())
+        with open(os.path.join(data_dir, "stats.json"), "r", encoding="utf-8") as f:
+            live_stats = json.load(f)
+        stat_keys = [k for k, v in state["stats"].items() if isinstance(v, (int, float))]
+        summary["stats_diff"] = {
+            k: [state["stats"][k], live_stats.get(k)] for k in stat_keys if state["stats"][k] != live_stats.get(k)
+        }
+        summary["player_diffs"] = _diff_players(state["players"], live_players)[:50]
+
+    summary["elapsed_seconds"] = round(time.perf_counter() - t0, 3)
+    print(json.dumps(summary, indent=2))
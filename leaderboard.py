@@ -0,0 +1,328 @@
+import heapq
+import random
+import threading
+import time
+
+from progression import DAY_SECONDS, passive_accrual
+
+# ---------------------------------
+# Ranking incremental (skiplist indexable)
+# ---------------------------------
+#
+# Cada índice ordena claves (-score, id): insertar, borrar, rank(id) y
+# "dame las posiciones [offset, offset+limit)" son O(log n). Los handlers
+# actualizan sólo la wallet que tocaron; nadie ordena todos los jugadores.
+# XP y aura se puntúan con el pasivo acumulado hasta ahora (lo mismo que
+# muestra /api/player), aunque la wallet no escriba: cada wallet queda en un
+# heap con la hora de su próximo tick y sync() la re-puntúa cuando vence.
+
+MAX_LEVEL = 24
+
+METRICS = ("xp", "aura", "missions")
+SCOPES  = ("wallet", "hero")
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, levels):
+        self.key   = key
+        self.next  = [None] * levels
+        self.width = [1] * levels
+
+
+class RankedIndex:
+    """id -> score, ordenado de mayor a menor score (empates por id)."""
+
+    def __init__(self):
+        self._tail = _Node(None, 0)
+        self._head = _Node(None, MAX_LEVEL)
+        self._head.next = [self._tail] * MAX_LEVEL
+        self._keys = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _random_level(self):
+        level = 1
+        while level < MAX_LEVEL and random.random() < 0.5:
+            level += 1
+        return level
+
+    def _insert(self, key):
+        chain = [None] * MAX_LEVEL
+        steps = [0] * MAX_LEVEL
+        node = self._head
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level] is not self._tail and node.next[level].key < key:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        levels = self._random_level()
+        new = _Node(key, levels)
+        acc = 0
+        for level in range(levels):
+            prev = chain[level]
+            new.next[level]   = prev.next[level]
+            prev.next[level]  = new
+            new.width[level]  = prev.width[level] - acc
+            prev.width[level] = acc + 1
+            acc += steps[level]
+        for level in range(levels, MAX_LEVEL):
+            chain[level].width[level] += 1
+
+    def _remove(self, key):
+        chain = [None] * MAX_LEVEL
+        node = self._head
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level] is not self._tail and node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level]   = target.next[level]
+        for level in range(len(target.next), MAX_LEVEL):
+            chain[level].width[level] -= 1
+
+    def set(self, entry_id, score):
+        key = (-score, entry_id)
+        old = self._keys.get(entry_id)
+        if old == key:
+            return
+        if old is not None:
+            self._remove(old)
+        self._insert(key)
+        self._keys[entry_id] = key
+
+    def discard(self, entry_id):
+        old = self._keys.pop(entry_id, None)
+        if old is not None:
+            self._remove(old)
+
+    def score(self, entry_id):
+        key = self._keys.get(entry_id)
+        return -key[0] if key is not None else None
+
+    def rank(self, entry_id):
+        """Posición 1-based, o None si el id no está."""
+        key = self._keys.get(entry_id)
+        if key is None:
+            return None
+        pos = 0
+        node = self._head
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level] is not self._tail and node.next[level].key < key:
+                pos += node.width[level]
+                node = node.next[level]
+        return pos + 1
+
+    def slice(self, offset, limit):
+        """[(rank, id, score), ...] desde la posición offset (0-based)."""
+        if offset < 0 or offset >= len(self._keys) or limit <= 0:
+            return []
+        remaining = offset + 1
+        node = self._head
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level] is not self._tail and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        out = []
+        rank = offset + 1
+        while node is not self._tail and len(out) < limit:
+            neg_score, entry_id = node.key
+            out.append((rank, entry_id, -neg_score))
+            rank += 1
+            node = node.next[0]
+        return out
+
+
+# ---------------------------------
+# Leaderboard de wallets y héroes
+# ---------------------------------
+
+def hero_entry_id(wallet, token_id):
+    return f"{wallet}/{token_id}"
+
+
+class Leaderboard:
+    """
+    Un RankedIndex por (scope, metric):
+    - scope  "wallet": totales de la wallet / "hero": cada héroe (wallet/token_id)
+    - metric "xp", "aura", "missions"
+    Se arma una vez desde el store y después se actualiza por wallet.
+    sync() trae las wallets que escribieron otros workers y re-puntúa las
+    que cruzaron un tick de pasivo.
+    """
+
+    def __init__(self, store, sync_seconds=2.0):
+        self.store = store
+        self.sync_seconds = sync_seconds
+        self._lock = threading.RLock()
+        self._built = False
+        self._rev = None
+        self._last_sync = 0.0
+        # sube en cada cambio del índice (para caches de respuestas)
+        self.version = 0
+        self._reset()
+
+    def _reset(self):
+        self._indexes = {(scope, metric): RankedIndex() for scope in SCOPES for metric in METRICS}
+        self._details = {"wallet": {}, "hero": {}}
+        self._wallet_heroes = {}
+        # wallet -> epoch del próximo tick de pasivo; heap de (epoch, wallet), con entradas viejas
+        self._next_tick = {}
+        self._ticks = []
+
+    # --- escritura ---
+
+    def update_player(self, wallet, player_obj):
+        with self._lock:
+            if not self._built:
+                return
+            self._update(wallet, player_obj)
+
+    def _update(self, wallet, player_obj, now=None):
+        self.version += 1
+        now = time.time() if now is None else now
+        heroes = player_obj.get("heroes", [])
+        tot = {"xp": 0, "aura": 0, "missions": 0}
+        hero_ids = set()
+        next_tick = None
+
+        for hero in heroes:
+            ds = hero.get("dynamic_state", {})
+            token_id = hero.get("token_id", "")
+            hid = hero_entry_id(wallet, token_id)
+            hero_ids.add(hid)
+            acc = passive_accrual(ds, now)
+            hero_next = acc["passive_anchor"] + DAY_SECONDS
+            next_tick = hero_next if next_tick is None else min(next_tick, hero_next)
+            scores = {
+                "xp":       ds.get("xp_total", 0) + acc["xp_gain"],
+                "aura":     ds.get("aura_level", 0) + acc["aura_gain"],
+                "missions": ds.get("missions_completed", 0),
+            }
+            for metric, val in scores.items():
+                self._indexes[("hero", metric)].set(hid, val)
+                tot[metric] += val
+            self._details["hero"][hid] = {
+                "wallet":     wallet,
+                "token_id":   token_id,
+                "name":       hero.get("name", token_id),
+                "race_class": hero.get("race_class", ""),
+                "guild":      hero.get("guild") or ds.get("current_guild", ""),
+                "xp_total":   scores["xp"],
+                "aura_level": scores["aura"],
+                "missions":   scores["missions"],
+            }
+
+        for hid in self._wallet_heroes.get(wallet, set()) - hero_ids:
+            self._discard("hero", hid)
+        self._wallet_heroes[wallet] = hero_ids
+
+        if next_tick is not None:
+            self._next_tick[wallet] = next_tick
+            heapq.heappush(self._ticks, (next_tick, wallet))
+        else:
+            self._next_tick.pop(wallet, None)
+
+        for metric, val in tot.items():
+            self._indexes[("wallet", metric)].set(wallet, val)
+        self._details["wallet"][wallet] = {
+            "wallet":         wallet,
+            "heroes_count":   len(heroes),
+            "xp_total_all":   tot["xp"],
+            "aura_total_all": tot["aura"],
+            "missions_total": tot["missions"],
+        }
+
+    def _discard(self, scope, entry_id):
+        self.version += 1
+        for metric in METRICS:
+            self._indexes[(scope, metric)].discard(entry_id)
+        self._details[scope].pop(entry_id, None)
+
+    def remove_player(self, wallet):
+        with self._lock:
+            self._next_tick.pop(wallet, None)
+            for hid in self._wallet_heroes.pop(wallet, set()):
+                self._discard("hero", hid)
+            self._discard("wallet", wallet)
+
+    # --- build / sync con el store ---
+
+    def _build(self):
+        self._reset()
+        self._rev = self.store.current_rev()
+        now = time.time()
+        for wallet, player_obj in self.store.iter_players():
+            self._update(wallet, player_obj, now)
+        self._built = True
+        self._last_sync = time.monotonic()
+
+    def sync(self, force=False):
+        with self._lock:
+            if not self._built:
+                self._build()
+                return
+            if not force and time.monotonic() - self._last_sync < self.sync_seconds:
+                return
+            self._last_sync = time.monotonic()
+            rev, wallets = self.store.changed_since(self._rev)
+            if wallets is None:
+                self._build()
+                return
+            for wallet in wallets:
+                player_obj = self.store.get_player(wallet)
+                if player_obj is None:
+                    self.remove_player(wallet)
+                else:
+                    self._update(wallet, player_obj)
+            self._rev = rev
+            self._accrue_due()
+
+    def _accrue_due(self):
+        """Re-puntúa las wallets que cruzaron un tick de pasivo sin escribir."""
+        now = time.time()
+        due = set()
+        while self._ticks and self._ticks[0][0] <= now:
+            t, wallet = heapq.heappop(self._ticks)
+            if self._next_tick.get(wallet) == t:
+                due.add(wallet)
+        for wallet in due:
+            player_obj = self.store.get_player(wallet)
+            if player_obj is None:
+                self.remove_player(wallet)
+            else:
+                self._update(wallet, player_obj, now)
+
+    # --- lectura ---
+
+    def page(self, metric="xp", scope="wallet", offset=0, limit=25):
+        self.sync()
+        with self._lock:
+            index = self._indexes[(scope, metric)]
+            rows = []
+            for rank, entry_id, score in index.slice(offset, limit):
+                row = dict(self._details[scope].get(entry_id, {}))
+                row["rank"]  = rank
+                row["score"] = score
+                rows.append(row)
+            return len(index), rows
+
+    def rank(self, metric="xp", scope="wallet", entry_id=""):
+        self.sync()
+        with self._lock:
+            index = self._indexes[(scope, metric)]
+            rank = index.rank(entry_id)
+            if rank is None:
+                return None
+            row = dict(self._details[scope].get(entry_id, {}))
+            row["rank"]  = rank
+            row["score"] = index.score(entry_id)
+            row["of"]    = len(index)
+            return row
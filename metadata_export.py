@@ -0,0 +1,214 @@
+"""
+Export estático de toda la colección (tokenURI) para servir desde un CDN.
+
+Escribe en <out>/releases/<id>/ un archivo por token con exactamente el
+cuerpo de /api/metadata/<token_id>, y publica la release moviendo el
+symlink <out>/current (os.replace de un symlink nuevo: atómico). Un export
+a medio hacer o que falla nunca queda publicado.
+
+Incremental: cada release guarda en <out>/releases/<id>.manifest.json el
+ETag de cada token (metadata base + rareza + dueño + state_version + pasivo
+pendiente). En la corrida siguiente los tokens con el mismo ETag se
+hard-linkean desde la release anterior y sólo se re-renderizan los sucios.
+Los archivos nunca se modifican en el lugar, así que compartir inodos entre
+releases es seguro.
+
+Uso:
+    python metadata_export.py --workers 8            # incremental
+    python metadata_export.py --full                 # re-renderiza todo
+    python metadata_export.py --name "{num}"         # archivos 1, 2, ... (baseURI sin extensión)
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from datetime import datetime, timezone
+
+from state_commit import atomic_write_json, file_lock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+MANIFEST_FORMAT = 1
+CHUNK_TOKENS    = 500
+
+_app = None
+
+
+def _load_app():
+    global _app
+    if _app is None:
+        sys.path.insert(0, HERE)
+        import app
+        _app = app
+    return _app
+
+
+def token_filename(pattern, token_id):
+    return pattern.format(token_id=token_id, num=int(token_id))
+
+
+def _export_chunk(job):
+    """
+    Un bloque de tokens: link desde la release anterior si el ETag no cambió,
+    si no render + write. Devuelve ({token_id: etag}, rendered, linked, missing).
+    """
+    token_ids, release_dir, prev_dir, prev_etags, pattern, now = job
+    app = _load_app()
+    owners = app.player_store.find_tokens(token_ids)
+    etags, rendered, linked, missing = {}, 0, 0, []
+    for token_id in token_ids:
+        found = owners.get(token_id)
+        base_sig = app.base_metadata_signature(token_id)
+        if base_sig is None:
+            missing.append(token_id)
+            continue
+        name = token_filename(pattern, token_id)
+        dest = os.path.join(release_dir, name)
+
+        etag = app.metadata_etag(token_id, base_sig, found, now)
+        if prev_dir is not None and prev_etags.get(token_id) == etag:
+            try:
+                os.link(os.path.join(prev_dir, name), dest)
+                etags[token_id] = etag
+                linked += 1
+                continue
+            except OSError:
+                pass  # no está / otro filesystem: se vuelve a escribir
+
+        entry = app.render_metadata_read(token_id, found, now)
+        if entry is None:
+            missing.append(token_id)
+            continue
+        with open(dest, "wb") as f:
+            f.write(entry.body)
+        etags[token_id] = entry.etag
+        rendered += 1
+    return etags, rendered, linked, missing
+
+
+def _current_release(out_dir):
+    try:
+        target = os.readlink(os.path.join(out_dir, "current"))
+    except OSError:
+        return None
+    return os.path.basename(target.rstrip("/"))
+
+
+def _load_manifest(out_dir, release_id, pattern):
+    if release_id is None:
+        return {}
+    try:
+        with open(os.path.join(out_dir, "releases", f"{release_id}.manifest.json"), "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # otro formato de nombres: no se puede reusar nada
+    if data.get("format") != MANIFEST_FORMAT or data.get("name") != pattern:
+        return {}
+    return data.get("etags", {})
+
+
+def publish(out_dir, release_id):
+    """current -> releases/<release_id>, con rename de un symlink nuevo (atómico)."""
+    link = os.path.join(out_dir, "current")
+    tmp = f"{link}.{os.getpid()}.tmp"
+    os.symlink(os.path.join("releases", release_id), tmp)
+    os.replace(tmp, link)
+
+
+def prune_releases(out_dir, keep):
+    """Borra las releases más viejas (nunca la publicada). Devuelve cuántas."""
+    releases_dir = os.path.join(out_dir, "releases")
+    current = _current_release(out_dir)
+    ids = sorted(
+        name for name in os.listdir(releases_dir)
+        if os.path.isdir(os.path.join(releases_dir, name)) and name != current
+    )
+    old = ids[:max(0, len(ids) - keep)]
+    for release_id in old:
+        shutil.rmtree(os.path.join(releases_dir, release_id), ignore_errors=True)
+        try:
+            os.unlink(os.path.join(releases_dir, f"{release_id}.manifest.json"))
+        except OSError:
+            pass
+    return len(old)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    data_dir = os.environ.get("EMBERHOLM_DATA_DIR", os.path.join(HERE, "data"))
+    parser.add_argument("--out", default=os.path.join(data_dir, "export"))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--name", default="{token_id}.json", help="nombre de archivo: {token_id} (00001) o {num} (1)")
+    parser.add_argument("--full", action="store_true", help="ignora la release anterior y re-renderiza todo")
+    parser.add_argument("--keep", type=int, default=2, help="releases viejas a conservar además de la publicada")
+    args = parser.parse_args()
+
+    app = _load_app()
+    os.makedirs(os.path.join(args.out, "releases"), exist_ok=True)
+
+    with file_lock(os.path.join(args.out, "export")):
+        t0 = time.perf_counter()
+        now = time.time()
+        prev_id = None if args.full else _current_release(args.out)
+        prev_etags = _load_manifest(args.out, prev_id, args.name)
+        prev_dir = os.path.join(args.out, "releases", prev_id) if prev_etags else None
+
+        release_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        release_dir = os.path.join(args.out, "releases", release_id)
+        os.makedirs(release_dir)
+
+        token_ids = app.all_token_ids()
+        jobs = []
+        for i in range(0, len(token_ids), CHUNK_TOKENS):
+            chunk = token_ids[i:i + CHUNK_TOKENS]
+            jobs.append((
+                chunk, release_dir, prev_dir,
+                {t: prev_etags[t] for t in chunk if t in prev_etags}, args.name, now,
+            ))
+
+        try:
+            if args.workers > 1:
+                # spawn: cada proceso importa app por su cuenta (como un worker de gunicorn)
+                ctx = multiprocessing.get_context("spawn")
+                with ctx.Pool(args.workers) as pool:
+                    results = pool.map(_export_chunk, jobs, chunksize=1)
+            else:
+                results = [_export_chunk(job) for job in jobs]
+
+            etags, rendered, linked, missing = {}, 0, 0, []
+            for chunk_etags, r, l, m in results:
+                etags.update(chunk_etags)
+                rendered += r
+                linked += l
+                missing.extend(m)
+
+            atomic_write_json(
+                os.path.join(args.out, "releases", f"{release_id}.manifest.json"),
+                {"format": MANIFEST_FORMAT, "name": args.name, "created": now, "etags": etags},
+                indent=None,
+            )
+            publish(args.out, release_id)
+        except BaseException:
+            shutil.rmtree(release_dir, ignore_errors=True)
+            raise
+
+        pruned = prune_releases(args.out, args.keep)
+
+    print(json.dumps({
+        "release": release_id,
+        "previous": prev_id,
+        "tokens": len(etags),
+        "rendered": rendered,
+        "linked": linked,
+        "missing": len(missing),
+        "pruned_releases": pruned,
+        "seconds": round(time.perf_counter() - t0, 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
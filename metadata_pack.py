@@ -0,0 +1,292 @@
+import bisect
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from datetime import datetime
+
+# ---------------------------------
+# Pack de metadata base (data/metadata/*.json -> data/metadata.pack)
+# ---------------------------------
+#
+# Layout (little endian):
+#   header : magic(8) | count(u32) | reserved(u32)
+#   index  : count x [token_num(u32) | offset(u32) | length(u32) | source_crc32(u32)]
+#            ordenado por token_num
+#   payload: JSON compacto de cada token, ya normalizado
+#
+# El archivo se abre con mmap: todos los workers de gunicorn comparten
+# las mismas páginas del page cache en vez de parsear 35k archivos sueltos.
+
+PACK_MAGIC   = b"EMBPACK1"
+HEADER       = struct.Struct("<8sII")
+INDEX_ENTRY  = struct.Struct("<IIII")
+
+
+def normalize_base_metadata(token_id, raw):
+    """
+    Normaliza el JSON crudo de data/metadata/<token_id>.json:
+    - name / description / image
+    - fixed_profile{}  (race, class, str, etc.)
+    - attributes[]     (fallback si falta algo)
+    Devuelve todo en un dict plano usable.
+    """
+    meta = {
+        "token_id":        str(token_id).zfill(5),
+        "name":            raw.get("name", f"Emissary #{str(token_id).zfill(5)}"),
+        "description":     raw.get("description", "Emissary of Emberholm."),
+        "image":           raw.get("image", ""),
+        "race":            "Unknown",
+        "class":           "Unknown",
+        "rarity":          "Unknown",
+        "age":             0,
+        "starting_guild":  "Unknown",
+        "str":             0,
+        "dex":             0,
+        "con":             0,
+        "int":             0,
+        "wis":             0,
+        "cha":             0,
+    }
+
+    # 1) fixed_profile: tu formato real
+    fixed = raw.get("fixed_profile", {})
+    if isinstance(fixed, dict):
+        if "token_id"       in fixed: meta["token_id"]        = fixed["token_id"]
+        if "race"           in fixed: meta["race"]            = fixed["race"]
+        if "class"          in fixed: meta["class"]           = fixed["class"]
+        if "rarity"         in fixed: meta["rarity"]          = fixed["rarity"]
+        if "age"            in fixed: meta["age"]             = fixed["age"]
+        if "starting_guild" in fixed: meta["starting_guild"]  = fixed["starting_guild"]
+        if "str"            in fixed: meta["str"]             = fixed["str"]
+        if "dex"            in fixed: meta["dex"]             = fixed["dex"]
+        if "con"            in fixed: meta["con"]             = fixed["con"]
+        if "int"            in fixed: meta["int"]             = fixed["int"]
+        if "wis"            in fixed: meta["wis"]             = fixed["wis"]
+        if "cha"            in fixed: meta["cha"]             = fixed["cha"]
+
+    # 2) fallback desde attributes[] si todavía faltan cosas
+    attrs = raw.get("attributes", [])
+    for trait in attrs:
+        ttype = trait.get("trait_type", "").lower()
+        val   = trait.get("value")
+
+        if ttype == "id" and meta["token_id"] == str(token_id).zfill(5):
+            # ya tenemos token_id, no lo pisamos
+            pass
+        elif ttype == "race" and meta["race"] == "Unknown":
+            meta["race"] = val
+        elif ttype == "class" and meta["class"] == "Unknown":
+            meta["class"] = val
+        elif ttype == "rarity" and meta["rarity"] == "Unknown":
+            meta["rarity"] = val
+        elif ttype == "guild" and meta["starting_guild"] == "Unknown":
+            meta["starting_guild"] = val
+        elif ttype == "age" and meta["age"] == 0:
+            meta["age"] = val
+
+    return meta
+
+
+def pack_token_num(token_id):
+    """
+    "00001" / "1" -> 1. Devuelve None si el id no tiene forma canónica
+    (así "000001" sigue dando 404 como con los archivos sueltos).
+    """
+    s = str(token_id)
+    if not (s.isascii() and s.isdigit()):
+        return None
+    n = int(s)
+    if s.zfill(5) != f"{n:05d}":
+        return None
+    return n
+
+
+def _iter_source_files(metadata_dir):
+    """(token_num, path) de cada NNNNN.json en el directorio, ordenados."""
+    entries = []
+    for name in os.listdir(metadata_dir):
+        stem, ext = os.path.splitext(name)
+        if ext != ".json" or not stem.isdigit():
+            continue
+        entries.append((int(stem), os.path.join(metadata_dir, name)))
+    entries.sort()
+    return entries
+
+
+# ---------------------------------
+# Build + drift check
+# ---------------------------------
+
+def build_pack(metadata_dir, pack_path):
+    """
+    Compila todo data/metadata en un solo archivo.
+    Se escribe a un temporal y se renombra: los workers que tengan el pack
+    anterior mapeado siguen leyendo la versión vieja sin errores.
+    """
+    index = []
+    payload = bytearray()
+    entries = _iter_source_files(metadata_dir)
+    data_start = HEADER.size + INDEX_ENTRY.size * len(entries)
+
+    for token_num, path in entries:
+        with open(path, "rb") as f:
+            src = f.read()
+        meta = normalize_base_metadata(f"{token_num:05d}", json.loads(src))
+        blob = json.dumps(meta, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        index.append((token_num, data_start + len(payload), len(blob), zlib.crc32(src)))
+        payload += blob
+
+    tmp_path = f"{pack_path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(PACK_MAGIC, len(index), 0))
+        for entry in index:
+            f.write(INDEX_ENTRY.pack(*entry))
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, pack_path)
+    return len(index)
+
+
+def check_pack(metadata_dir, pack_path):
+    """
+    Compara el pack con los archivos fuente.
+    Devuelve {"missing": [...], "stale": [...], "orphaned": [...]}:
+    - missing : tokens con archivo pero sin entrada en el pack
+    - stale   : el archivo cambió desde que se armó el pack (crc distinto)
+    - orphaned: tokens en el pack cuyo archivo ya no existe
+    """
+    pack = MetadataPack(pack_path)
+    packed = dict(pack.iter_crcs())
+    report = {"missing": [], "stale": [], "orphaned": []}
+
+    seen = set()
+    for token_num, path in _iter_source_files(metadata_dir):
+        seen.add(token_num)
+        if token_num not in packed:
+            report["missing"].append(f"{token_num:05d}")
+            continue
+        with open(path, "rb") as f:
+            if zlib.crc32(f.read()) != packed[token_num]:
+                report["stale"].append(f"{token_num:05d}")
+
+    report["orphaned"] = [f"{n:05d}" for n in sorted(set(packed) - seen)]
+    pack.close()
+    return report
+
+
+# ---------------------------------
+# Lector (mmap compartido)
+# ---------------------------------
+
+class MetadataPack:
+    """
+    Lectura O(log n) por token sobre el archivo mapeado.
+    Si el pack no existe, get() devuelve None y el caller usa los archivos sueltos.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mm = None
+        self._keys = None
+        self._opened = False
+        self.mtime = None
+
+    def _open(self):
+        with self._lock:
+            if self._opened:
+                return
+            try:
+                self._map()
+            finally:
+                self._opened = True
+
+    def _map(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.mtime = datetime.utcfromtimestamp(os.fstat(f.fileno()).st_mtime)
+        magic, count, _ = HEADER.unpack_from(mm, 0)
+        if magic != PACK_MAGIC:
+            mm.close()
+            return
+        # sólo la columna de token_num vive en memoria del proceso (~140 KB)
+        self._keys = [
+            INDEX_ENTRY.unpack_from(mm, HEADER.size + i * INDEX_ENTRY.size)[0]
+            for i in range(count)
+        ]
+        self._mm = mm
+
+    def _entry(self, token_id):
+        if not self._opened:
+            self._open()
+        if self._mm is None:
+            return None
+        token_num = pack_token_num(token_id)
+        if token_num is None:
+            return None
+        i = bisect.bisect_left(self._keys, token_num)
+        if i == len(self._keys) or self._keys[i] != token_num:
+            return None
+        return INDEX_ENTRY.unpack_from(self._mm, HEADER.size + i * INDEX_ENTRY.size)
+
+    @property
+    def available(self):
+        if not self._opened:
+            self._open()
+        return self._mm is not None
+
+    def get(self, token_id):
+        entry = self._entry(token_id)
+        if entry is None:
+            return None
+        _, offset, length, _ = entry
+        return json.loads(self._mm[offset:offset + length])
+
+    def token_nums(self):
+        if not self.available:
+            return []
+        return list(self._keys)
+
+    def source_crc(self, token_id):
+        entry = self._entry(token_id)
+        return entry[3] if entry is not None else None
+
+    def iter_crcs(self):
+        if not self.available:
+            return
+        for i, token_num in enumerate(self._keys):
+            yield token_num, INDEX_ENTRY.unpack_from(self._mm, HEADER.size + i * INDEX_ENTRY.size)[3]
+
+    def close(self):
+        with self._lock:
+            if self._mm is not None:
+                self._mm.close()
+            self._mm = None
+            self._keys = None
+            self._opened = False
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Compila o verifica data/metadata.pack.")
+    parser.add_argument("command", choices=["build", "check"])
+    parser.add_argument("--metadata-dir", default=os.path.join(here, "data", "metadata"))
+    parser.add_argument("--pack", default=os.path.join(here, "data", "metadata.pack"))
+    args = parser.parse_args()
+
+    if args.command == "build":
+        n = build_pack(args.metadata_dir, args.pack)
+        print(f"packed {n} tokens -> {args.pack}")
+    else:
+        report = check_pack(args.metadata_dir, args.pack)
+        print(json.dumps({k: {"count": len(v), "tokens": v[:50]} for k, v in report.items()}, indent=2))
+        sys.exit(1 if any(report.values()) else 0)
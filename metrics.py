@@ -0,0 +1,321 @@
+import bisect
+import cProfile
+import io
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# ---------------------------------
+# Métricas en proceso + export Prometheus
+# ---------------------------------
+#
+# - Histogram / Counter con labels, en memoria y con un solo lock: observar
+#   cuesta un perf_counter, un bisect y un += (se puede dejar prendido).
+# - span("fase") / @timed("fase"): cuánto se va en load_json, save_json,
+#   apply_passive_and_regen, find_dynamic_state_for_token, etc.
+# - count_bytes(path, "read"|"write", n): bytes por archivo de estado.
+# - Varios workers de gunicorn: cada uno vuelca su snapshot a
+#   <metrics_dir>/<pid>.json cada pocos segundos y /metrics suma todos,
+#   así el scrape no depende de a qué worker le tocó.
+# - SlowRequestProfiler: corre cProfile en una fracción de los requests y
+#   guarda el perfil de los que pasan el umbral.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_str(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + body + "}"
+
+
+def _fmt(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+
+    def inc(self, *labels, amount=1):
+        with self.registry.lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def snapshot(self):
+        return [[list(k), v] for k, v in self._series.items()]
+
+    def merge(self, series, data):
+        for labels, v in data:
+            labels = tuple(labels)
+            series[labels] = series.get(labels, 0) + v
+
+    def render(self, series):
+        lines = []
+        for labels, v in sorted(series.items()):
+            lines.append(f"{self.name}{_label_str(self.labelnames, labels)} {_fmt(v)}")
+        return lines
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, registry, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.registry.lock:
+            s = self._series.get(labels)
+            if s is None:
+                # [conteo por bucket (no acumulado) + overflow, suma, total]
+                s = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    def snapshot(self):
+        return [[list(k), [list(v[0]), v[1], v[2]]] for k, v in self._series.items()]
+
+    def merge(self, series, data):
+        for labels, (counts, total, n) in data:
+            labels = tuple(labels)
+            s = series.get(labels)
+            if s is None:
+                series[labels] = [list(counts), total, n]
+                continue
+            s[0] = [a + b for a, b in zip(s[0], counts)]
+            s[1] += total
+            s[2] += n
+
+    def render(self, series):
+        lines = []
+        for labels, (counts, total, n) in sorted(series.items()):
+            acc = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                le = ("le", _fmt(bound) if bound == float("inf") else repr(bound))
+                lines.append(f"{self.name}_bucket{_label_str(self.labelnames, labels, le)} {acc}")
+            lines.append(f"{self.name}_sum{_label_str(self.labelnames, labels)} {_fmt(float(total))}")
+            lines.append(f"{self.name}_count{_label_str(self.labelnames, labels)} {n}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._metrics = {}
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._metrics.setdefault(name, Counter(self, name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._metrics.setdefault(name, Histogram(self, name, help_text, labelnames, buckets))
+
+    def snapshot(self):
+        with self.lock:
+            return {name: m.snapshot() for name, m in self._metrics.items()}
+
+    def render(self, snapshots):
+        """Texto Prometheus (formato 0.0.4) sumando varios snapshots."""
+        out = []
+        for name, metric in self._metrics.items():
+            series = {}
+            for snap in snapshots:
+                metric.merge(series, snap.get(name, []))
+            out.append(f"# HELP {name} {metric.help}")
+            out.append(f"# TYPE {name} {metric.kind}")
+            out.extend(metric.render(series))
+        return "\n".join(out) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "emberholm_request_duration_seconds", "Latencia por ruta", ("method", "route", "status")
+)
+PHASE_SECONDS = registry.histogram(
+    "emberholm_phase_duration_seconds", "Tiempo por fase interna (span)", ("phase",)
+)
+STATE_BYTES = registry.counter(
+    "emberholm_state_bytes_total", "Bytes leídos/escritos por archivo de estado", ("file", "op")
+)
+PROFILES = registry.counter(
+    "emberholm_profiles_total", "Requests perfilados con cProfile", ("kept",)
+)
+
+
+@contextmanager
+def span(phase):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        PHASE_SECONDS.observe(time.perf_counter() - t0, phase)
+
+
+def timed(phase):
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                PHASE_SECONDS.observe(time.perf_counter() - t0, phase)
+        return wrapper
+    return deco
+
+
+def count_bytes(path, op, n):
+    STATE_BYTES.inc(os.path.basename(path), op, amount=n)
+
+
+# ---------------------------------
+# Export entre workers
+# ---------------------------------
+
+class MultiprocessExporter:
+    """
+    Cada worker escribe su snapshot en <metrics_dir>/<pid>.json (a lo sumo
+    cada dump_seconds); render() suma el propio en vivo + los de los demás.
+    Archivos de workers que no escriben hace más de stale_seconds se ignoran.
+    """
+
+    def __init__(self, metrics_dir, dump_seconds=5.0, stale_seconds=3600):
+        self.metrics_dir = metrics_dir
+        self.dump_seconds = dump_seconds
+        self.stale_seconds = stale_seconds
+        self._last_dump = 0.0
+
+    def _path(self, pid):
+        return os.path.join(self.metrics_dir, f"{pid}.json")
+
+    def maybe_dump(self):
+        now = time.monotonic()
+        if now - self._last_dump < self.dump_seconds:
+            return
+        self._last_dump = now
+        self.dump()
+
+    def dump(self):
+        # métricas: sin fsync ni lock, un snapshot perdido no importa
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        data = json.dumps(registry.snapshot(), separators=(",", ":"))
+        fd, tmp = tempfile.mkstemp(dir=self.metrics_dir, prefix=".metrics.", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, self._path(os.getpid()))
+
+    def render(self):
+        snapshots = [registry.snapshot()]
+        own = f"{os.getpid()}.json"
+        cutoff = time.time() - self.stale_seconds
+        try:
+            names = os.listdir(self.metrics_dir)
+        except OSError:
+            names = []
+        for name in names:
+            if not name.endswith(".json") or name == own:
+                continue
+            path = os.path.join(self.metrics_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    continue
+                with open(path, "r", encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return registry.render(snapshots)
+
+
+# ---------------------------------
+# cProfile muestreado
+# ---------------------------------
+
+class SlowRequestProfiler:
+    """
+    Perfila ~sample_rate de los requests (uno a la vez: cProfile no se puede
+    anidar) y guarda el .prof + un resumen .txt de los que tardan más de
+    slow_seconds en profile_dir. sample_rate=0 lo apaga.
+    """
+
+    def __init__(self, profile_dir, sample_rate=0.0, slow_seconds=0.5, keep=50):
+        self.profile_dir = profile_dir
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.keep = keep
+        self._busy = threading.Lock()
+        self._tick = 0
+
+    def start(self):
+        """Devuelve un Profile activo o None si este request no se muestrea."""
+        if self.sample_rate <= 0:
+            return None
+        self._tick += 1
+        if self._tick * self.sample_rate < 1:
+            return None
+        self._tick = 0
+        if not self._busy.acquire(blocking=False):
+            return None
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:  # otro profiler activo en el proceso
+            self._busy.release()
+            return None
+        return prof
+
+    def stop(self, prof, elapsed, label):
+        try:
+            prof.disable()
+            kept = elapsed >= self.slow_seconds
+            PROFILES.inc(str(kept).lower())
+            if kept:
+                self._save(prof, elapsed, label)
+        finally:
+            self._busy.release()
+
+    def _save(self, prof, elapsed, label):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        safe = "".join(c if c.isalnum() else "_" for c in label).strip("_") or "root"
+        base = os.path.join(self.profile_dir, f"{int(time.time() * 1000)}-{int(elapsed * 1000)}ms-{safe}")
+        prof.dump_stats(base + ".prof")
+        buf = io.StringIO()
+        pstats.Stats(prof, stream=buf).sort_stats("cumulative").print_stats(30)
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(f"{label} {elapsed * 1000:.1f} ms\n\n{buf.getvalue()}")
+
+        # sólo los últimos `keep` perfiles
+        files = sorted(n for n in os.listdir(self.profile_dir) if n.endswith(".prof"))
+        for name in files[:-self.keep]:
+            for ext in (".prof", ".txt"):
+                try:
+                    os.unlink(os.path.join(self.profile_dir, name[:-5] + ext))
+                except OSError:
+                    pass
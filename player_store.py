@@ -0,0 +1,548 @@
+import copy
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from metrics import count_bytes
+from state_commit import atomic_write_json, file_lock
+
+# ---------------------------------
+# Repositorio de jugadores
+# ---------------------------------
+#
+# Cada backend guarda la wallet (sin la lista de héroes) y cada héroe como
+# una fila propia. Así una petición lee y escribe sólo la wallet que toca,
+# en vez de parsear y reescribir players.json entero.
+
+
+class PlayerStore:
+    """
+    Interfaz común:
+    - get_player(wallet)            -> dict o None (copia, se puede mutar)
+    - put_player(wallet, player)    -> guarda wallet + todos sus héroes
+    - iter_players()                -> (wallet, player) para jobs offline
+    - iter_heroes()                 -> (wallet, hero)
+    - find_token(token_id)          -> (wallet, slot, hero) o None, vía índice inverso
+    - find_tokens(token_ids)        -> lo mismo en lote
+    - current_rev() / changed_since(rev) -> qué wallets cambiaron (índices en memoria)
+    """
+
+    def get_player(self, wallet):
+        raise NotImplementedError
+
+    def put_player(self, wallet, player_obj):
+        raise NotImplementedError
+
+    def put_many(self, players):
+        for wallet, player_obj in players.items():
+            self.put_player(wallet, player_obj)
+
+    def iter_players(self):
+        raise NotImplementedError
+
+    def iter_heroes(self):
+        for wallet, player_obj in self.iter_players():
+            for hero in player_obj.get("heroes", []):
+                yield wallet, hero
+
+    def find_token(self, token_id):
+        raise NotImplementedError
+
+    def find_tokens(self, token_ids):
+        """{token_id: (wallet, slot, hero)} sólo para los tokens que tienen dueño."""
+        out = {}
+        for token_id in token_ids:
+            found = self.find_token(token_id)
+            if found is not None:
+                out[str(token_id).zfill(5)] = found
+        return out
+
+    def current_rev(self):
+        """Marca opaca del estado actual del store."""
+        return None
+
+    def changed_since(self, rev):
+        """
+        (rev_actual, [wallets escritas después de rev]).
+        None en vez de la lista = no se puede saber, hay que releer todo.
+        """
+        return self.current_rev(), None
+
+    def count(self):
+        return sum(1 for _ in self.iter_players())
+
+    def close(self):
+        pass
+
+
+def _split_player(player_obj):
+    """Separa el objeto jugador en (datos de wallet, lista de héroes)."""
+    head = {k: v for k, v in player_obj.items() if k != "heroes"}
+    return head, list(player_obj.get("heroes", []))
+
+
+class _TokenIndex:
+    """
+    token_id -> wallets que lo tienen, en orden de llegada.
+    Si un token aparece en varias wallets (héroes demo), el dueño es el primero,
+    igual que el escaneo lineal original.
+    """
+
+    def __init__(self):
+        self._owners = {}
+        self._tokens = {}
+
+    def clear(self):
+        self._owners.clear()
+        self._tokens.clear()
+
+    def set_wallet(self, wallet, heroes):
+        tokens = {str(h.get("token_id", "")) for h in heroes}
+        for token_id in self._tokens.get(wallet, set()) - tokens:
+            owners = self._owners.get(token_id, {})
+            owners.pop(wallet, None)
+            if not owners:
+                self._owners.pop(token_id, None)
+        for token_id in tokens:
+            self._owners.setdefault(token_id, {})[wallet] = None
+        self._tokens[wallet] = tokens
+
+    def owner(self, token_id):
+        owners = self._owners.get(token_id)
+        return next(iter(owners)) if owners else None
+
+
+# ---------------------------------
+# Backend en memoria (tests, dev, benchmarks)
+# ---------------------------------
+
+class MemoryPlayerStore(PlayerStore):
+
+    def __init__(self):
+        self._players = {}
+        self._index = _TokenIndex()
+        self._lock = threading.Lock()
+        self._rev = 0
+        self._revs = OrderedDict()
+
+    def _touch(self, wallet):
+        self._rev += 1
+        self._revs[wallet] = self._rev
+        self._revs.move_to_end(wallet)
+
+    def get_player(self, wallet):
+        with self._lock:
+            obj = self._players.get(wallet)
+            return copy.deepcopy(obj) if obj is not None else None
+
+    def put_player(self, wallet, player_obj):
+        with self._lock:
+            self._players[wallet] = copy.deepcopy(player_obj)
+            self._index.set_wallet(wallet, player_obj.get("heroes", []))
+            self._touch(wallet)
+
+    def find_token(self, token_id):
+        token_id = str(token_id).zfill(5)
+        with self._lock:
+            wallet = self._index.owner(token_id)
+            if wallet is None:
+                return None
+            for slot, hero in enumerate(self._players[wallet].get("heroes", [])):
+                if hero.get("token_id") == token_id:
+                    return wallet, slot, copy.deepcopy(hero)
+        return None
+
+    def iter_players(self):
+        with self._lock:
+            snapshot = list(self._players.items())
+        for wallet, pobj in snapshot:
+            yield wallet, copy.deepcopy(pobj)
+
+    def current_rev(self):
+        with self._lock:
+            return self._rev
+
+    def changed_since(self, rev):
+        with self._lock:
+            wallets = []
+            for wallet in reversed(self._revs):
+                if self._revs[wallet] <= rev:
+                    break
+                wallets.append(wallet)
+            return self._rev, wallets
+
+    def count(self):
+        with self._lock:
+            return len(self._players)
+
+
+# ---------------------------------
+# Backend legacy: players.json completo
+# ---------------------------------
+
+class JsonPlayerStore(PlayerStore):
+    """
+    Comportamiento original: todo el archivo se lee y se reescribe.
+    Se mantiene por compatibilidad y como origen de la migración.
+    Cada escritura toma el lock del archivo y lo reemplaza de forma atómica.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._index = _TokenIndex()
+        self._index_sig = None
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "rb") as f:
+            raw = f.read()
+        count_bytes(self.path, "read", len(raw))
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError:
+            return {}
+
+    def _save(self, players):
+        atomic_write_json(self.path, players, indent=4)
+
+    def _file_sig(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def get_player(self, wallet):
+        return self._load().get(wallet)
+
+    def find_token(self, token_id):
+        """
+        El índice se reconstruye sólo cuando players.json cambió en disco;
+        la lectura del héroe sigue necesitando el archivo (backend legacy).
+        """
+        token_id = str(token_id).zfill(5)
+        players = None
+        sig = self._file_sig()
+        if sig != self._index_sig:
+            players = self._load()
+            self._index.clear()
+            for wallet, pobj in players.items():
+                self._index.set_wallet(wallet, pobj.get("heroes", []))
+            self._index_sig = sig
+        wallet = self._index.owner(token_id)
+        if wallet is None:
+            return None
+        if players is None:
+            players = self._load()
+        for slot, hero in enumerate(players.get(wallet, {}).get("heroes", [])):
+            if hero.get("token_id") == token_id:
+                return wallet, slot, hero
+        return None
+
+    def put_player(self, wallet, player_obj):
+        with file_lock(self.path):
+            players = self._load()
+            players[wallet] = player_obj
+            self._save(players)
+
+    def put_many(self, new_players):
+        with file_lock(self.path):
+            players = self._load()
+            players.update(new_players)
+            self._save(players)
+
+    def iter_players(self):
+        yield from self._load().items()
+
+    def current_rev(self):
+        return self._file_sig()
+
+    def changed_since(self, rev):
+        # players.json no sabe qué wallets cambiaron: si el archivo cambió, todo
+        sig = self._file_sig()
+        return sig, ([] if sig == rev else None)
+
+
+# ---------------------------------
+# Backend SQLite embebido
+# ---------------------------------
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    wallet TEXT PRIMARY KEY,
+    data   TEXT NOT NULL,
+    rev    INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS heroes (
+    wallet   TEXT    NOT NULL,
+    slot     INTEGER NOT NULL,
+    token_id TEXT    NOT NULL,
+    data     TEXT    NOT NULL,
+    PRIMARY KEY (wallet, slot)
+);
+-- Índice inverso token_id -> (wallet, slot); SQLite lo mantiene en cada
+-- alta, update o cambio de dueño dentro de la misma transacción.
+CREATE INDEX IF NOT EXISTS heroes_token_id ON heroes (token_id);
+-- migrated: players.json ya se copió (se marca en la misma transacción)
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# players.rev: contador global que sube en cada escritura de la wallet
+# (las escrituras van en BEGIN IMMEDIATE, así que no se repite entre workers).
+_SQLITE_REV_INDEX = "CREATE INDEX IF NOT EXISTS players_rev ON players (rev);"
+
+_NEXT_REV = "(SELECT COALESCE(MAX(rev), 0) + 1 FROM players)"
+
+
+def _ensure_rev_column(conn):
+    """Bases creadas antes de players.rev: se agrega la columna en el lugar."""
+    cols = {row[1] for row in conn.execute("PRAGMA table_info(players)")}
+    if "rev" not in cols:
+        try:
+            conn.execute("ALTER TABLE players ADD COLUMN rev INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass  # otro worker la agregó primero
+    conn.execute(_SQLITE_REV_INDEX)
+
+
+class SQLitePlayerStore(PlayerStore):
+    """
+    Una fila por wallet y una fila por héroe (wallet, slot).
+    - WAL para que varios workers lean mientras otro escribe.
+    - Una conexión por hilo/proceso (sqlite3 no se comparte entre hilos).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SQLITE_SCHEMA)
+        _ensure_rev_column(conn)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _dumps(self, obj):
+        return json.dumps(obj, separators=(",", ":"))
+
+    def get_player(self, wallet):
+        conn = self._conn()
+        row = conn.execute("SELECT data FROM players WHERE wallet = ?", (wallet,)).fetchone()
+        if row is None:
+            return None
+        rows = [data for (data,) in conn.execute(
+            "SELECT data FROM heroes WHERE wallet = ? ORDER BY slot", (wallet,)
+        )]
+        count_bytes(self.path, "read", len(row[0]) + sum(len(data) for data in rows))
+        player_obj = json.loads(row[0])
+        player_obj["heroes"] = [json.loads(data) for data in rows]
+        return player_obj
+
+    def _write_player(self, conn, wallet, player_obj):
+        head, heroes = _split_player(player_obj)
+        head_data = self._dumps(head)
+        written = len(head_data)
+        conn.execute(
+            f"INSERT INTO players (wallet, data, rev) VALUES (?, ?, {_NEXT_REV}) "
+            "ON CONFLICT(wallet) DO UPDATE SET data = excluded.data, rev = excluded.rev",
+            (wallet, head_data),
+        )
+        for slot, hero in enumerate(heroes):
+            hero_data = self._dumps(hero)
+            written += len(hero_data)
+            conn.execute(
+                "INSERT INTO heroes (wallet, slot, token_id, data) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(wallet, slot) DO UPDATE SET "
+                "token_id = excluded.token_id, data = excluded.data",
+                (wallet, slot, str(hero.get("token_id", "")), hero_data),
+            )
+        count_bytes(self.path, "write", written)
+        conn.execute("DELETE FROM heroes WHERE wallet = ? AND slot >= ?", (wallet, len(heroes)))
+
+    def put_player(self, wallet, player_obj):
+        conn = self._conn()
+        with _transaction(conn):
+            self._write_player(conn, wallet, player_obj)
+
+    def put_many(self, players):
+        conn = self._conn()
+        with _transaction(conn):
+            for wallet, player_obj in players.items():
+                self._write_player(conn, wallet, player_obj)
+
+    def migrate_once(self, json_path):
+        """
+        Copia players.json a la base una sola vez entre todos los workers:
+        bajo file_lock, y la marca meta.migrated va en la misma transacción
+        que las filas (un worker que llega después espera y no ve una base a
+        medio migrar). Devuelve cuántas wallets copió (0 si ya estaba hecho).
+        """
+        with file_lock(self.path):
+            conn = self._conn()
+            with _transaction(conn):
+                if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone() is not None:
+                    return 0
+                players = {}
+                # base de antes de la marca: ya tiene las wallets (y escrituras nuevas), no se pisa
+                if conn.execute("SELECT 1 FROM players LIMIT 1").fetchone() is None:
+                    players = _load_players_json(json_path)
+                for wallet, player_obj in players.items():
+                    self._write_player(conn, wallet, player_obj)
+                conn.execute("INSERT INTO meta (key, value) VALUES ('migrated', ?)", (os.path.basename(json_path),))
+            return len(players)
+
+    def find_token(self, token_id):
+        # rowid más bajo = la wallet que lo registró primero
+        row = self._conn().execute(
+            "SELECT wallet, slot, data FROM heroes WHERE token_id = ? ORDER BY rowid LIMIT 1",
+            (str(token_id).zfill(5),),
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def find_tokens(self, token_ids):
+        conn = self._conn()
+        token_ids = [str(t).zfill(5) for t in token_ids]
+        out = {}
+        for i in range(0, len(token_ids), 500):
+            chunk = token_ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT token_id, wallet, slot, data FROM heroes WHERE token_id IN ({marks}) ORDER BY rowid",
+                chunk,
+            )
+            for token_id, wallet, slot, data in rows:
+                if token_id not in out:
+                    out[token_id] = (wallet, slot, json.loads(data))
+        return out
+
+    def iter_players(self):
+        conn = self._conn()
+        current_wallet, current = None, None
+        rows = conn.execute(
+            "SELECT p.wallet, p.data, h.data FROM players p "
+            "LEFT JOIN heroes h ON h.wallet = p.wallet "
+            "ORDER BY p.wallet, h.slot"
+        )
+        for wallet, pdata, hdata in rows:
+            if wallet != current_wallet:
+                if current is not None:
+                    yield current_wallet, current
+                current_wallet = wallet
+                current = json.loads(pdata)
+                current["heroes"] = []
+            if hdata is not None:
+                current["heroes"].append(json.loads(hdata))
+        if current is not None:
+            yield current_wallet, current
+
+    def iter_heroes(self):
+        conn = self._conn()
+        for wallet, data in conn.execute("SELECT wallet, data FROM heroes ORDER BY rowid"):
+            yield wallet, json.loads(data)
+
+    def current_rev(self):
+        (rev,) = self._conn().execute("SELECT COALESCE(MAX(rev), 0) FROM players").fetchone()
+        return rev
+
+    def changed_since(self, rev):
+        if rev is None:
+            return self.current_rev(), None
+        rows = self._conn().execute(
+            "SELECT wallet, rev FROM players WHERE rev > ? ORDER BY rev", (rev,)
+        ).fetchall()
+        if not rows:
+            return rev, []
+        return rows[-1][1], [wallet for wallet, _ in rows]
+
+    def count(self):
+        (n,) = self._conn().execute("SELECT COUNT(*) FROM players").fetchone()
+        return n
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class _transaction:
+    """BEGIN IMMEDIATE / COMMIT / ROLLBACK sobre una conexión en autocommit."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+# ---------------------------------
+# Fábrica + migración desde players.json
+# ---------------------------------
+
+def _load_players_json(json_path):
+    if not os.path.exists(json_path):
+        return {}
+    with open(json_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def migrate_players_json(json_path, store):
+    """
+    Copia todas las wallets de players.json al store indicado.
+    Devuelve cuántas wallets se migraron.
+    """
+    players = _load_players_json(json_path)
+    if players:
+        store.put_many(players)
+    return len(players)
+
+
+def open_player_store(backend, json_path, db_path):
+    """
+    backend: "sqlite" (default), "memory" o "json".
+    Con sqlite se migra players.json una vez (SQLitePlayerStore.migrate_once);
+    vuelve recién con la migración terminada, la haya hecho este worker u otro.
+    """
+    if backend == "memory":
+        return MemoryPlayerStore()
+    if backend == "json":
+        return JsonPlayerStore(json_path)
+    if backend != "sqlite":
+        raise ValueError(f"unknown player store backend: {backend}")
+
+    store = SQLitePlayerStore(db_path)
+    store.migrate_once(json_path)
+    return store
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Migra players.json a la base SQLite.")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--json", default=os.path.join(os.path.dirname(__file__), "data", "players.json"))
+    parser.add_argument("--db", default=os.path.join(os.path.dirname(__file__), "data", "players.db"))
+    args = parser.parse_args()
+
+    n = migrate_players_json(args.json, SQLitePlayerStore(args.db))
+    print(f"migrated {n} wallets -> {args.db}")
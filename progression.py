@@ -0,0 +1,150 @@
+import functools
+from datetime import datetime, timezone
+
+# ---------------------------------
+# Reglas de progresión (compartidas por app.py y los jobs offline)
+# ---------------------------------
+
+# Ganancia pasiva cada 24h por héroe
+PASSIVE_XP_PER_DAY   = 5
+PASSIVE_AURA_PER_DAY = 1
+
+# Cada cuántas horas se refresca la energía natural completa
+ENERGY_FULL_REFRESH_HOURS = 48
+
+# Coste de RECOVER: cuánta XP cuesta recuperar 1 punto de energía
+XP_COST_PER_ENERGY = 5
+
+# En cuántas horas se resetea el cooldown de misión
+ROTATION_HOURS = 72
+
+# Misiones disponibles en la rotación actual
+MISSIONS = [
+    {
+        "id": "001",
+        "name": "The Lost Forge",
+        "difficulty": "EASY",
+        "energy_cost": 10,
+        "reward_xp": 25,
+        "reward_aura": 2,
+        "favored": "Forge Legion / Orc Warrior"
+    },
+    {
+        "id": "002",
+        "name": "Circle Interference Node",
+        "difficulty": "MEDIUM",
+        "energy_cost": 18,
+        "reward_xp": 60,
+        "reward_aura": 5,
+        "favored": "Circle of Mist / Human Wizard"
+    },
+    {
+        "id": "003",
+        "name": "Veil Breach Containment",
+        "difficulty": "HARD",
+        "energy_cost": 25,
+        "reward_xp": 120,
+        "reward_aura": 11,
+        "favored": "Echoes of the Veil / Necromancer"
+    }
+]
+
+MISSIONS_BY_ID = {m["id"]: m for m in MISSIONS}
+
+DAY_SECONDS            = 24 * 3600
+ENERGY_REFRESH_SECONDS = ENERGY_FULL_REFRESH_HOURS * 3600
+
+# ---------------------------------
+# Timestamps
+# ---------------------------------
+
+@functools.lru_cache(maxsize=65536)
+def ts_to_epoch(ts_str):
+    """
+    ISO "2025-10-28T14:06:53.255261Z" -> epoch (float) o None.
+    Cacheado: los mismos anchors se leen en cada request de la wallet.
+    """
+    if not ts_str:
+        return None
+    try:
+        t = datetime.fromisoformat(ts_str.replace("Z", ""))
+    except Exception:
+        return None
+    return t.replace(tzinfo=timezone.utc).timestamp()
+
+def epoch_to_ts(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None).isoformat() + "Z"
+
+# ---------------------------------
+# Pasivo + regen en forma cerrada
+# ---------------------------------
+
+def elapsed_periods(anchor, now, period):
+    """
+    (períodos completos entre anchor y now, anchor avanzado en esos períodos).
+    Sin anchor cuenta como un período vencido y el anchor pasa a ser now.
+    Sirve igual con epochs en segundos (float) o en microsegundos (int).
+    """
+    if anchor is None:
+        return 1, now
+    n = max(0, int((now - anchor) // period))
+    return n, anchor + n * period
+
+def passive_accrual(ds, now):
+    """
+    Cuánto acumuló un héroe hasta now (epoch), sin tocar ds:
+    - ticks:        días completos desde el anchor pasivo (passive_anchor,
+                    o last_update en héroes viejos)
+    - refreshes:    ciclos de ENERGY_FULL_REFRESH_HOURS desde last_energy_refresh
+    - passive_anchor / energy_anchor: anchors nuevos, avanzados en múltiplos
+      exactos del período (no se pierde el tiempo parcial)
+    Sin anchor cuenta como un período vencido y el anchor pasa a ser now.
+    """
+    ticks, new_anchor = elapsed_periods(
+        ts_to_epoch(ds.get("passive_anchor") or ds.get("last_update")), now, DAY_SECONDS
+    )
+    refreshes, new_e_anchor = elapsed_periods(
+        ts_to_epoch(ds.get("last_energy_refresh")), now, ENERGY_REFRESH_SECONDS
+    )
+
+    return {
+        "ticks":          ticks,
+        "xp_gain":        ticks * PASSIVE_XP_PER_DAY,
+        "aura_gain":      ticks * PASSIVE_AURA_PER_DAY,
+        "passive_anchor": new_anchor,
+        "refreshes":      refreshes,
+        "energy_anchor":  new_e_anchor,
+    }
+
+def accrue_hero(ds, now):
+    """
+    Materializa passive_accrual sobre ds (muta).
+    Devuelve (xp_gain, aura_gain, changed).
+    """
+    acc = passive_accrual(ds, now)
+    changed = False
+
+    # héroes viejos usan last_update como anchor: se fija acá para que
+    # una misión (que sí pisa last_update) no reinicie el reloj pasivo
+    if "passive_anchor" not in ds:
+        ds["passive_anchor"] = epoch_to_ts(acc["passive_anchor"])
+
+    if acc["ticks"]:
+        ds["xp_total"]       = ds.get("xp_total", 0) + acc["xp_gain"]
+        ds["aura_level"]     = ds.get("aura_level", 0) + acc["aura_gain"]
+        ds["passive_anchor"] = epoch_to_ts(acc["passive_anchor"])
+        # hora del último tick, no "ahora": la vista es estable entre ticks
+        ds["last_update"]    = ds["passive_anchor"]
+        changed = True
+
+    if acc["refreshes"]:
+        ds["energy_current"]      = ds.get("energy_max", 100)
+        ds["last_energy_refresh"] = epoch_to_ts(acc["energy_anchor"])
+        changed = True
+
+    return acc["xp_gain"], acc["aura_gain"], changed
+
+def passive_epoch(ds, now):
+    """(ticks, refreshes) pendientes: entra en los ETag de lecturas sin escritura."""
+    acc = passive_accrual(ds, now)
+    return acc["ticks"], acc["refreshes"]
@@ -0,0 +1,248 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from collection_index import CATEGORICAL, NUMERIC
+from state_commit import atomic_write_json
+
+try:
+    import numpy as np
+except ImportError:  # sin numpy: mismo cálculo con array/listas (más lento, mismo resultado)
+    np = None
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------
+# Rareza de traits + estadísticas de la colección
+# ---------------------------------
+#
+# Una pasada vectorizada sobre las columnas de CollectionColumns:
+#   trait_counts  -> cuántos tokens tienen cada valor de race/class/rarity/starting_guild
+#   score         -> rareza estadística: sum(N / count(valor)) sobre esos traits
+#   rank          -> 1 = el más raro (score más alto); empates por token_id
+#   stats         -> distribución de age y str..cha (min/max/media/desvío/percentiles/histograma)
+# El resultado se guarda en data/rarity.json con el fingerprint de las
+# columnas: si la metadata no cambió, un worker nuevo lo carga sin recalcular.
+# Las columnas se refrescan por token; los scores se recalculan completos
+# (un cambio de trait mueve los conteos de todos), pero es una pasada de ms.
+# Los requests (tokenURI incluido) leen siempre el último resultado armado:
+# la carga inicial va en warm() al arrancar y el re-chequeo de la fuente en
+# un hilo por worker cada refresh_seconds.
+
+RARITY_TRAITS = CATEGORICAL
+PERCENTILES   = (10, 25, 50, 75, 90)
+CACHE_FORMAT  = 1
+
+
+def _scores(columns):
+    n = len(columns)
+    counts = {}
+    if np is not None:
+        score = np.zeros(n)
+        for f in RARITY_TRAITS:
+            codes = np.asarray(columns.categorical[f]["codes"], dtype=np.int64)
+            c = np.bincount(codes, minlength=len(columns.categorical[f]["values"]))
+            counts[f] = c.tolist()
+            if n:
+                score += n / c[codes]
+        order = np.lexsort((np.arange(n), -score))
+        ranks = np.empty(n, dtype=np.int64)
+        ranks[order] = np.arange(1, n + 1)
+        return counts, score.tolist(), ranks.tolist()
+
+    score = array("d", bytes(8 * n))
+    for f in RARITY_TRAITS:
+        codes = columns.categorical[f]["codes"]
+        c = [0] * len(columns.categorical[f]["values"])
+        for code in codes:
+            c[code] += 1
+        counts[f] = c
+        inv = [n / k if k else 0.0 for k in c]
+        for i, code in enumerate(codes):
+            score[i] += inv[code]
+    ranks = [0] * n
+    for r, i in enumerate(sorted(range(n), key=lambda i: (-score[i], i)), start=1):
+        ranks[i] = r
+    return counts, score.tolist(), ranks
+
+
+def _distribution(values):
+    n = len(values)
+    if not n:
+        return {"min": 0, "max": 0, "mean": 0, "stdev": 0, "percentiles": {}, "histogram": []}
+    if np is not None:
+        arr = np.asarray(values, dtype=np.int64)
+        ordered = np.sort(arr).tolist()
+        mean = float(arr.mean())
+        stdev = float(arr.std())
+        lo = ordered[0]
+        hist = {lo + k: int(c) for k, c in enumerate(np.bincount(arr - lo)) if c}
+    else:
+        ordered = sorted(values)
+        mean = math.fsum(ordered) / n
+        stdev = math.sqrt(math.fsum((v - mean) ** 2 for v in ordered) / n)
+        hist = dict(sorted(Counter(ordered).items()))
+    return {
+        "min": ordered[0],
+        "max": ordered[-1],
+        "mean": round(mean, 3),
+        "stdev": round(stdev, 3),
+        # nearest-rank: siempre un valor real de la colección
+        "percentiles": {f"p{p}": ordered[max(0, math.ceil(p / 100 * n) - 1)] for p in PERCENTILES},
+        # [[valor, conteo], ...] en orden (un dict de JSON ordenaría las claves como texto)
+        "histogram": [[k, v] for k, v in hist.items()],
+    }
+
+
+class RarityEngine:
+    """
+    Resultados de rareza sobre CollectionColumns, recalculados cuando cambia
+    su fingerprint. fingerprint sirve también como versión para ETag/caches.
+    """
+
+    def __init__(self, columns, cache_path, refresh_seconds=None):
+        self.columns = columns
+        self.cache_path = cache_path
+        # None: el mismo intervalo con que se re-chequean las columnas
+        self.refresh_seconds = columns.recheck_seconds if refresh_seconds is None else refresh_seconds
+        self._lock = threading.Lock()
+        self._result = None
+        self._version = None
+        # (resultado, token_nums, categorical) de la misma versión de columnas
+        self._snapshot = None
+        self._thread_pid = None
+
+    def _load_cache(self, fingerprint):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("format") != CACHE_FORMAT or data.get("fingerprint") != fingerprint:
+            return None
+        return data
+
+    def _compute(self):
+        cols = self.columns
+        counts, scores, ranks = _scores(cols)
+        return {
+            "format": CACHE_FORMAT,
+            "fingerprint": cols.fingerprint,
+            "total": len(cols),
+            "trait_counts": {
+                f: dict(zip(cols.categorical[f]["values"], counts[f])) for f in RARITY_TRAITS
+            },
+            "stats": {f: _distribution(cols.numeric[f]) for f in NUMERIC},
+            "scores": [round(s, 4) for s in scores],
+            "ranks": ranks,
+        }
+
+    def _ensure(self):
+        self.columns.ensure()
+        if self._version == self.columns.version:
+            return self._result
+        with self._lock:
+            if self._version != self.columns.version:
+                version = self.columns.version
+                result = self._load_cache(self.columns.fingerprint)
+                if result is None:
+                    result = self._compute()
+                    try:
+                        atomic_write_json(self.cache_path, result, indent=None, fsync="never")
+                    except OSError:
+                        pass
+                self._result = result
+                self._version = version
+                self._snapshot = (result, self.columns.token_nums, dict(self.columns.categorical))
+        return self._result
+
+    def warm(self):
+        """Carga columnas + resultado (cache en disco o cálculo) antes del primer request."""
+        self._ensure()
+        return self
+
+    def _ensure_thread(self):
+        # el hilo se arranca en el worker (después del fork), no en el master
+        if self.refresh_seconds <= 0 or self._thread_pid == os.getpid():
+            return
+        self._thread_pid = os.getpid()
+        t = threading.Thread(target=self._run, name="rarity-refresh", daemon=True)
+        t.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.refresh_seconds)
+            try:
+                self.columns.refresh(force=True)
+                self._ensure()
+            except Exception:
+                log.exception("refresh de rareza falló; se reintenta en %ss", self.refresh_seconds)
+
+    def _current(self):
+        """Último snapshot sin tocar la fuente; sólo carga si este proceso todavía no tiene uno."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            self._ensure()
+            snapshot = self._snapshot
+        self._ensure_thread()
+        return snapshot
+
+    @property
+    def fingerprint(self):
+        return self._current()[0]["fingerprint"]
+
+    def summary(self):
+        """Conteos (con %) por trait + distribuciones de stats; sin los arrays por token."""
+        result = self._current()[0]
+        total = result["total"]
+        return {
+            "total": total,
+            "traits": {
+                f: {
+                    value: {"count": c, "pct": round(100 * c / total, 3) if total else 0}
+                    for value, c in sorted(counts.items(), key=lambda kv: kv[1])
+                }
+                for f, counts in result["trait_counts"].items()
+            },
+            "stats": result["stats"],
+        }
+
+    @staticmethod
+    def _position(nums, token_id):
+        try:
+            token_num = int(token_id)
+        except (TypeError, ValueError):
+            return None
+        i = bisect_left(nums, token_num)
+        return i if i < len(nums) and nums[i] == token_num else None
+
+    def rank(self, token_id):
+        result, nums, _ = self._current()
+        i = self._position(nums, token_id)
+        return result["ranks"][i] if i is not None else None
+
+    def token(self, token_id):
+        """Score, puesto y frecuencia de cada trait de un token (None si no existe)."""
+        result, nums, categorical = self._current()
+        i = self._position(nums, token_id)
+        if i is None:
+            return None
+        total = result["total"]
+        traits = {}
+        for f in RARITY_TRAITS:
+            value = categorical[f]["values"][categorical[f]["codes"][i]]
+            count = result["trait_counts"][f][value]
+            traits[f] = {"value": value, "count": count, "pct": round(100 * count / total, 3)}
+        return {
+            "token_id": f"{nums[i]:05d}",
+            "score": result["scores"][i],
+            "rank": result["ranks"][i],
+            "of": total,
+            "traits": traits,
+        }
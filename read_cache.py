@@ -0,0 +1,171 @@
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import registry
+
+# ---------------------------------
+# Lecturas calientes: single-flight + cache TTL/LRU
+# ---------------------------------
+#
+# Cuando un marketplace refresca la colección llegan muchas copias del mismo
+# GET /api/metadata/<id> o /api/player/<wallet> a la vez. Dentro de un worker:
+# - SingleFlight: si ya hay un cálculo en curso para esa clave, los demás
+#   hilos esperan su resultado en vez de repetir la carga.
+# - ReadCache: el resultado (ETag + cuerpo ya serializado) queda ttl segundos,
+#   con tope de entradas y de bytes (LRU). Las escrituras de este worker
+#   invalidan sus claves; las de otros workers se ven a más tardar en ttl.
+# En un miss el ETag sale primero (probe, barato): si el cliente ya tiene esa
+# versión se responde 304 sin armar ni serializar el cuerpo (render).
+
+READ_CACHE_EVENTS = registry.counter(
+    "emberholm_read_cache_total",
+    "Lecturas por resultado (hit/miss/coalesced/not_modified/evicted)", ("cache", "result"),
+)
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """(resultado, compartido): fn() corre una sola vez por clave a la vez."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except BaseException as e:  # abort(404) también se comparte
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class CachedRead:
+    """Respuesta armada: ETag, cuerpo serializado y Last-Modified (body None: sólo el ETag, para un 304)."""
+
+    __slots__ = ("etag", "body", "last_modified", "expires")
+
+    def __init__(self, etag, body, last_modified=None):
+        self.etag = etag
+        self.body = body
+        self.last_modified = last_modified
+        self.expires = 0.0
+
+
+class ReadCache:
+
+    def __init__(self, name, ttl=2.0, max_entries=4096, max_bytes=32 << 20):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self.counts = {"hit": 0, "miss": 0, "coalesced": 0, "not_modified": 0, "evicted": 0}
+
+    def _count(self, result):
+        self.counts[result] += 1
+        READ_CACHE_EVENTS.inc(self.name, result)
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires < time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry.body)
+
+    def _store(self, key, entry, generation):
+        size = len(entry.body)
+        if self.ttl <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            # hubo una escritura mientras se armaba: puede ser vieja, no se guarda
+            if generation != self._generation:
+                return
+            self._drop(key)
+            entry.expires = time.monotonic() + self.ttl
+            self._entries[key] = entry
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                old_key = next(iter(self._entries))
+                self._drop(old_key)
+                self._count("evicted")
+
+    def get(self, key, probe, render, known=None):
+        """
+        CachedRead para key (None si no hay nada que servir).
+        - probe() -> (etag, estado) o None: lo barato, sin cuerpo
+        - render(etag, estado) -> CachedRead con el cuerpo de ese mismo estado
+        - known(etag): True si el cliente ya tiene esa versión (If-None-Match);
+          entonces se devuelve CachedRead(etag, None) sin llamar a render
+        probe y render corren una vez aunque lleguen N pedidos juntos.
+        """
+        entry = self._lookup(key)
+        if entry is not None:
+            self._count("hit")
+            return entry
+
+        generation = self._generation
+        probed, _ = self._flight.do(("probe", key), probe)
+        if probed is None:
+            return None
+        etag, state = probed
+        if known is not None and known(etag):
+            self._count("not_modified")
+            return CachedRead(etag, None)
+
+        def load():
+            entry = render(etag, state)
+            if entry is not None:
+                self._store(key, entry, generation)
+            return entry
+
+        # por ETag: un pedido que ya vio un estado más nuevo no espera el render del viejo
+        entry, shared = self._flight.do((key, etag), load)
+        self._count("coalesced" if shared else "miss")
+        return entry
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._drop(key)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, **self.counts}
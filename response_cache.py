@@ -0,0 +1,96 @@
+import gzip
+import hashlib
+import threading
+
+from flask import current_app, request
+from flask import json as flask_json
+
+try:
+    import brotli
+except ImportError:  # opcional: sin brotli se sirve gzip / identity
+    brotli = None
+
+# ---------------------------------
+# Cache de respuestas ya serializadas y comprimidas
+# ---------------------------------
+#
+# Para endpoints "calientes" cuyo contenido depende de un estado chico
+# (stats, guilds, missions, páginas HTML): se guarda el cuerpo ya codificado
+# y sus variantes gzip/br, junto con la versión de datos con la que se armó. Mientras la
+# versión no cambie, responder es elegir la variante según Accept-Encoding
+# y copiar bytes; no se relee ni se re-serializa nada.
+
+# Debajo de esto comprimir no ahorra nada que valga la pena
+MIN_COMPRESS_SIZE = 256
+
+
+class CachedBody:
+    __slots__ = ("version", "variants")
+
+    def __init__(self, version, body):
+        self.version = version
+        etag = hashlib.sha1(body).hexdigest()[:24]
+        # encoding -> (bytes, etag); cada representación con su ETag fuerte
+        self.variants = {"identity": (body, etag)}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            self.variants["gzip"] = (gzip.compress(body, 6, mtime=0), f"{etag}-gz")
+            if brotli is not None:
+                self.variants["br"] = (brotli.compress(body, quality=9), f"{etag}-br")
+
+
+def negotiate_encoding(available):
+    """br > gzip > identity, respetando q=0 en Accept-Encoding."""
+    accept = request.accept_encodings
+    for encoding in ("br", "gzip"):
+        if encoding in available and accept.quality(encoding) > 0:
+            return encoding
+    return "identity"
+
+
+class ResponseCache:
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, version, build, mimetype="application/json"):
+        """
+        CachedBody para key; build() sólo corre si la versión cambió.
+        Con JSON build() devuelve el objeto; con otro mimetype, str o bytes.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry.version == version:
+            return entry
+        if mimetype == "application/json":
+            body = flask_json.dumps(build()).encode("utf-8") + b"\n"
+        else:
+            body = build()
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+        entry = CachedBody(version, body)
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def respond(self, key, version, build, max_age=0, mimetype="application/json"):
+        entry = self.get(key, version, build, mimetype)
+        encoding = negotiate_encoding(entry.variants)
+        body, etag = entry.variants[encoding]
+
+        resp = current_app.response_class(body, mimetype=mimetype)
+        if encoding != "identity":
+            resp.headers["Content-Encoding"] = encoding
+        resp.headers["Vary"] = "Accept-Encoding"
+        resp.set_etag(etag)
+        resp.cache_control.public = True
+        resp.cache_control.max_age = max_age
+        if max_age == 0:
+            resp.cache_control.no_cache = True
+        return resp.make_conditional(request)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
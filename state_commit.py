@@ -0,0 +1,158 @@
+import json
+import os
+import tempfile
+import threading
+import zlib
+from contextlib import contextmanager
+
+from metrics import count_bytes
+
+try:
+    import fcntl
+except ImportError:  # Windows (dev local): sólo locks entre hilos
+    fcntl = None
+
+# ---------------------------------
+# Commits seguros entre workers
+# ---------------------------------
+#
+# - atomic_write_json: escribe a un temporal en el mismo directorio y hace
+#   os.replace(). Un lector ve el archivo viejo o el nuevo, nunca uno a medias.
+# - file_lock: lock exclusivo (hilos + procesos) para read-modify-write de
+#   un archivo de estado (stats.json, guilds.json, players.json legacy).
+# - WalletLocks: lock por wallet, repartido en N franjas (un archivo de
+#   lock por franja en data/locks/).
+#
+# Política de fsync (EMBERHOLM_FSYNC):
+#   "always" -> fsync del archivo y del directorio (default)
+#   "data"   -> sólo fsync del archivo
+#   "never"  -> confía en el page cache (dev / benchmarks)
+
+FSYNC_POLICY = os.environ.get("EMBERHOLM_FSYNC", "always")
+
+WALLET_LOCK_STRIPES = 256
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+_held_files = threading.local()
+
+
+def _thread_lock(key):
+    with _thread_locks_guard:
+        lock = _thread_locks.get(key)
+        if lock is None:
+            lock = _thread_locks[key] = threading.RLock()
+        return lock
+
+
+def _fsync_dir(path):
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write_bytes(path, data, fsync=None):
+    policy = fsync or FSYNC_POLICY
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=os.path.dirname(os.path.abspath(path))
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            if policy in ("always", "data"):
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        count_bytes(path, "write", len(data))
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    if policy == "always":
+        _fsync_dir(path)
+
+
+def atomic_write_json(path, obj, indent=4, fsync=None):
+    atomic_write_bytes(path, json.dumps(obj, indent=indent).encode("utf-8"), fsync=fsync)
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Lock exclusivo sobre <path>.lock, reentrante dentro del mismo hilo.
+    Protege el ciclo load -> modificar -> save de un archivo de estado.
+    """
+    lock_path = f"{path}.lock"
+    held = _held_files.__dict__.setdefault("paths", {})
+    with _thread_lock(lock_path):
+        if held.get(lock_path) or fcntl is None:
+            held[lock_path] = held.get(lock_path, 0) + 1
+            try:
+                yield
+            finally:
+                held[lock_path] -= 1
+            return
+
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            held[lock_path] = 1
+            try:
+                yield
+            finally:
+                held[lock_path] = 0
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+
+class WalletLocks:
+    """
+    Locks por wallet entre procesos: la wallet cae en una franja
+    (crc32 % stripes) y se toma flock sobre locks/wallet-<franja>.lock.
+    Dos wallets en la misma franja se serializan entre sí; nada más.
+
+    flock y no lockf: los locks POSIX son por proceso y el kernel reporta
+    falsos deadlocks (EDEADLK) cuando varios hilos esperan franjas cruzadas.
+    """
+
+    def __init__(self, lock_dir, stripes=WALLET_LOCK_STRIPES):
+        self.lock_dir = lock_dir
+        self.stripes = stripes
+        self._stripe_locks = [threading.RLock() for _ in range(stripes)]
+        self._held = threading.local()
+
+    def stripe(self, wallet):
+        return zlib.crc32(str(wallet).encode("utf-8")) % self.stripes
+
+    @contextmanager
+    def lock(self, wallet):
+        stripe = self.stripe(wallet)
+        held = self._held.__dict__.setdefault("stripes", {})
+        with self._stripe_locks[stripe]:
+            if held.get(stripe) or fcntl is None:
+                held[stripe] = held.get(stripe, 0) + 1
+                try:
+                    yield
+                finally:
+                    held[stripe] -= 1
+                return
+
+            os.makedirs(self.lock_dir, exist_ok=True)
+            fd = os.open(os.path.join(self.lock_dir, f"wallet-{stripe:04d}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                held[stripe] = 1
+                try:
+                    yield
+                finally:
+                    held[stripe] = 0
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            finally:
+                os.close(fd)
@@ -0,0 +1,134 @@
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+
+from flask import abort, current_app, send_file
+from werkzeug.security import safe_join
+
+# ---------------------------------
+# Assets estáticos con fingerprint
+# ---------------------------------
+#
+# /assets/<digest>/<ruta> sirve static/<ruta> con Cache-Control immutable de
+# un año: el digest es el hash del contenido, así que si el archivo cambia
+# cambia la URL y los navegadores/CDN nunca sirven una versión vieja.
+# index.html y mint.html se reescriben para apuntar a esas URLs.
+#
+# Descarga de archivos grandes (portal.mp4):
+#   - default     : send_file con Range/206; gunicorn usa sendfile() (zero-copy)
+#   - "x-sendfile": Apache/lighttpd mandan el archivo (header X-Sendfile)
+#   - "x-accel"   : nginx lo manda vía X-Accel-Redirect; el worker responde
+#                   sólo headers y queda libre. Config nginx:
+#                       location /_static/ { internal; alias /ruta/a/static/; }
+
+ASSET_PREFIX      = "/assets"
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+DIGEST_LEN        = 10
+
+# Las páginas no llevan fingerprint (su URL es la pública)
+UNVERSIONED_EXT = (".html",)
+
+# "img/x.png", "/img/x.png" dentro de atributos/url(): se reemplazan si existen en static/
+_REF_RE = re.compile(r"""(["'(])/?([\w\-./]+\.\w+)(?=["')])""")
+
+
+def _file_digest(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()[:DIGEST_LEN]
+
+
+class AssetManifest:
+    """
+    ruta relativa (posix) -> digest del contenido. Se arma una vez por
+    worker (un deploy reinicia los workers); con reload=True se vuelve a
+    escanear en cada uso (modo debug).
+    """
+
+    def __init__(self, static_dir, reload=False):
+        self.static_dir = static_dir
+        self.reload = reload
+        self._digests = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        digests = {}
+        for root, _, files in os.walk(self.static_dir):
+            for name in files:
+                if name.startswith(".") or name.endswith(UNVERSIONED_EXT):
+                    continue
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, self.static_dir).replace(os.sep, "/")
+                digests[rel] = _file_digest(path)
+        return digests
+
+    def _manifest(self):
+        if self._digests is None or self.reload:
+            with self._lock:
+                if self._digests is None or self.reload:
+                    digests = self._scan()
+                    self._version = hashlib.sha1(
+                        "".join(f"{k}={v};" for k, v in sorted(digests.items())).encode("utf-8")
+                    ).hexdigest()[:DIGEST_LEN]
+                    self._digests = digests
+        return self._digests
+
+    @property
+    def version(self):
+        self._manifest()
+        return self._version
+
+    def digest(self, rel_path):
+        return self._manifest().get(rel_path.lstrip("/"))
+
+    def url(self, rel_path):
+        """URL con fingerprint, o la ruta tal cual si no es un asset conocido."""
+        if not rel_path or "://" in rel_path:
+            return rel_path
+        rel = rel_path.lstrip("/")
+        digest = self.digest(rel)
+        return f"{ASSET_PREFIX}/{digest}/{rel}" if digest else rel_path
+
+    def rewrite(self, html):
+        """Reemplaza referencias a assets locales en un HTML por su URL con fingerprint."""
+        manifest = self._manifest()
+
+        def sub(m):
+            quote, rel = m.group(1), m.group(2)
+            if rel not in manifest:
+                return m.group(0)
+            return f"{quote}{ASSET_PREFIX}/{manifest[rel]}/{rel}"
+
+        return _REF_RE.sub(sub, html)
+
+
+def send_asset(static_dir, rel_path, immutable, sendfile_mode="", accel_prefix="/_static", max_age=3600):
+    """
+    Respuesta para un archivo de static/:
+    - Range / If-None-Match / If-Modified-Since vía send_file (206 / 304)
+    - immutable=True -> Cache-Control: public, max-age=1 año, immutable
+    - sendfile_mode "x-accel": sólo headers, el archivo lo manda nginx
+    ("x-sendfile" lo resuelve send_file con app.use_x_sendfile)
+    """
+    path = safe_join(static_dir, rel_path)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    age = IMMUTABLE_MAX_AGE if immutable else max_age
+    if sendfile_mode == "x-accel":
+        resp = current_app.response_class(status=200)
+        resp.headers["X-Accel-Redirect"] = f"{accel_prefix.rstrip('/')}/{rel_path}"
+        resp.mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        resp.cache_control.public = True
+        resp.cache_control.max_age = age
+    else:
+        resp = send_file(path, conditional=True, etag=True, max_age=age)
+
+    if immutable:
+        resp.cache_control.immutable = True
+    return resp
@@ -0,0 +1,143 @@
+import atexit
+import json
+import logging
+import os
+import threading
+
+from metrics import count_bytes, registry
+from state_commit import atomic_write_json, file_lock
+
+# ---------------------------------
+# Contadores globales con write-behind
+# ---------------------------------
+#
+# Los handlers ya no reescriben stats.json en cada misión/tick: acumulan un
+# "delta" con la misma forma que stats.json y el agregador lo suma en memoria.
+# Cada FLUSH_SECONDS (o al juntar MAX_PENDING eventos, o al salir el worker)
+# el delta se suma al archivo bajo file_lock. Como sólo se suman deltas,
+# varios workers haciendo flush se combinan bien; un crash pierde como mucho
+# la ventana sin flushear de ese worker.
+# Un flush que falla (disco lleno, permisos) deja el delta en la cola, se
+# loguea y suma a emberholm_state_flush_errors_total.
+
+log = logging.getLogger(__name__)
+
+FLUSH_ERRORS = registry.counter(
+    "emberholm_state_flush_errors_total", "Flushes write-behind fallidos (el delta queda en la cola)", ("file",)
+)
+
+
+def merge_stats_delta(target, delta):
+    """
+    Suma delta sobre target (ambos con forma de stats.json): claves
+    numéricas de primer nivel. Los gremios van aparte (ver guild_stats).
+    """
+    for key, val in delta.items():
+        if isinstance(val, (int, float)) and not isinstance(val, bool):
+            target[key] = target.get(key, 0) + val
+    return target
+
+
+class StatsAggregator:
+    """
+    Write-behind genérico sobre un archivo JSON. Las subclases cambian:
+    - empty_state  : contenido si el archivo no existe
+    - merge_pending: cómo se suman dos deltas en memoria
+    - apply_delta  : cómo se aplica un delta al contenido del archivo
+    """
+
+    empty_state   = dict
+    merge_pending = staticmethod(merge_stats_delta)
+    apply_delta   = staticmethod(merge_stats_delta)
+
+    def __init__(self, path, flush_seconds=5.0, max_pending=500):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self._pending = {}
+        self._events = 0
+        self._version = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread_pid = None
+        atexit.register(self.flush)
+
+    def _ensure_thread(self):
+        # el hilo se arranca en el worker (después del fork), no en el master
+        if self.flush_seconds <= 0 or self._thread_pid == os.getpid():
+            return
+        self._thread_pid = os.getpid()
+        t = threading.Thread(target=self._run, name="stats-flush", daemon=True)
+        t.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                FLUSH_ERRORS.inc(os.path.basename(self.path))
+                log.exception("flush de %s falló; se reintenta en %ss", self.path, self.flush_seconds)
+
+    def add(self, delta):
+        """Encola un delta con forma de stats.json (ver merge_stats_delta)."""
+        if not delta:
+            return
+        with self._lock:
+            self.merge_pending(self._pending, delta)
+            self._events += 1
+            self._version += 1
+            events = self._events
+        if self.flush_seconds <= 0:
+            self.flush()
+            return
+        self._ensure_thread()
+        if events >= self.max_pending:
+            self._wake.set()
+
+    def _file_sig(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def version(self):
+        """
+        Cambia cuando cambia lo que devolvería read(): el archivo (flush de
+        cualquier worker, por rename atómico) o los deltas de este worker.
+        """
+        return self._file_sig(), self._version
+
+    def pending(self):
+        with self._lock:
+            return json.loads(json.dumps(self._pending))
+
+    def read(self, base):
+        """stats.json + lo que este worker todavía no flusheó."""
+        return self.apply_delta(base, self.pending())
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                delta, self._pending, self._events = self._pending, {}, 0
+            if not delta:
+                return False
+            try:
+                with file_lock(self.path):
+                    state = self.empty_state()
+                    if os.path.exists(self.path):
+                        with open(self.path, "rb") as f:
+                            raw = f.read()
+                        count_bytes(self.path, "read", len(raw))
+                        state = json.loads(raw)
+                    state = self.apply_delta(state, delta)
+                    atomic_write_json(self.path, state, indent=4)
+            except Exception:
+                # no se pierde nada: el delta vuelve a la cola para el próximo intento
+                with self._lock:
+                    self._pending = self.merge_pending(delta, self._pending)
+                raise
+            return True
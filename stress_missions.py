@@ -0,0 +1,149 @@
+"""
+Stress test de commits concurrentes.
+
+Levanta varios procesos (como workers de gunicorn) con varios hilos cada uno,
+todos disparando /api/mission/execute contra el mismo directorio de datos.
+Cada combinación (wallet, héroe, misión) se envía dos veces y en desorden.
+
+Al final verifica que no se perdió ningún update:
+- missions_completed en stats.json == cantidad de respuestas 200
+- total_exp / total_aura en stats.json == suma de recompensas devueltas
+- XP de cada héroe en el store == XP demo inicial + recompensas de ese héroe
+- cada wallet demo corre exactamente 5 misiones (00001 las 3, 00002 sólo 2 por energía)
+- successes / xp_gained de cada gremio en guilds.json == misiones y XP de sus héroes
+
+Uso:
+    python stress_missions.py --processes 4 --threads 8 --wallets 40
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+DEMO_START_XP = {"00001": 120, "00002": 210}
+DEMO_GUILDS   = {"00001": "Circle of Mist", "00002": "Forge Legion"}
+MISSION_IDS   = ["001", "002", "003"]
+
+
+def _worker(data_dir, jobs, threads, out_q):
+    os.environ["EMBERHOLM_DATA_DIR"] = data_dir
+    os.environ["EMBERHOLM_METADATA_DIR"] = os.path.join(HERE, "data", "metadata")
+    sys.path.insert(0, HERE)
+    from app import app, guild_stats, stats_aggregator
+
+    def run(job):
+        wallet, hero_id, mission_id = job
+        client = app.test_client()
+        r = client.post("/api/mission/execute", json={
+            "wallet": wallet, "hero_id": hero_id, "mission_id": mission_id
+        })
+        return job, r.status_code, (r.get_json() if r.status_code == 200 else None)
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(run, jobs))
+    # multiprocessing no corre atexit: flush explícito, como al apagar un worker
+    stats_aggregator.flush()
+    guild_stats.flush()
+    out_q.put(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--wallets", type=int, default=40)
+    parser.add_argument("--backend", default="sqlite", choices=["sqlite", "json"])
+    parser.add_argument("--keep", action="store_true", help="no borrar el directorio temporal")
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix="emberholm-stress-")
+    shutil.copy(os.path.join(HERE, "data", "stats.json"), data_dir)
+    shutil.copy(os.path.join(HERE, "data", "guilds.json"), data_dir)
+    os.environ["EMBERHOLM_PLAYER_STORE"] = args.backend
+    os.environ["EMBERHOLM_FSYNC"] = "never"
+
+    with open(os.path.join(data_dir, "stats.json"), encoding="utf-8") as f:
+        stats_before = json.load(f)
+    legacy_ranking = stats_before.get("guild_ranking", {})
+
+    wallets = [f"0xstress{i:04d}" for i in range(args.wallets)]
+    jobs = [(w, h, m) for w in wallets for h in DEMO_START_XP for m in MISSION_IDS] * 2
+    random.shuffle(jobs)
+
+    ctx = multiprocessing.get_context("spawn")
+    out_q = ctx.Queue()
+    chunks = [jobs[i::args.processes] for i in range(args.processes)]
+    procs = [ctx.Process(target=_worker, args=(data_dir, c, args.threads, out_q)) for c in chunks]
+    for p in procs:
+        p.start()
+    results = [r for _ in procs for r in out_q.get()]
+    for p in procs:
+        p.join()
+
+    ok = [(job, body) for job, status, body in results if status == 200]
+    unexpected = [(job, status) for job, status, _ in results if status not in (200, 400)]
+
+    with open(os.path.join(data_dir, "stats.json"), encoding="utf-8") as f:
+        stats_after = json.load(f)
+    with open(os.path.join(data_dir, "guilds.json"), encoding="utf-8") as f:
+        guilds_after = {g["name"]: g for g in json.load(f)}
+
+    os.environ["EMBERHOLM_DATA_DIR"] = data_dir
+    sys.path.insert(0, HERE)
+    from app import player_store
+
+    errors = []
+    if unexpected:
+        errors.append(f"unexpected statuses: {unexpected[:5]}")
+
+    def delta(key):
+        return stats_after.get(key, 0) - stats_before.get(key, 0)
+
+    if delta("missions_completed") != len(ok):
+        errors.append(f"missions_completed delta {delta('missions_completed')} != {len(ok)} successes")
+    if delta("total_exp_collected") != sum(b["xp_gained"] for _, b in ok):
+        errors.append("total_exp_collected does not match the rewards handed out")
+    if delta("total_aura_collected") != sum(b["aura_gained"] for _, b in ok):
+        errors.append("total_aura_collected does not match the rewards handed out")
+
+    for token_id, g_name in DEMO_GUILDS.items():
+        g = guilds_after[g_name]
+        runs = [b for job, b in ok if job[1] == token_id]
+        if g["successes"] - legacy_ranking.get(g_name, {}).get("successes", 0) != len(runs):
+            errors.append(f"{g_name}: successes {g['successes']} != {len(runs)} missions")
+        if g["xp_gained"] - legacy_ranking.get(g_name, {}).get("xp", 0) != sum(b["xp_gained"] for b in runs):
+            errors.append(f"{g_name}: xp_gained does not match the rewards handed out")
+
+    for wallet in wallets:
+        runs = [job for job, _ in ok if job[0] == wallet]
+        if len(runs) != 5:
+            errors.append(f"{wallet}: {len(runs)} successful missions, expected 5")
+        player = player_store.get_player(wallet)
+        for hero in player["heroes"]:
+            gained = sum(b["xp_gained"] for job, b in ok if job[0] == wallet and job[1] == hero["token_id"])
+            if hero["dynamic_state"]["xp_total"] != DEMO_START_XP[hero["token_id"]] + gained:
+                errors.append(f"{wallet}/{hero['token_id']}: xp {hero['dynamic_state']['xp_total']} lost updates")
+
+    print(json.dumps({
+        "requests": len(results),
+        "successes": len(ok),
+        "processes": args.processes,
+        "threads": args.threads,
+        "backend": args.backend,
+        "errors": errors[:20],
+    }, indent=2))
+
+    if not args.keep:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()